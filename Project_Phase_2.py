@@ -7,7 +7,20 @@
 
 ## Dyanamic Inventory Management System
 ## This program will allow end users to perform CRUD operations on products and categories
-from datetime import datetime
+from bisect import bisect_left, bisect_right, insort
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import ExitStack, contextmanager
+from heapq import heapify, heappop, heappush, heappushpop, nlargest, nsmallest
+import csv
+import functools
+import itertools
+import json
+import math
+import re
+import sys
+import threading
 import time
 
 
@@ -15,6 +28,9 @@ import time
 # A category has unique id assigned to it
 # A category has a name and the status can be active or inactive i.e, true or false
 class Category:
+    # Fixed attribute slots instead of a per instance __dict__ to save memory
+    __slots__ = ("category_id", "name", "status")
+
     # Constructor to initialize a category class object
     def __init__(self, cagetory_id: int, name: str, status: bool = True):
         self.category_id = cagetory_id
@@ -35,9 +51,106 @@ class Category:
         return f"Category ({self.category_id}), Name {self.name}, Current Status {'Active' if self.status else 'Inactive'}"
 
 
+# Defining class PriceHistory
+# The prices of a product over time, kept as two parallel arrays of
+# epoch seconds and prices so they take 8 bytes each instead of a tuple per change
+# Timestamps are always ascending so lookups by time use binary search
+class PriceHistory:
+    __slots__ = ("timestamps", "prices")
+
+    # Constructor to initialize the history with the first price
+    def __init__(self, timestamp: float, price: float):
+        self.timestamps = array("d", [timestamp])
+        self.prices = array("d", [price])
+
+    # Build a history from existing arrays of timestamps and prices, e.g. read from a file
+    @classmethod
+    def from_arrays(cls, timestamps: array, prices: array):
+        history = cls.__new__(cls)
+        history.timestamps = timestamps
+        history.prices = prices
+        return history
+
+    # Record a new price, a clock going backwards never breaks the ordering
+    def append(self, timestamp: float, price: float):
+        self.timestamps.append(max(timestamp, self.timestamps[-1]))
+        self.prices.append(price)
+
+    # Price in effect at the passed in time, None if it is before the first entry
+    def price_at(self, timestamp: float):
+        position = bisect_right(self.timestamps, timestamp)
+        return self.prices[position - 1] if position else None
+
+    # List of (epoch seconds, price) changes between start and end (both inclusive)
+    def between(self, start: float, end: float):
+        lo = bisect_left(self.timestamps, start)
+        hi = bisect_right(self.timestamps, end)
+        return list(zip(self.timestamps[lo:hi], self.prices[lo:hi]))
+
+    # Number of prices in the history
+    def __len__(self):
+        return len(self.timestamps)
+
+    # Iterate the history as (epoch seconds, price)
+    def __iter__(self):
+        return zip(self.timestamps, self.prices)
+
+
+# Defining class PriceHistoryPolicy
+# Optional limits that keep the price history of often repriced products small
+#   min_interval: a price that lasted less than this many seconds is replaced by the next one
+#   max_age: changes older than this many seconds are dropped, except the last one
+#            before the cutoff so the price at the cutoff is still known
+#   max_entries: only this many of the latest changes are kept
+class PriceHistoryPolicy:
+    # Constructor to initialize the policy, None means no limit
+    def __init__(
+        self, min_interval: float = None, max_age: float = None, max_entries: int = None
+    ):
+        self.min_interval = min_interval
+        self.max_age = max_age
+        self.max_entries = max_entries
+
+    # Apply the limits after a new price was appended to the history
+    def apply(self, history: PriceHistory, now: float):
+        timestamps, prices = history.timestamps, history.prices
+
+        # The first entry is the price when added, it is never merged away
+        if (
+            self.min_interval is not None
+            and len(timestamps) >= 3
+            and timestamps[-1] - timestamps[-2] < self.min_interval
+        ):
+            del timestamps[-2]
+            del prices[-2]
+
+        if self.max_age is not None:
+            cutoff = bisect_right(timestamps, now - self.max_age) - 1
+            if cutoff > 0:
+                del timestamps[:cutoff]
+                del prices[:cutoff]
+
+        if self.max_entries is not None and len(timestamps) > self.max_entries:
+            extra = len(timestamps) - self.max_entries
+            del timestamps[:extra]
+            del prices[:extra]
+
+
 # Defining class Product
 # A product has id, name, description, quantity and belongs to the category
 class Product:
+    # Fixed attribute slots instead of a per instance __dict__ to save memory
+    __slots__ = (
+        "product_id",
+        "name",
+        "price",
+        "description",
+        "category",
+        "quantity",
+        "created_at",
+        "_price_history",
+    )
+
     # Constructor to initialize the product class
     def __init__(
         self,
@@ -54,9 +167,34 @@ class Product:
         self.description = description
         self.category = category
         self.quantity = quantity
-        self.price_history = [(datetime.now(), price)]  # a list of price history
+        self.created_at = time.time()  # epoch seconds when the product was added
+        # The price history is only allocated once the price changes
+        self._price_history = None
+
+    # Price history as a list of (epoch seconds, price)
+    # The first entry is the price the product was added with
+    @property
+    def price_history(self):
+        if self._price_history is None:
+            return [(self.created_at, self.price)]
+        return list(self._price_history)
+
+    # Price of the product at the passed in epoch seconds
+    # None if the product was not added yet at that time
+    def price_at(self, timestamp: float):
+        if self._price_history is None:
+            return self.price if timestamp >= self.created_at else None
+        return self._price_history.price_at(timestamp)
+
+    # Price changes between start and end epoch seconds (both inclusive)
+    def price_history_between(self, start: float, end: float):
+        if self._price_history is None:
+            history = PriceHistory(self.created_at, self.price)
+            return history.between(start, end)
+        return self._price_history.between(start, end)
 
     # A function to update product information
+    # timestamp is the epoch seconds recorded for a price change, defaults to now
     def update(
         self,
         name: str = None,
@@ -64,14 +202,19 @@ class Product:
         description: str = None,
         category: Category = None,
         quantity: int = None,
+        timestamp: float = None,
     ):
         if name:
             self.name = name
         # Only if the passed in price is not equal to old price
         if price is not None and price != self.price:
+            if self._price_history is None:
+                self._price_history = PriceHistory(self.created_at, self.price)
             self.price = price
-            # Append the new price in the price history list
-            self.price_history.append((datetime.now(), price))
+            # Append the new price in the price history
+            self._price_history.append(
+                time.time() if timestamp is None else timestamp, price
+            )
         if description:
             self.description = description
         if category:
@@ -83,22 +226,2394 @@ class Product:
     def increaseQuantity(self, increaseBy: int):
         self.quantity += increaseBy
 
-    # A function to decrease quantity
-    def decreaseQuantity(self, increaseBy: int):
-        self.quantity -= increaseBy
+    # A function to decrease quantity
+    def decreaseQuantity(self, increaseBy: int):
+        self.quantity -= increaseBy
+
+    # A function to print the product class
+    def __repr__(self):
+        return f"Product Id: {self.product_id}, Product Price: {self.price}, Product Name: {self.name}, Description: {self.description}, Quantity: {self.quantity}, Category:{self.category.name}"
+
+
+# Defining class SortedIndex
+# A sorted container used by the inventory to answer range queries
+# Items are kept in a list of small sorted lists (like the leaves of a B-tree)
+# so an insert or delete only shifts one small list instead of the whole index
+# Lookups binary search the largest item of every small list and then inside that list
+class SortedIndex:
+    # A small list is split in two once it grows past twice this size
+    LOAD = 512
+
+    # Constructor to initialize the index, optionally from an unsorted iterable
+    def __init__(self, items=None):
+        values = sorted(items) if items else []
+        self._lists = [
+            values[i : i + self.LOAD] for i in range(0, len(values), self.LOAD)
+        ]
+        self._maxes = [chunk[-1] for chunk in self._lists]
+        self._len = len(values)
+
+    # Add an item keeping the index sorted
+    def add(self, item):
+        if not self._maxes:
+            self._lists.append([item])
+            self._maxes.append(item)
+        else:
+            pos = bisect_right(self._maxes, item)
+            # Item is larger than everything, append it to the last list
+            if pos == len(self._maxes):
+                pos -= 1
+                self._lists[pos].append(item)
+                self._maxes[pos] = item
+            else:
+                insort(self._lists[pos], item)
+
+            # Split the small list when it grows too big
+            values = self._lists[pos]
+            if len(values) > 2 * self.LOAD:
+                half = values[self.LOAD :]
+                del values[self.LOAD :]
+                self._maxes[pos] = values[-1]
+                self._lists.insert(pos + 1, half)
+                self._maxes.insert(pos + 1, half[-1])
+        self._len += 1
+
+    # Remove an item from the index, raise error if it is not present
+    def remove(self, item):
+        pos = bisect_left(self._maxes, item)
+        if pos == len(self._maxes):
+            raise ValueError(f"{item} is not in the index")
+
+        values = self._lists[pos]
+        idx = bisect_left(values, item)
+        if values[idx] != item:
+            raise ValueError(f"{item} is not in the index")
+
+        del values[idx]
+        self._len -= 1
+        # Drop empty lists so the maxes list stays small
+        if not values:
+            del self._lists[pos]
+            del self._maxes[pos]
+        elif idx == len(values):
+            self._maxes[pos] = values[-1]
+
+    # Positions (start list, start index, end list, end index) of the items between
+    # minimum and maximum, the end index is right after the last item in the range
+    # None when no item is in the range
+    def _locate(self, minimum, maximum):
+        if not self._maxes:
+            return None
+
+        # Find the position of the first item in the range
+        if minimum is None:
+            start_pos, start_idx = 0, 0
+        else:
+            start_pos = bisect_left(self._maxes, minimum)
+            if start_pos == len(self._maxes):
+                return None
+            start_idx = bisect_left(self._lists[start_pos], minimum)
+
+        # Find the position right after the last item in the range
+        if maximum is None:
+            end_pos = len(self._maxes) - 1
+            end_idx = len(self._lists[end_pos])
+        else:
+            end_pos = bisect_right(self._maxes, maximum)
+            if end_pos == len(self._maxes):
+                end_pos -= 1
+                end_idx = len(self._lists[end_pos])
+            else:
+                end_idx = bisect_right(self._lists[end_pos], maximum)
+        return start_pos, start_idx, end_pos, end_idx
+
+    # Return a generator over the items between minimum and maximum (both inclusive)
+    # Passing None for a bound leaves that side of the range open
+    def irange(self, minimum=None, maximum=None, reverse: bool = False):
+        located = self._locate(minimum, maximum)
+        if located is None:
+            return
+        start_pos, start_idx, end_pos, end_idx = located
+
+        positions = range(start_pos, end_pos + 1)
+        for pos in reversed(positions) if reverse else positions:
+            values = self._lists[pos]
+            lo = start_idx if pos == start_pos else 0
+            hi = end_idx if pos == end_pos else len(values)
+            if reverse:
+                yield from reversed(values[lo:hi])
+            else:
+                yield from values[lo:hi]
+
+    # Number of items between minimum and maximum (both inclusive) without visiting them
+    # Only adds up the lengths of the small lists in the range
+    def count(self, minimum=None, maximum=None) -> int:
+        if minimum is None and maximum is None:
+            return self._len
+        located = self._locate(minimum, maximum)
+        if located is None:
+            return 0
+        start_pos, start_idx, end_pos, end_idx = located
+        if start_pos > end_pos:
+            return 0
+        if start_pos == end_pos:
+            return max(end_idx - start_idx, 0)
+        return (
+            len(self._lists[start_pos])
+            - start_idx
+            + sum(len(values) for values in self._lists[start_pos + 1 : end_pos])
+            + end_idx
+        )
+
+    # Number of items in the index
+    def __len__(self):
+        return self._len
+
+    # Iterate all items in sorted order
+    def __iter__(self):
+        for values in self._lists:
+            yield from values
+
+
+# Defining class TrigramIndex
+# An inverted index from every 3 character piece (trigram) of a lowercase name
+# to the ids having that piece, used for case insensitive substring search
+# Names are lowercased like the scans of search_product_by_name do, so the
+# index finds exactly what a scan finds
+# A name containing the searched text must contain all of its trigrams, so the
+# candidates are the intersection of those posting sets, which are then verified
+class TrigramIndex:
+    # Constructor to initialize an empty index
+    def __init__(self):
+        self._postings = {}  # trigram -> set of ids
+        self._names = {}  # id -> lowercase name
+
+    # Split the text in its unique trigrams
+    @staticmethod
+    def trigrams(text: str) -> set:
+        return {text[i : i + 3] for i in range(len(text) - 2)}
+
+    # Add or replace the name of an id
+    def add(self, key_id, name: str):
+        if key_id in self._names:
+            self.remove(key_id)
+
+        folded = name.lower()
+        self._names[key_id] = folded
+        for trigram in self.trigrams(folded):
+            self._postings.setdefault(trigram, set()).add(key_id)
+
+    # Remove an id from the index if present
+    def remove(self, key_id):
+        folded = self._names.pop(key_id, None)
+        if folded is None:
+            return
+
+        for trigram in self.trigrams(folded):
+            posting = self._postings[trigram]
+            posting.discard(key_id)
+            if not posting:
+                del self._postings[trigram]
+
+    # Return the ids, in ascending order, whose name contains the text ignoring case
+    def search(self, text: str) -> list:
+        folded = text.lower()
+        # Text shorter than a trigram can't use the postings, check the cached names
+        if len(folded) < 3:
+            return sorted(
+                key_id for key_id, name in self._names.items() if folded in name
+            )
+
+        # Start from the smallest posting set to keep the intersection cheap
+        postings = []
+        for trigram in self.trigrams(folded):
+            posting = self._postings.get(trigram)
+            if not posting:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        candidates = postings[0].intersection(*postings[1:])
+
+        # Trigrams can match out of order, so verify the actual substring
+        return sorted(
+            key_id for key_id in candidates if folded in self._names[key_id]
+        )
+
+    # Upper bound of the number of ids search(text) returns, without searching
+    # It is the size of the smallest posting set of the text's trigrams
+    def estimate(self, text: str) -> int:
+        folded = text.lower()
+        if len(folded) < 3:
+            return len(self._names)
+        return min(
+            len(self._postings.get(trigram, ())) for trigram in self.trigrams(folded)
+        )
+
+    # Lowercase name of the id, None if it is not in the index
+    def folded_name(self, key_id):
+        return self._names.get(key_id)
+
+
+# Defining class FuzzyIndex
+# A typo tolerant index over the words of names (symmetric delete, like SymSpell)
+# Every word is stored under each variant of it with up to max_distance letters
+# deleted. Two words within that edit distance share such a variant, so the words
+# similar to a searched word are found with a few dict lookups of the searched
+# word's variants instead of comparing it with every word, and are then verified
+# with the real edit distance. Only the first PREFIX letters make the variants,
+# which keeps their number small for long words.
+# Memory depends on the number of distinct words, not on the number of names.
+# Words made only of digits (e.g. sizes or ids) are not indexed.
+class FuzzyIndex:
+    PREFIX = 7
+
+    # Constructor to initialize an empty index
+    def __init__(self, max_distance: int = 2):
+        self.max_distance = max_distance
+        self._variants = {}  # variant -> word, or set of words when more share it
+        self._postings = {}  # word -> ids having it, a dict used as an ordered set
+        self._words = {}  # id -> words of its name
+
+    # The casefolded words of a name, without duplicates or words of digits only
+    @staticmethod
+    def words(name: str) -> tuple:
+        return tuple(
+            dict.fromkeys(
+                word
+                for word in re.findall(r"\w+", name.casefold())
+                if not word.isdigit()
+            )
+        )
+
+    # Edits allowed for a searched word: none up to 3 letters, one up to 6, then two
+    # so short words don't match nearly everything
+    def allowed_distance(self, word: str) -> int:
+        return min(self.max_distance, (len(word) - 1) // 3)
+
+    # Edit distance counting insert, delete, replace and swap of neighbours
+    # (optimal string alignment), or limit + 1 once it is known to be more than limit
+    @staticmethod
+    def distance(first: str, second: str, limit: int) -> int:
+        if abs(len(first) - len(second)) > limit:
+            return limit + 1
+        if first == second:
+            return 0
+
+        previous_row = None
+        row = list(range(len(second) + 1))
+        for i in range(1, len(first) + 1):
+            before, previous_row = previous_row, row
+            row = [i] + [0] * len(second)
+            for j in range(1, len(second) + 1):
+                cost = first[i - 1] != second[j - 1]
+                value = min(
+                    previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + cost
+                )
+                if (
+                    i > 1
+                    and j > 1
+                    and first[i - 1] == second[j - 2]
+                    and first[i - 2] == second[j - 1]
+                ):
+                    value = min(value, before[j - 2] + 1)
+                row[j] = value
+            if min(row) > limit:
+                return limit + 1
+        return row[-1] if row[-1] <= limit else limit + 1
+
+    # The word and every variant of its prefix with up to distance letters deleted
+    def variants(self, word: str, distance: int) -> set:
+        prefix = word[: self.PREFIX]
+        found = {word, prefix}
+        level = {prefix}
+        for _ in range(distance):
+            level = {
+                variant[:i] + variant[i + 1 :]
+                for variant in level
+                for i in range(len(variant))
+            }
+            found |= level
+        return found
+
+    # Add or replace the name of an id
+    def add(self, key_id, name: str):
+        if key_id in self._words:
+            self.remove(key_id)
+
+        # Names share the word strings instead of each keeping its own copies
+        words = tuple(sys.intern(word) for word in self.words(name))
+        self._words[key_id] = words
+        for word in words:
+            posting = self._postings.get(word)
+            if posting is None:
+                posting = self._postings[word] = {}
+                for variant in self.variants(word, self.max_distance):
+                    shared = self._variants.get(variant)
+                    if shared is None:
+                        self._variants[variant] = word
+                    elif isinstance(shared, set):
+                        shared.add(word)
+                    else:
+                        self._variants[variant] = {shared, word}
+            posting[key_id] = None
+
+    # Remove an id from the index if present
+    def remove(self, key_id):
+        words = self._words.pop(key_id, None)
+        if words is None:
+            return
+
+        for word in words:
+            posting = self._postings[word]
+            del posting[key_id]
+            if posting:
+                continue
+            # No name has the word any more
+            del self._postings[word]
+            for variant in self.variants(word, self.max_distance):
+                shared = self._variants[variant]
+                if not isinstance(shared, set):
+                    del self._variants[variant]
+                else:
+                    shared.discard(word)
+                    if len(shared) == 1:
+                        self._variants[variant] = shared.pop()
+
+    # Indexed words within the allowed edit distance of word, as {word: distance}
+    def similar(self, word: str) -> dict:
+        allowed = self.allowed_distance(word)
+        candidates = set()
+        for variant in self.variants(word, allowed):
+            shared = self._variants.get(variant)
+            if shared is None:
+                continue
+            if isinstance(shared, set):
+                candidates |= shared
+            else:
+                candidates.add(shared)
+
+        similar = {}
+        for candidate in candidates:
+            distance = self.distance(word, candidate, allowed)
+            if distance <= allowed:
+                similar[candidate] = distance
+        return similar
+
+    # Sum of the distances of the searched words to the closest word of the id,
+    # None if a searched word is not close to any of them
+    @staticmethod
+    def score(matches, words) -> int:
+        total = 0
+        for similar in matches:
+            best = min(
+                (similar[word] for word in words if word in similar), default=None
+            )
+            if best is None:
+                return None
+            total += best
+        return total
+
+    # Return up to limit ids whose name has a word close to every word of the text,
+    # the smallest total edit distance first
+    def search(self, text: str, limit: int = 10) -> list:
+        matches = [self.similar(word) for word in self.words(text)]
+        if not matches or not all(matches) or limit <= 0:
+            return []
+
+        # Go through the ids of the searched word with the fewest of them,
+        # closest words first, and check the other searched words on each id
+        sizes = [
+            sum(len(self._postings[word]) for word in similar) for similar in matches
+        ]
+        driver = matches.pop(sizes.index(min(sizes)))
+        # The other searched words add at least their smallest distance to any score
+        rest_at_least = sum(min(similar.values()) for similar in matches)
+
+        best = []  # max heap of (-score, -order, id) holding the limit best ids
+        seen = set()
+        order = 0
+        for word, word_distance in sorted(driver.items(), key=lambda item: item[::-1]):
+            # Ids found later score at least this and have a larger order, so none
+            # of them can beat a full heap whose worst score is already at most that
+            lowest = word_distance + rest_at_least
+            if len(best) == limit and -best[0][0] <= lowest:
+                break
+            for key_id in self._postings[word]:
+                if len(best) == limit and -best[0][0] <= lowest:
+                    break
+                if key_id in seen:
+                    continue
+                seen.add(key_id)
+                words = self._words[key_id]
+                rest = self.score(matches, words)
+                if rest is None:
+                    continue
+                score = self.score([driver], words) + rest
+                order += 1
+                item = (-score, -order, key_id)
+                if len(best) < limit:
+                    heappush(best, item)
+                elif item > best[0]:
+                    heappushpop(best, item)
+
+        return [key_id for _, _, key_id in sorted(best, reverse=True)]
+
+
+# Defining class TrieNode
+# A node of the PrefixIndex, its label is the text on the edge leading to it
+class TrieNode:
+    # Fixed attribute slots instead of a per instance __dict__ to save memory
+    __slots__ = ("label", "children", "ids", "size", "top")
+
+    def __init__(self, label: str):
+        self.label = label
+        self.children = None  # first letter of the child's label -> child
+        self.ids = None  # ids of the names ending here, a list as names rarely repeat
+        self.size = 0  # number of names in the subtree
+        self.top = None  # best TOP entries of the subtree once it has more than TOP
+
+
+# Defining class PrefixIndex
+# A compressed trie (radix tree) over casefolded names for type ahead completion
+# Names are ranked by a score, e.g. the quantity in stock, and then by name
+# Every node with more than TOP names below it keeps its TOP best entries,
+# so completing a prefix walks the prefix and reads one list, however many names
+# start with it. A changed score only touches the nodes on the path of its name.
+class PrefixIndex:
+    TOP = 10
+
+    # Constructor to initialize an empty index
+    def __init__(self):
+        self._root = TrieNode("")
+        # id -> (-score, casefolded name, id), the sort entry shared by every top list
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    # Add or replace the name of an id with its score
+    def add(self, key_id, name: str, score=0):
+        with self._lock:
+            if key_id in self._entries:
+                self._remove(key_id)
+            folded = name.casefold()
+            entry = self._entries[key_id] = (-score, folded, key_id)
+
+            node = self._root
+            path = [node]
+            rest = folded
+            while rest:
+                if node.children is None:
+                    node.children = {}
+                child = node.children.get(rest[0])
+                if child is None:
+                    child = node.children[rest[0]] = TrieNode(rest)
+                    path.append(child)
+                    node, rest = child, ""
+                    break
+
+                label = child.label
+                if rest.startswith(label):
+                    path.append(child)
+                    node, rest = child, rest[len(label) :]
+                    continue
+
+                # Split the edge where the name leaves the label
+                common = 1
+                while common < len(rest) and label[common] == rest[common]:
+                    common += 1
+                middle = TrieNode(label[:common])
+                child.label = label[common:]
+                middle.children = {child.label[0]: child}
+                middle.size = child.size
+                middle.top = None if child.top is None else list(child.top)
+                node.children[rest[0]] = middle
+                path.append(middle)
+                node, rest = middle, rest[common:]
+
+            if node.ids is None:
+                node.ids = []
+            node.ids.append(key_id)
+            for node in path:
+                node.size += 1
+                if node.top is not None:
+                    self._offer(node.top, entry)
+                elif node.size > self.TOP:
+                    node.top = sorted(self._scan(node))[: self.TOP]
+
+    # Remove an id from the index if present
+    def remove(self, key_id):
+        with self._lock:
+            if key_id in self._entries:
+                self._remove(key_id)
+
+    # Change the score of an id
+    def set_score(self, key_id, score):
+        with self._lock:
+            old_entry = self._entries[key_id]
+            if -old_entry[0] == score:
+                return
+            folded = old_entry[1]
+            entry = self._entries[key_id] = (-score, folded, key_id)
+            # Children first, so a refilled list reads the updated lists below it
+            for node in reversed(self._path(folded)):
+                top = node.top
+                if top is None:
+                    continue
+                last = top[-1]
+                if old_entry <= last:
+                    del top[bisect_left(top, old_entry)]
+                    if entry < last:
+                        insort(top, entry)
+                    else:
+                        # The entry dropped out and the next best is not known here
+                        node.top = self._best_of(node)
+                elif entry < last:
+                    self._offer(top, entry)
+
+    # Up to limit ids whose name starts with the prefix, best score first
+    # Up to TOP completions are read from the cached lists, more scan the subtree
+    def complete(self, prefix: str, limit: int = 10) -> list:
+        with self._lock:
+            node = self._root
+            rest = prefix.casefold()
+            while rest:
+                child = node.children.get(rest[0]) if node.children else None
+                if child is None:
+                    return []
+                label = child.label
+                if len(rest) <= len(label):
+                    if not label.startswith(rest):
+                        return []
+                    node, rest = child, ""
+                elif rest.startswith(label):
+                    node, rest = child, rest[len(label) :]
+                else:
+                    return []
+
+            if node.top is not None and limit <= self.TOP:
+                entries = node.top[:limit]
+            else:
+                entries = nsmallest(limit, self._scan(node))
+            return [key_id for _, _, key_id in entries]
+
+    # Remove an id, the caller holds the lock
+    def _remove(self, key_id):
+        entry = self._entries.pop(key_id)
+        path = self._path(entry[1])
+        node = path[-1]
+        node.ids.remove(key_id)
+        if not node.ids:
+            node.ids = None
+
+        for node in reversed(path):
+            node.size -= 1
+            if node.top is None:
+                continue
+            if node.size <= self.TOP:
+                node.top = None
+            elif entry <= node.top[-1]:
+                node.top = self._best_of(node)
+
+        # Drop emptied nodes and merge a node left with one child into it,
+        # so every node still branches or ends a name
+        for parent, node in zip(reversed(path[:-1]), reversed(path[1:])):
+            if node.size == 0:
+                del parent.children[node.label[0]]
+                if not parent.children:
+                    parent.children = None
+            elif node.ids is None and node.children and len(node.children) == 1:
+                (child,) = node.children.values()
+                child.label = node.label + child.label
+                parent.children[child.label[0]] = child
+
+    # Nodes from the root to the node where the folded name ends
+    def _path(self, folded: str):
+        node = self._root
+        path = [node]
+        rest = folded
+        while rest:
+            node = node.children[rest[0]]
+            path.append(node)
+            rest = rest[len(node.label) :]
+        return path
+
+    # Add the entry to a top list, keeping only the TOP best entries
+    def _offer(self, top: list, entry):
+        if len(top) < self.TOP:
+            insort(top, entry)
+        elif entry < top[-1]:
+            insort(top, entry)
+            top.pop()
+
+    # Best TOP entries of a node from its own names and the lists of its children
+    def _best_of(self, node: TrieNode):
+        candidates = [self._entries[key_id] for key_id in node.ids or ()]
+        for child in (node.children or {}).values():
+            candidates.extend(
+                child.top if child.top is not None else self._scan(child)
+            )
+        return nsmallest(self.TOP, candidates)
+
+    # Every entry in the subtree of a node
+    def _scan(self, node: TrieNode):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for key_id in node.ids or ():
+                yield self._entries[key_id]
+            if node.children:
+                stack.extend(node.children.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Defining class CategoryStats
+# Product count, total units, stock value (price times quantity) and prices of the
+# products of one category, kept up to date by the inventory on every change so
+# reading them never walks the products
+# The prices are counted in a dict with a min heap and a max heap of them beside it.
+# A price whose count drops to zero stays in the heaps until it reaches the top,
+# where it is popped right away, so the tops are always the current min and max price
+class CategoryStats:
+    # Fixed attribute slots instead of a per instance __dict__ to save memory
+    __slots__ = (
+        "count",
+        "units",
+        "stock_value",
+        "price_total",
+        "_price_counts",
+        "_min_prices",
+        "_max_prices",
+    )
+
+    # Constructor to initialize the stats, optionally from the products of the category
+    def __init__(self, products=()):
+        self.count = 0
+        self.units = 0
+        self.stock_value = 0.0
+        self.price_total = 0.0
+        self._price_counts = {}
+        for product in products:
+            self.count += 1
+            self.units += product.quantity
+            self.stock_value += product.price * product.quantity
+            self.price_total += product.price
+            self._price_counts[product.price] = (
+                self._price_counts.get(product.price, 0) + 1
+            )
+        self._rebuild_heaps()
+
+    # Count a product added to the category
+    def add(self, price: float, quantity: int):
+        self.count += 1
+        self.units += quantity
+        self.stock_value += price * quantity
+        self.price_total += price
+        counts = self._price_counts
+        if price in counts:
+            counts[price] += 1
+        else:
+            counts[price] = 1
+            heappush(self._min_prices, price)
+            heappush(self._max_prices, -price)
+
+    # Stop counting a product that left the category
+    def remove(self, price: float, quantity: int):
+        self.count -= 1
+        self.units -= quantity
+        if self.count:
+            self.stock_value -= price * quantity
+            self.price_total -= price
+        else:
+            # Start again from exact zeros instead of keeping float rounding left overs
+            self.stock_value = 0.0
+            self.price_total = 0.0
+
+        counts = self._price_counts
+        if counts[price] > 1:
+            counts[price] -= 1
+            return
+        del counts[price]
+        min_prices, max_prices = self._min_prices, self._max_prices
+        while min_prices and min_prices[0] not in counts:
+            heappop(min_prices)
+        while max_prices and -max_prices[0] not in counts:
+            heappop(max_prices)
+        # Prices gone from the middle of the heaps are dropped once they are half of them
+        if len(min_prices) > 2 * len(counts) + 32:
+            self._rebuild_heaps()
+
+    # Count a change of quantity of a product in the category
+    def change_quantity(self, price: float, difference: int):
+        self.units += difference
+        self.stock_value += price * difference
+
+    # Build the heaps from the counted prices
+    def _rebuild_heaps(self):
+        self._min_prices = list(self._price_counts)
+        self._max_prices = [-price for price in self._price_counts]
+        heapify(self._min_prices)
+        heapify(self._max_prices)
+
+    # The stats as a dict, prices are None for a category without products
+    def summary(self):
+        has_prices = bool(self._price_counts)
+        return {
+            "count": self.count,
+            "units": self.units,
+            "stock_value": self.stock_value,
+            "min_price": self._min_prices[0] if has_prices else None,
+            "max_price": -self._max_prices[0] if has_prices else None,
+            "average_price": self.price_total / self.count if self.count else None,
+        }
+
+
+# Defining class PriceChange
+# One price change of a product, category_id is the category it was in at the time
+class PriceChange:
+    # Fixed attribute slots instead of a per instance __dict__ to save memory
+    __slots__ = ("timestamp", "product_id", "old_price", "new_price", "category_id")
+
+    def __init__(
+        self,
+        timestamp: float,
+        product_id: int,
+        old_price: float,
+        new_price: float,
+        category_id: int,
+    ):
+        self.timestamp = timestamp
+        self.product_id = product_id
+        self.old_price = old_price
+        self.new_price = new_price
+        self.category_id = category_id
+
+    # Change relative to the old price, 0.1 is 10% more and -0.25 is 25% less
+    # A price going up from 0 is an infinite change
+    @property
+    def relative_change(self) -> float:
+        if self.old_price == 0:
+            return float("inf") if self.new_price > 0 else 0.0
+        return (self.new_price - self.old_price) / self.old_price
+
+    def __repr__(self):
+        return f"Price change of product {self.product_id} at {self.timestamp}: {self.old_price} -> {self.new_price}"
+
+
+# Summary of price changes by category id, with the number of changes, increases
+# and decreases, the number of products repriced and the average relative change
+# (changes up from a price of 0 are left out of the average)
+def summarize_price_changes(changes) -> dict:
+    totals = {}
+    for change in changes:
+        total = totals.get(change.category_id)
+        if total is None:
+            total = totals[change.category_id] = [0, 0, 0, set(), 0.0, 0]
+        total[0] += 1
+        if change.new_price > change.old_price:
+            total[1] += 1
+        elif change.new_price < change.old_price:
+            total[2] += 1
+        total[3].add(change.product_id)
+        relative = change.relative_change
+        if relative != float("inf"):
+            total[4] += relative
+            total[5] += 1
+    return {
+        category_id: {
+            "changes": count,
+            "increases": increases,
+            "decreases": decreases,
+            "products": len(products),
+            "average_change": relative_total / averaged if averaged else None,
+        }
+        for category_id, (
+            count,
+            increases,
+            decreases,
+            products,
+            relative_total,
+            averaged,
+        ) in totals.items()
+    }
+
+
+# Defining class PriceChangeIndex
+# Every price change of the inventory in time order, for repricing reports across
+# the whole catalog. Pass it as Inventory(price_changes=PriceChangeIndex())
+# Changes are kept in a SortedIndex of (timestamp, sequence, change), so a report
+# over a time window only visits the changes in that window, however many
+# products the catalog has. With max_age set, changes older than max_age seconds
+# before the latest one are dropped.
+class PriceChangeIndex:
+    # Constructor to initialize an empty index
+    def __init__(self, max_age: float = None):
+        self.max_age = max_age
+        self._changes = SortedIndex()
+        # Breaks ties between changes made at the same time, in the order added
+        self._sequence = itertools.count()
+        self._latest = None  # timestamp of the latest change
+        # Changes of products in different lock stripes meet here
+        self._lock = threading.Lock()
+
+    # Record a change, dropping the changes that got too old
+    def add(self, change: PriceChange):
+        with self._lock:
+            self._changes.add((change.timestamp, next(self._sequence), change))
+            if self._latest is None or change.timestamp > self._latest:
+                self._latest = change.timestamp
+            if self.max_age is not None:
+                cutoff = (self._latest - self.max_age,)
+                for expired in list(self._changes.irange(None, cutoff)):
+                    self._changes.remove(expired)
+
+    # Changes between start and end epoch seconds (both inclusive), oldest first
+    # Passing None for a bound leaves that side of the window open
+    def between(self, start: float = None, end: float = None):
+        lower = None if start is None else (start,)
+        upper = None if end is None else (end, float("inf"))
+        with self._lock:
+            return [change for _, _, change in self._changes.irange(lower, upper)]
+
+    # Number of changes between start and end without visiting them
+    def count(self, start: float = None, end: float = None) -> int:
+        lower = None if start is None else (start,)
+        upper = None if end is None else (end, float("inf"))
+        with self._lock:
+            return self._changes.count(lower, upper)
+
+    # Number of changes kept
+    def __len__(self):
+        return len(self._changes)
+
+
+# Defining class IndexedHeap
+# A binary min heap of ids ordered by a priority (e.g. the stock of a product)
+# with the position of every id kept in a dict, so the priority of an id can be
+# changed or the id removed in O(log n) instead of searching the heap for it
+class IndexedHeap:
+    # Constructor to build the heap from (id, priority) pairs in O(n)
+    def __init__(self, items=None):
+        self._ids = []
+        self._priorities = []
+        self._positions = {}
+        if items is not None:
+            for key_id, priority in items:
+                self._positions[key_id] = len(self._ids)
+                self._ids.append(key_id)
+                self._priorities.append(priority)
+            for index in reversed(range(len(self._ids) // 2)):
+                self._sift_down(index)
+
+    # Add the id or change its priority
+    def set(self, key_id, priority):
+        index = self._positions.get(key_id)
+        if index is None:
+            index = len(self._ids)
+            self._positions[key_id] = index
+            self._ids.append(key_id)
+            self._priorities.append(priority)
+            self._sift_up(index)
+            return
+
+        old_priority = self._priorities[index]
+        self._priorities[index] = priority
+        if priority < old_priority:
+            self._sift_up(index)
+        elif priority > old_priority:
+            self._sift_down(index)
+
+    # Remove the id, does nothing if it is not in the heap
+    def remove(self, key_id):
+        index = self._positions.pop(key_id, None)
+        if index is None:
+            return
+        last_id = self._ids.pop()
+        last_priority = self._priorities.pop()
+        if index == len(self._ids):
+            return
+
+        # Move the last item into the hole and restore the heap order
+        self._ids[index] = last_id
+        self._priorities[index] = last_priority
+        self._positions[last_id] = index
+        self._sift_up(index)
+        self._sift_down(self._positions[last_id])
+
+    # Priority of the id, None if it is not in the heap
+    def priority(self, key_id):
+        index = self._positions.get(key_id)
+        return None if index is None else self._priorities[index]
+
+    # Yield (id, priority) in ascending priority, stopping after a priority above limit
+    # Walks the heap from the root with a second small heap of the next candidates,
+    # so the cost only depends on the number of items yielded, not on the heap size
+    def smallest(self, limit=None):
+        priorities = self._priorities
+        if not priorities:
+            return
+        candidates = [(priorities[0], 0)]
+        while candidates:
+            priority, index = heappop(candidates)
+            if limit is not None and priority > limit:
+                return
+            yield self._ids[index], priority
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(priorities):
+                    heappush(candidates, (priorities[child], child))
+
+    # Move the item at index up while it is smaller than its parent
+    def _sift_up(self, index: int):
+        ids, priorities, positions = self._ids, self._priorities, self._positions
+        key_id, priority = ids[index], priorities[index]
+        while index > 0:
+            parent = (index - 1) // 2
+            if not priority < priorities[parent]:
+                break
+            ids[index] = ids[parent]
+            priorities[index] = priorities[parent]
+            positions[ids[index]] = index
+            index = parent
+        ids[index] = key_id
+        priorities[index] = priority
+        positions[key_id] = index
+
+    # Move the item at index down while a child is smaller
+    def _sift_down(self, index: int):
+        ids, priorities, positions = self._ids, self._priorities, self._positions
+        size = len(ids)
+        key_id, priority = ids[index], priorities[index]
+        while True:
+            child = 2 * index + 1
+            if child >= size:
+                break
+            if child + 1 < size and priorities[child + 1] < priorities[child]:
+                child += 1
+            if not priorities[child] < priority:
+                break
+            ids[index] = ids[child]
+            priorities[index] = priorities[child]
+            positions[ids[index]] = index
+            index = child
+        ids[index] = key_id
+        priorities[index] = priority
+        positions[key_id] = index
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, key_id):
+        return key_id in self._positions
+
+
+# Defining class TimingWheel
+# Deadlines of many keys (e.g. stock holds) in a hierarchical timing wheel, so
+# scheduling, cancelling and expiring a key take O(1) however many are waiting
+# Time is cut in ticks of tick seconds. Level 0 has a slot for each of the next
+# slots ticks, level 1 a slot for each of the next slots turns of level 0 and so
+# on. A key waits in the lowest level whose turn holds its deadline. When the time
+# reaches a slot of a higher level, its keys move down (cascade), so a key moves
+# at most levels times before it expires. Deadlines past every level wait in an
+# overflow slot until the top level turns. Advancing only visits the slots of the
+# ticks that passed, never the waiting keys, and a key expires at the first
+# advance at or after its deadline, at most a tick late
+class TimingWheel:
+    # Constructor to initialize an empty wheel starting at now (epoch seconds)
+    def __init__(
+        self, tick: float = 1.0, slots: int = 64, levels: int = 4, now: float = None
+    ):
+        if tick <= 0 or slots < 2 or levels < 1:
+            raise ValueError(
+                "Timing wheel needs a positive tick, at least 2 slots and 1 level"
+            )
+        self.tick = tick
+        self.slots = slots
+        self._wheels = [[{} for _ in range(slots)] for _ in range(levels)]
+        self._overflow = {}
+        # Ticks covered by one slot of each level, the last one by a whole top level
+        self._spans = [slots**level for level in range(levels + 1)]
+        # Next tick to expire, every tick before it was already expired
+        self._current = math.floor((time.time() if now is None else now) / tick)
+        self._slot_of = {}  # key -> slot (dict of key -> deadline) holding it
+
+    # Expire the key at deadline (epoch seconds), moving it if it was scheduled
+    def schedule(self, key, deadline: float):
+        self.cancel(key)
+        self._place(key, deadline)
+
+    # Stop waiting for the key, returns False if it was not scheduled
+    def cancel(self, key) -> bool:
+        slot = self._slot_of.pop(key, None)
+        if slot is None:
+            return False
+        del slot[key]
+        return True
+
+    # Put the key in the slot of the lowest level whose turn holds the deadline
+    def _place(self, key, deadline: float):
+        due = max(math.ceil(deadline / self.tick), self._current)
+        spans = self._spans
+        for level, wheel in enumerate(self._wheels):
+            if due // spans[level + 1] == self._current // spans[level + 1]:
+                slot = wheel[due // spans[level] % self.slots]
+                break
+        else:
+            slot = self._overflow
+        slot[key] = deadline
+        self._slot_of[key] = slot
+
+    # Move the time to now (epoch seconds), returns the keys whose deadline passed
+    def advance(self, now: float = None) -> list:
+        target = math.floor((time.time() if now is None else now) / self.tick)
+        expired = []
+        spans = self._spans
+        levels = len(self._wheels)
+        while self._current <= target:
+            # Nothing is waiting, the remaining ticks have nothing to expire
+            if not self._slot_of:
+                self._current = target + 1
+                break
+            current = self._current
+            # Cascade the higher levels first, their keys may land in the
+            # lower slots whose time also came
+            for level in range(levels, 0, -1):
+                if current % spans[level]:
+                    continue
+                if level == levels:
+                    slot = self._overflow
+                else:
+                    slot = self._wheels[level][current // spans[level] % self.slots]
+                if slot:
+                    waiting = list(slot.items())
+                    slot.clear()
+                    for key, deadline in waiting:
+                        self._place(key, deadline)
+
+            slot = self._wheels[0][current % self.slots]
+            if slot:
+                for key in slot:
+                    del self._slot_of[key]
+                expired.extend(slot)
+                slot.clear()
+            self._current = current + 1
+        return expired
+
+    # Deadline of the key, None if it is not scheduled
+    def deadline(self, key):
+        slot = self._slot_of.get(key)
+        return None if slot is None else slot[key]
+
+    # Number of keys waiting
+    def __len__(self):
+        return len(self._slot_of)
+
+    def __contains__(self, key):
+        return key in self._slot_of
+
+
+# Defining class Histogram
+# Counts values (e.g. latencies in nanoseconds) in log-linear buckets like an HDR
+# histogram: every power of two is split in 16 buckets, so a bucket is within about
+# 6% of the values in it. Recording a value is a few integer operations.
+class Histogram:
+    SUB_BUCKETS = 16
+    BUCKETS = 64 * SUB_BUCKETS  # enough for any 64 bit value
+
+    # Constructor to initialize an empty histogram
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    # Bucket of a value, values below 32 have a bucket of their own
+    def bucket(self, value: int) -> int:
+        if value < 2 * self.SUB_BUCKETS:
+            return max(value, 0)
+        shift = value.bit_length() - 5
+        return (shift + 1) * self.SUB_BUCKETS + (value >> shift) - self.SUB_BUCKETS
+
+    # Largest value that falls in the bucket
+    def bucket_high(self, bucket: int) -> int:
+        if bucket < 2 * self.SUB_BUCKETS:
+            return bucket
+        shift = bucket // self.SUB_BUCKETS - 1
+        mantissa = bucket % self.SUB_BUCKETS + self.SUB_BUCKETS
+        return ((mantissa + 1) << shift) - 1
+
+    # Count one value
+    def record(self, value: int):
+        self.counts[self.bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    # Value at the passed in percentile (0-100), reported as the top of its bucket
+    def percentile(self, percent: float) -> int:
+        if not self.count:
+            return 0
+        rank = max(1, round(percent / 100 * self.count))
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.bucket_high(bucket), self.max)
+        return self.max
+
+    # Summary of the recorded values as a dict
+    def summary(self):
+        return {
+            "count": self.count,
+            "min": self.min or 0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max or 0,
+            "mean": self.total / self.count if self.count else 0,
+        }
+
+
+# Defining class MethodStats
+# Calls, errors, latency and result sizes of one instrumented method
+class MethodStats:
+    def __init__(self):
+        self.errors = 0
+        self.latency_ns = Histogram()
+        self.result_sizes = Histogram()
+
+
+# Defining class Instrumentation
+# Records call counts, latency histograms and result sizes of the Inventory methods
+# Turned on with Inventory.enable_instrumentation. The methods are only wrapped
+# while it is on, so an inventory without instrumentation pays nothing for it.
+# exporter is any function taking the snapshot dict, e.g. print_instrumentation_report
+# Only the outermost call of each thread is recorded, so the counts match the calls
+# made from outside, e.g. search_product_by_min_price doesn't also record a
+# search_product_by_price_range
+class Instrumentation:
+    # Constructor to initialize empty stats
+    def __init__(self, exporter=None):
+        self.exporter = exporter
+        self.methods = {}
+        self._calling = threading.local()
+
+    # Return a function that calls method and records the call under name
+    def wrap(self, name: str, method):
+        stats = self.methods.setdefault(name, MethodStats())
+        clock = time.perf_counter_ns
+        calling = self._calling
+
+        @functools.wraps(method)
+        def instrumented(*args, **kwargs):
+            # Called by another instrumented method, which records the time
+            if getattr(calling, "active", False):
+                return method(*args, **kwargs)
+            calling.active = True
+            start = clock()
+            try:
+                result = method(*args, **kwargs)
+            except Exception:
+                stats.errors += 1
+                raise
+            finally:
+                stats.latency_ns.record(clock() - start)
+                calling.active = False
+            if isinstance(result, (list, dict, set, tuple)):
+                stats.result_sizes.record(len(result))
+            return result
+
+        return instrumented
+
+    # Stats of every method that was called, as a dict that can be saved as JSON
+    def snapshot(self):
+        return {
+            name: {
+                "calls": stats.latency_ns.count,
+                "errors": stats.errors,
+                "latency_ns": stats.latency_ns.summary(),
+                "result_size": stats.result_sizes.summary(),
+            }
+            for name, stats in self.methods.items()
+            if stats.latency_ns.count
+        }
+
+    # Forget every recorded call
+    def reset(self):
+        for stats in self.methods.values():
+            stats.errors = 0
+            stats.latency_ns = Histogram()
+            stats.result_sizes = Histogram()
+
+    # Send the snapshot to the exporter, optionally starting a new period
+    def export(self, reset: bool = False):
+        snapshot = self.snapshot()
+        if self.exporter is not None:
+            self.exporter(snapshot)
+        if reset:
+            self.reset()
+        return snapshot
+
+
+# Exporter printing one line per instrumented method
+def print_instrumentation_report(snapshot):
+    print(f"{'Method':<36} {'Calls':>8} {'Errors':>7} {'p50 us':>9} {'p99 us':>9} {'Avg size':>9}")
+    for name, stats in sorted(snapshot.items()):
+        latency = stats["latency_ns"]
+        print(
+            f"{name:<36} {stats['calls']:>8} {stats['errors']:>7} "
+            f"{latency['p50'] / 1e3:>9.1f} {latency['p99'] / 1e3:>9.1f} "
+            f"{stats['result_size']['mean']:>9.1f}"
+        )
+
+
+# Defining class JsonLinesExporter
+# Exporter appending every snapshot as one JSON line to a file
+class JsonLinesExporter:
+    def __init__(self, path: str):
+        self.path = path
+
+    def __call__(self, snapshot):
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps({"time": time.time(), "methods": snapshot}) + "\n")
+
+
+# Defining class StripedLock
+# A fixed set of locks picked by the hash of a key (lock striping)
+# Changes to different products rarely wait on each other, unlike with one global lock
+class StripedLock:
+    # Constructor to initialize the stripes
+    def __init__(self, stripes: int = 64):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    # The lock guarding the key
+    def lock_for(self, key) -> threading.Lock:
+        return self._locks[hash(key) % len(self._locks)]
+
+    # The locks guarding all the keys, always in the same order so that two
+    # callers locking overlapping keys can't deadlock
+    def locks_for(self, keys):
+        count = len(self._locks)
+        stripes = set()
+        for key in keys:
+            stripes.add(hash(key) % count)
+            # Every stripe is already needed, e.g. for a count of the whole catalog
+            if len(stripes) == count:
+                break
+        return [self._locks[stripe] for stripe in sorted(stripes)]
+
+
+# Defining class QueryCache
+# Least recently used cache of the results of the Inventory search methods
+# Every result is stored with the generations of the indexes it was read from
+# (e.g. the price index or one category) and is only served while none of them changed
+# max_entries bounds the number of results, max_items the products held by all of them
+# A cache belongs to one inventory, pass it as Inventory(query_cache=QueryCache())
+class QueryCache:
+    # Constructor to initialize an empty cache
+    def __init__(self, max_entries: int = 1024, max_items: int = None):
+        self.max_entries = max_entries
+        self.max_items = max_items
+        self._entries = OrderedDict()
+        self._items = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    # Cached result of key if it was read at these versions, otherwise None
+    def get(self, key, versions):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == versions:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+            if entry is not None:
+                # Something the result was read from changed since, never serve it
+                del self._entries[key]
+                self._items -= len(entry[1])
+                self.stale += 1
+            return None
+
+    # Store the result (a tuple) of key read at these versions
+    # Drops the least recently used results until the cache is within its bounds
+    def put(self, key, versions, result: tuple):
+        if self.max_items is not None and len(result) > self.max_items:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._items -= len(old[1])
+            self._entries[key] = (versions, result)
+            self._items += len(result)
+            while len(self._entries) > self.max_entries or (
+                self.max_items is not None and self._items > self.max_items
+            ):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._items -= len(evicted)
+                self.evictions += 1
+
+    # Drop every cached result, the stats are kept
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._items = 0
+
+    # Hit and miss counts and the current size of the cache
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "items": self._items,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Decorator caching the results of an Inventory search method in its query_cache
+# dependencies are the generation keys the result is read from, either a tuple
+# or a function of (inventory, *args) returning them
+# The versions are read before searching, so a change made during the search
+# makes the stored result stale instead of hiding the change
+def cached_search(dependencies):
+    def decorator(method):
+        name = method.__name__
+
+        @functools.wraps(method)
+        def search(self, *args, **kwargs):
+            cache = self.query_cache
+            if cache is None:
+                return method(self, *args, **kwargs)
+
+            key = (name, args, tuple(sorted(kwargs.items())))
+            keys = (
+                dependencies(self, *args, **kwargs)
+                if callable(dependencies)
+                else dependencies
+            )
+            generations = self._generations
+            versions = tuple(generations.get(dependency, 0) for dependency in keys)
+            result = cache.get(key, versions)
+            if result is None:
+                result = tuple(method(self, *args, **kwargs))
+                cache.put(key, versions, result)
+            # A new list every call so callers can't change the cached result
+            return list(result)
+
+        return search
+
+    return decorator
+
+
+# Defining class ChangeEvent
+# One change made to the inventory, as recorded by a ChangeLog
+# kind is the name of the change: add_product, update_product,
+# increase_product_quantity, decrease_product_quantity, set_reorder_threshold,
+# add_new_category, update_category or delete_category (reserve and commit_hold
+# record a decrease_product_quantity for each product, change_quantities an increase or
+# decrease for each change made and reconcile_counts an update_product for each
+# quantity it set). entity_id is the product or category id.
+# changes holds {field: (old value, new value)} of the changed fields only,
+# old values are None for an added product or category and new values None for
+# a deleted category
+class ChangeEvent:
+    # Fixed attribute slots instead of a per instance __dict__ to save memory
+    __slots__ = ("sequence", "kind", "entity_id", "changes", "timestamp")
+
+    def __init__(
+        self, sequence: int, kind: str, entity_id, changes: dict, timestamp: float
+    ):
+        self.sequence = sequence
+        self.kind = kind
+        self.entity_id = entity_id
+        self.changes = changes
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return f"Change {self.sequence}: {self.kind} {self.entity_id} {self.changes}"
+
+
+# Changes of a newly added product, every field going from None to its value
+def added_changes(product: Product) -> dict:
+    return {
+        "name": (None, product.name),
+        "price": (None, product.price),
+        "description": (None, product.description),
+        "category_id": (None, product.category.category_id),
+        "quantity": (None, product.quantity),
+    }
+
+
+# Defining class ChangeLog
+# The latest changes of an inventory in a ring buffer of capacity events, for
+# consumers that want what changed instead of rescanning the inventory
+# Pass it as Inventory(change_log=ChangeLog()) and read it through subscriptions
+# Every event gets the next sequence number. A subscription's cursor is the
+# sequence number of the next event it reads, so a consumer that saves the cursor
+# can subscribe again from it later, as long as that event is still kept.
+# When the buffer is full, a change waits up to max_wait seconds for the slowest
+# subscription to read the oldest event (backpressure). After that the oldest event
+# is overwritten and that subscription can no longer continue from its cursor.
+class ChangeLog:
+    # Constructor to initialize an empty log
+    def __init__(self, capacity: int = 65536, max_wait: float = 1.0):
+        if capacity < 1:
+            raise ValueError("Change log capacity must be at least 1")
+        self.capacity = capacity
+        self.max_wait = max_wait
+        self._events = [None] * capacity
+        self._next = 0  # sequence number of the next event
+        self._subscriptions = set()
+        self._condition = threading.Condition()
+        self.waits = 0  # changes that had to wait for a subscription
+        self.overwritten = 0  # events overwritten before every subscription read them
+
+    # Sequence number of the oldest event still kept
+    @property
+    def oldest(self) -> int:
+        return max(0, self._next - self.capacity)
+
+    # Sequence number the next event will get
+    @property
+    def next_sequence(self) -> int:
+        return self._next
+
+    # Record a change, waiting for room when a subscription is behind
+    def append(self, kind: str, entity_id, changes: dict):
+        with self._condition:
+            deadline = None
+            while self._next >= self.capacity and self._unread(
+                self._next - self.capacity
+            ):
+                if deadline is None:
+                    self.waits += 1
+                    deadline = time.monotonic() + self.max_wait
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.overwritten += 1
+                    break
+                self._condition.wait(remaining)
+
+            sequence = self._next
+            self._events[sequence % self.capacity] = ChangeEvent(
+                sequence, kind, entity_id, changes, time.time()
+            )
+            self._next = sequence + 1
+            self._condition.notify_all()
+
+    # True when a subscription is yet to read the event with this sequence number
+    # Subscriptions whose cursor was already overwritten no longer hold changes back
+    def _unread(self, sequence: int) -> bool:
+        return any(
+            subscription.cursor == sequence for subscription in self._subscriptions
+        )
+
+    # Start reading the changes at cursor, by default from the next change on
+    def subscribe(self, cursor: int = None):
+        with self._condition:
+            if cursor is None:
+                cursor = self._next
+            elif cursor < self.oldest or cursor > self._next:
+                raise ValueError(
+                    "Cursor is no longer in the change log, rescan the inventory"
+                )
+            subscription = Subscription(self, cursor)
+            self._subscriptions.add(subscription)
+            return subscription
+
+
+# Defining class Subscription
+# A reader of a ChangeLog, created by ChangeLog.subscribe or Inventory.subscribe
+# cursor is the sequence number of the next event to read, save it to resume later
+class Subscription:
+    def __init__(self, change_log: ChangeLog, cursor: int):
+        self.change_log = change_log
+        self.cursor = cursor
+
+    # Return the next events in order, at most max_events of them
+    # When there are none, wait up to timeout seconds for one (0 doesn't wait)
+    # Raise error when events were overwritten before this subscription read them
+    def poll(self, max_events: int = 1000, timeout: float = 0.0) -> list:
+        log = self.change_log
+        with log._condition:
+            if self not in log._subscriptions:
+                raise ValueError("Subscription is closed")
+            if timeout and self.cursor == log._next:
+                log._condition.wait_for(lambda: self.cursor < log._next, timeout)
+            if self.cursor < log.oldest:
+                raise ValueError(
+                    "Changes were overwritten before they were read, rescan the inventory"
+                )
+            end = min(log._next, self.cursor + max_events)
+            events = [
+                log._events[sequence % log.capacity]
+                for sequence in range(self.cursor, end)
+            ]
+            self.cursor = end
+            # Changes waiting for room may go on
+            log._condition.notify_all()
+            return events
+
+    # Number of events not read yet
+    def lag(self) -> int:
+        return self.change_log._next - self.cursor
+
+    # Stop reading, so changes no longer wait for this subscription
+    def close(self):
+        with self.change_log._condition:
+            self.change_log._subscriptions.discard(self)
+            self.change_log._condition.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Defining class PersistentMap
+# An immutable mapping that is changed by making a new map, sharing everything
+# that did not change with the old one, so a reader holding the old map never sees
+# the change and needs no lock. It is a hash array mapped trie: each level of nodes
+# is picked by the next 5 bits of the key's hash. A node is a list of a 32 bit
+# bitmap of the used slots followed by what is in them, in slot order: a
+# (key, value) leaf, a child node or a _Collision of keys with the same hash.
+# A change copies only the nodes on the path to the key, about log32(n) of them.
+class PersistentMap(Mapping):
+    # Fixed attribute slots instead of a per instance __dict__ to save memory
+    __slots__ = ("_root", "_len")
+
+    # Constructor to initialize a map of the passed in (key, value) pairs
+    def __init__(self, items=()):
+        self._root = [0]
+        self._len = 0
+        if items:
+            self._root, self._len = self._assoc(items)
+
+    # A new map with the passed in (key, value) pairs added or replaced
+    def with_items(self, items) -> "PersistentMap":
+        changed = PersistentMap.__new__(PersistentMap)
+        changed._root, changed._len = self._assoc(items)
+        return changed
+
+    # Copy the path to every key, nodes copied by this call are changed in place
+    # when a later key goes through them
+    def _assoc(self, items):
+        root = list(self._root)
+        copied = {id(root)}
+        length = self._len
+        for key, value in items:
+            key_hash = hash(key) & 0xFFFFFFFFFFFFFFFF
+            node = root
+            shift = 0
+            while True:
+                bitmap = node[0]
+                bit = 1 << ((key_hash >> shift) & 31)
+                position = (bitmap & (bit - 1)).bit_count() + 1
+                if not bitmap & bit:
+                    node.insert(position, (key, value))
+                    node[0] = bitmap | bit
+                    length += 1
+                    break
+                slot = node[position]
+                if type(slot) is list:
+                    if id(slot) not in copied:
+                        slot = list(slot)
+                        copied.add(id(slot))
+                        node[position] = slot
+                    node = slot
+                    shift += 5
+                    continue
+                if type(slot) is tuple:
+                    if slot[0] == key:
+                        node[position] = (key, value)
+                        break
+                    # The hash of the leaf is worked out again instead of kept,
+                    # it is only needed when two keys meet in a slot
+                    slot_hash = hash(slot[0]) & 0xFFFFFFFFFFFFFFFF
+                    if slot_hash == key_hash:
+                        node[position] = _Collision(
+                            key_hash, {slot[0]: slot[1], key: value}
+                        )
+                        length += 1
+                        break
+                elif slot.key_hash == key_hash:
+                    entries = dict(slot.entries)
+                    length += key not in entries
+                    entries[key] = value
+                    node[position] = _Collision(key_hash, entries)
+                    break
+                else:
+                    slot_hash = slot.key_hash
+                # Push what is in the slot one level down and try again there
+                shift += 5
+                child = [1 << ((slot_hash >> shift) & 31), slot]
+                copied.add(id(child))
+                node[position] = child
+                node = child
+        return root, length
+
+    def __getitem__(self, key):
+        key_hash = hash(key) & 0xFFFFFFFFFFFFFFFF
+        node = self._root
+        shift = 0
+        while True:
+            bitmap = node[0]
+            bit = 1 << ((key_hash >> shift) & 31)
+            if not bitmap & bit:
+                raise KeyError(key)
+            slot = node[(bitmap & (bit - 1)).bit_count() + 1]
+            if type(slot) is list:
+                node = slot
+                shift += 5
+            elif type(slot) is tuple:
+                if slot[0] == key:
+                    return slot[1]
+                raise KeyError(key)
+            else:
+                return slot.entries[key]
+
+    # Every (key, value) pair, in hash order
+    def items(self):
+        stack = [iter(self._root[1:])]
+        while stack:
+            for slot in stack[-1]:
+                if type(slot) is list:
+                    stack.append(iter(slot[1:]))
+                    break
+                if type(slot) is tuple:
+                    yield slot
+                else:
+                    yield from slot.entries.items()
+            else:
+                stack.pop()
+
+    def values(self):
+        return (value for _, value in self.items())
+
+    def __iter__(self):
+        return (key for key, _ in self.items())
+
+    def __len__(self) -> int:
+        return self._len
+
+
+# Keys of a PersistentMap having the same hash, never changed once made
+class _Collision:
+    __slots__ = ("key_hash", "entries")
+
+    def __init__(self, key_hash: int, entries: dict):
+        self.key_hash = key_hash
+        self.entries = entries
+
+
+# Defining class ProductVersion
+# The fields of a product at one point in time, as kept by inventory snapshots
+# It is never changed, a change to the product makes a new version
+class ProductVersion:
+    # Fixed attribute slots instead of a per instance __dict__ to save memory
+    __slots__ = (
+        "product_id",
+        "name",
+        "price",
+        "description",
+        "category_id",
+        "quantity",
+        "_category",
+    )
+
+    # Constructor to copy the current fields of the product
+    def __init__(self, product: Product):
+        self.product_id = product.product_id
+        self.name = product.name
+        self.price = product.price
+        self.description = product.description
+        self.category_id = product.category.category_id
+        self.quantity = product.quantity
+        # The category object, to tell a deleted category from a new one with its id
+        self._category = product.category
+
+    # A function to print the product version
+    def __repr__(self):
+        return f"Product Id: {self.product_id}, Product Price: {self.price}, Product Name: {self.name}, Description: {self.description}, Quantity: {self.quantity}, Category Id:{self.category_id}"
+
+
+# Defining class InventorySnapshot
+# A consistent point in time view of an inventory, from Inventory.read_snapshot
+# It shows every change published before it was taken and none after, so a long
+# scan over it doesn't see the catalog change half way. Reading it takes no lock.
+# products maps product id to ProductVersion and categories maps category id to a
+# copy of the Category; both are read only. Searches scan the products, results
+# are in no particular order unless said otherwise.
+class InventorySnapshot:
+    def __init__(
+        self, version: int, products: PersistentMap, categories: dict, copies: dict
+    ):
+        self.version = version
+        self.products = products
+        self.categories = categories
+        # Category object of the inventory to its copy in this snapshot
+        self._copies = copies
+
+    # The product version, None when the product was not added yet
+    def get_product(self, product_id: int):
+        return self.products.get(product_id)
+
+    # Category of the product in this snapshot, None when it was deleted
+    def category_of(self, product: ProductVersion):
+        return self._copies.get(product._category)
+
+    # A function to search category by name
+    def search_category_by_name(self, name: str):
+        return [
+            category
+            for category in self.categories.values()
+            if name.lower() in category.name.lower()
+        ]
+
+    # A function to search product by name
+    def search_product_by_name(self, name: str):
+        return [
+            product
+            for product in self.products.values()
+            if name.lower() in product.name.lower()
+        ]
+
+    # Search product by price range, ordered by price and then id
+    def search_product_by_price_range(
+        self, min_price: float = None, max_price: float = None
+    ):
+        return sorted(
+            (
+                product
+                for product in self.products.values()
+                if (min_price is None or product.price >= min_price)
+                and (max_price is None or product.price <= max_price)
+            ),
+            key=lambda product: (product.price, product.product_id),
+        )
+
+    # Search product by category id
+    def search_product_by_category_id(self, category_id: int):
+        category = self.categories.get(category_id)
+        if category is None:
+            return []
+        return [
+            product
+            for product in self.products.values()
+            if self._copies.get(product._category) is category
+        ]
+
+    # Search product by category name
+    def search_product_by_category_name(self, name: str):
+        matching = set(self.search_category_by_name(name))
+        return [
+            product
+            for product in self.products.values()
+            if self._copies.get(product._category) in matching
+        ]
+
+    # A function to print the snapshot
+    def __repr__(self):
+        return f"Inventory Snapshot {self.version} \nCategories:{list(self.categories.values())}, \n\nProducts:{list(self.products.values())})"
+
+
+# Decorator making the changes of a versioned Inventory one at a time
+# Readers of snapshots never wait for it, only other changes do
+def versioned_change(method):
+    @functools.wraps(method)
+    def wrapper(inventory, *args, **kwargs):
+        if inventory._published is None:
+            return method(inventory, *args, **kwargs)
+        with inventory._change_lock:
+            return method(inventory, *args, **kwargs)
+
+    return wrapper
+
+
+# Defining class BulkLoadResult
+# Outcome of a bulk load: how many rows were added and which rows failed
+# Each error is a tuple of (row number starting at 1, row, error message)
+class BulkLoadResult:
+    # Constructor to initialize an empty result
+    def __init__(self):
+        self.loaded = 0
+        self.errors = []
+
+    # A function to print the result
+    def __repr__(self):
+        return f"Loaded {self.loaded} rows, {len(self.errors)} rows failed"
+
+
+# Defining class StockHold
+# Stock set aside for a while, e.g. the items in a shopping cart, made by
+# Inventory.hold_stock. items maps product id to the quantity held and
+# expires_at is the epoch seconds at which the stock goes back if not committed
+class StockHold:
+    # Fixed attribute slots instead of a per instance __dict__ to save memory
+    __slots__ = ("hold_id", "items", "expires_at")
+
+    def __init__(self, hold_id, items: dict, expires_at: float):
+        self.hold_id = hold_id
+        self.items = items
+        self.expires_at = expires_at
+
+    def __repr__(self):
+        return f"Hold {self.hold_id} of {self.items} until {self.expires_at}"
+
+
+# Defining class ReconciliationResult
+# Variance report of Inventory.reconcile_counts
+#   counted: products whose count was applied
+#   variances: (product_id, quantity on record, counted quantity) of every product
+#              whose count differed from its stock on record
+#   units_found / units_missing: units counted above / below the stock on record
+#   value_difference: the variances valued at the product prices
+#   errors: (row number, row, error message) of the rows not applied
+class ReconciliationResult:
+    # Constructor to initialize an empty report
+    def __init__(self):
+        self.counted = 0
+        self.variances = []
+        self.units_found = 0
+        self.units_missing = 0
+        self.value_difference = 0.0
+        self.errors = []
+
+    # A function to print the report
+    def __repr__(self):
+        return f"Counted {self.counted} products, {len(self.variances)} variances (+{self.units_found} / -{self.units_missing} units, value {self.value_difference:+.2f}), {len(self.errors)} rows failed"
+
+
+# Read the rows of a CSV file with a header line as dicts, one row at a time
+def read_csv_rows(path: str):
+    with open(path, newline="", encoding="utf-8") as file:
+        yield from csv.DictReader(file)
+
+
+# Read a JSON lines file (one JSON object per line) as dicts, one row at a time
+# A line that is not valid JSON is passed on as text so the loader reports it
+def read_json_lines(path: str):
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield line
+
+
+# Convert a status read from a file to a boolean, CSV files give it as text
+def parse_status(status) -> bool:
+    if isinstance(status, str):
+        return status.strip().lower() in ("true", "1", "yes", "active")
+    return bool(status)
+
+
+# Defining class Query
+# A search combining filters on name, price, category and quantity, built with
+# Inventory.query(), e.g. inventory.query().price(1, 5).category(3).order_by("price").limit(20)
+# The candidates are read from one index (the access path) and the other filters are
+# checked on each of them. The planner picks the path visiting the fewest products:
+#   category: the products of the categories, the count is known exactly
+#   price: the price index between the bounds, counted without visiting them
+#   name: the trigram index, if the inventory has one
+#   quantity: the stock heap up to max_quantity
+#   scan: every product
+# Results are yielded lazily. When the path already yields them in the requested order
+# (price index for price, stock heap for ascending quantity) a limited query stops
+# as soon as the page is full, otherwise the matches are sorted first.
+# For keyset pagination pass the last product of a page to after(). Ordered by price
+# the next page is found in O(log n + page size) instead of skipping offset products
+# Like a dict, don't add products while reading the results of a query
+class Query:
+    ORDERS = ("price", "quantity", "name", "product_id")
+
+    # Constructor to initialize a query without filters
+    def __init__(self, inventory):
+        self._inventory = inventory
+        self._name = None
+        self._min_price = None
+        self._max_price = None
+        self._category_ids = None
+        self._min_quantity = None
+        self._max_quantity = None
+        self._order = None
+        self._descending = False
+        self._limit = None
+        self._offset = 0
+        self._after = None
+
+    # Only products whose name contains the text, ignoring case
+    def name(self, text: str):
+        self._name = text.lower()
+        return self
+
+    # Only products costing between min_price and max_price (both inclusive)
+    def price(self, min_price: float = None, max_price: float = None):
+        self._min_price = min_price
+        self._max_price = max_price
+        return self
+
+    # Only products in one of the passed in categories
+    def category(self, *category_ids: int):
+        self._category_ids = tuple(dict.fromkeys(category_ids))
+        return self
+
+    # Only products with between min_quantity and max_quantity in stock (both inclusive)
+    def quantity(self, min_quantity: int = None, max_quantity: int = None):
+        self._min_quantity = min_quantity
+        self._max_quantity = max_quantity
+        return self
+
+    # Order the results by price, quantity, name or product_id
+    # Products with the same value are ordered by product id
+    def order_by(self, field: str, descending: bool = False):
+        if field not in self.ORDERS:
+            raise ValueError(f"Unable to order by {field}, use one of {self.ORDERS}")
+        self._order = field
+        self._descending = descending
+        return self
+
+    # Return at most count products
+    def limit(self, count: int):
+        if count < 0:
+            raise ValueError("Limit can not be negative")
+        self._limit = count
+        return self
+
+    # Skip the first count products
+    def offset(self, count: int):
+        if count < 0:
+            raise ValueError("Offset can not be negative")
+        self._offset = count
+        return self
+
+    # Only products after the passed in product in the order of order_by
+    # Pass the last product of a page to get the next page
+    def after(self, product: Product):
+        if self._order is None:
+            raise ValueError("Keyset pagination needs an order, call order_by first")
+        self._after = product
+        return self
+
+    # Run the query and return the results as a list
+    def all(self):
+        return list(self)
+
+    # The access path the query would use and the estimated products it visits
+    def explain(self):
+        path, estimate, ordered = self._plan()
+        return {"path": path, "estimate": estimate, "ordered": ordered}
+
+    # Sort key of a product in the order of order_by
+    def _key(self, product: Product):
+        if self._order == "name":
+            return (product.name.casefold(), product.product_id)
+        return (getattr(product, self._order), product.product_id)
+
+    # The price bounds as price index items, narrowed by the keyset of an ordered path
+    def _price_bounds(self, keyset=None):
+        lower = None if self._min_price is None else (self._min_price,)
+        upper = None if self._max_price is None else (self._max_price, float("inf"))
+        if keyset is not None:
+            if self._descending:
+                upper = keyset if upper is None else min(upper, keyset)
+            else:
+                lower = keyset if lower is None else max(lower, keyset)
+        return lower, upper
+
+    # Estimated number of candidates of every usable access path as
+    # (path, candidates, yields in the requested order)
+    def _paths(self):
+        inventory = self._inventory
+        total = len(inventory.products)
+        # Without an order every path yields in an acceptable order
+        unordered = self._order is None
+        paths = [("scan", total, unordered)]
+
+        if self._category_ids is not None:
+            count = sum(
+                len(inventory._category_index.get(category_id, ()))
+                for category_id in self._category_ids
+            )
+            paths.append(("category", count, unordered))
+
+        if (
+            self._min_price is not None
+            or self._max_price is not None
+            or self._order == "price"
+        ):
+            count = inventory._price_index.count(*self._price_bounds())
+            paths.append(("price", count, unordered or self._order == "price"))
+
+        if self._name is not None and inventory._product_name_index is not None:
+            count = inventory._product_name_index.estimate(self._name)
+            paths.append(("name", count, unordered))
+
+        # The number of products up to max_quantity is not known, so the stock heap
+        # only helps when its order is asked for or the page is small
+        ordered_by_quantity = self._order == "quantity" and not self._descending
+        if self._max_quantity is not None or ordered_by_quantity:
+            paths.append(("quantity", total, unordered or ordered_by_quantity))
+        return paths
+
+    # Pick the access path visiting the fewest products as (path, estimate, ordered)
+    def _plan(self):
+        paths = self._paths()
+        total = max(len(self._inventory.products), 1)
+        # Share of the products every filter with an index keeps
+        selectivity = {path: count / total for path, count, _ in paths}
+        needed = None if self._limit is None else self._offset + self._limit
+
+        best = None
+        for path, count, ordered in paths:
+            estimate = count
+            if ordered and needed is not None:
+                # An ordered path stops once the page is full, the other filters
+                # are assumed to keep their share of the candidates
+                kept = 1.0
+                for other, share in selectivity.items():
+                    if other not in ("scan", path):
+                        kept *= share
+                estimate = min(count, needed / kept) if kept else count
+            if best is None or estimate < best[1]:
+                best = (path, estimate, ordered)
+        return best[0], int(best[1]), best[2]
+
+    # Generator over the candidates of an access path, checked by _matches later
+    def _candidates(self, path: str, ordered: bool):
+        inventory = self._inventory
+        products = inventory.products
+
+        if path == "category":
+            for category_id in self._category_ids:
+                # A copy so the products can be changed while reading the results
+                bucket = list(inventory._category_index.get(category_id, ()))
+                for product_id in bucket:
+                    yield products[product_id]
+        elif path == "price":
+            # Start a page ordered by price right at the last product of the previous one
+            keyset = None
+            if self._order == "price" and self._after is not None:
+                keyset = (self._after.price, self._after.product_id)
+            for _, product_id in inventory._price_index.irange(
+                *self._price_bounds(keyset), reverse=self._descending
+            ):
+                yield products[product_id]
+        elif path == "name":
+            for product_id in inventory._product_name_index.search(self._name):
+                yield products[product_id]
+        elif path == "quantity":
+            yield from self._by_quantity()
+        else:
+            yield from products.values()
+
+    # Products up to max_quantity from the stock heap, by quantity and product id
+    # The heap is read in growing batches so its lock is not held while yielding
+    def _by_quantity(self):
+        inventory = self._inventory
+        count = 64
+        seen = 0
+        while True:
+            with inventory._stock_heap_lock:
+                batch = list(
+                    itertools.islice(
+                        inventory._stock_heap.smallest(self._max_quantity), count
+                    )
+                )
+            # The heap doesn't order equal quantities, so hold back the last
+            # quantity of a full batch and sort products of the same quantity by id
+            ready = batch[seen:]
+            if len(batch) == count:
+                last = batch[-1][1]
+                ready = [item for item in ready if item[1] != last]
+            ready.sort(key=lambda item: (item[1], item[0]))
+            for product_id, _ in ready:
+                yield inventory.products[product_id]
+            if len(batch) < count:
+                return
+            seen += len(ready)
+            count *= 2
+
+    # Check every filter of the query on the product
+    def _matches(self, product: Product, buckets, name_index) -> bool:
+        if self._min_price is not None and product.price < self._min_price:
+            return False
+        if self._max_price is not None and product.price > self._max_price:
+            return False
+        if self._min_quantity is not None and product.quantity < self._min_quantity:
+            return False
+        if self._max_quantity is not None and product.quantity > self._max_quantity:
+            return False
+        # Category buckets are checked instead of product.category, so products of
+        # a deleted category are left out like in search_product_by_category_id
+        if buckets is not None and not any(
+            product.product_id in bucket for bucket in buckets
+        ):
+            return False
+        if self._name is not None:
+            folded = (
+                name_index.folded_name(product.product_id)
+                if name_index is not None
+                else product.name.lower()
+            )
+            if self._name not in folded:
+                return False
+        return True
+
+    # Run the query, yielding the matching products
+    def __iter__(self):
+        inventory = self._inventory
+        path, _, ordered = self._plan()
+        buckets = None
+        if self._category_ids is not None:
+            buckets = [
+                inventory._category_index.get(category_id, {})
+                for category_id in self._category_ids
+            ]
+        name_index = inventory._product_name_index
+        matches = (
+            product
+            for product in self._candidates(path, ordered)
+            if self._matches(product, buckets, name_index)
+        )
+
+        if self._after is not None:
+            after = self._key(self._after)
+            if self._descending:
+                matches = (p for p in matches if self._key(p) < after)
+            else:
+                matches = (p for p in matches if self._key(p) > after)
 
-    # A function to print the product class
-    def __repr__(self):
-        return f"Product Id: {self.product_id}, Product Price: {self.price}, Product Name: {self.name}, Description: {self.description}, Quantity: {self.quantity}, Category:{self.category.name}"
+        if self._order is not None and not ordered:
+            needed = None if self._limit is None else self._offset + self._limit
+            if needed is None:
+                matches = iter(
+                    sorted(matches, key=self._key, reverse=self._descending)
+                )
+            elif self._descending:
+                matches = iter(nlargest(needed, matches, key=self._key))
+            else:
+                matches = iter(nsmallest(needed, matches, key=self._key))
+
+        stop = None if self._limit is None else self._offset + self._limit
+        yield from itertools.islice(matches, self._offset, stop)
 
 
 # Finally as we now have product and category class, create Inventory class
 class Inventory:
 
     # Intialize inventory class with empty categories and product dictionary
-    def __init__(self):
+    # Pass name_index=True to keep trigram indexes for the name searches
+    # Pass a PriceHistoryPolicy to limit how much price history every product keeps
+    # lock_stripes is the number of locks guarding the product quantities
+    # Pass a QueryCache to cache the results of the search methods between changes
+    # Pass fuzzy_index=True to keep a typo tolerant index for the fuzzy name search
+    # Pass autocomplete=True to keep prefix indexes for the name completions
+    # Pass a ChangeLog to record every change for subscribers
+    # Pass versioned=True to keep point in time snapshots for lock free reads
+    # Pass a PriceChangeIndex to keep every price change in time order for reports
+    def __init__(
+        self,
+        name_index: bool = False,
+        price_history_policy: PriceHistoryPolicy = None,
+        lock_stripes: int = 64,
+        query_cache: QueryCache = None,
+        fuzzy_index: bool = False,
+        autocomplete: bool = False,
+        change_log: ChangeLog = None,
+        versioned: bool = False,
+        price_changes: PriceChangeIndex = None,
+    ):
         self.categories = {}
         self.products = {}
+        self.price_history_policy = price_history_policy
+        # Quantity changes are guarded by the lock of the product's stripe
+        self._stock_locks = StripedLock(lock_stripes)
+        # Sorted (price, product_id) pairs used to answer price range searches
+        self._price_index = SortedIndex()
+        # Product ids of every category, keyed by category id
+        # Each bucket is a dict used as an ordered set so results keep insertion order
+        self._category_index = {}
+        # Optional trigram indexes over product and category names
+        self._product_name_index = TrigramIndex() if name_index else None
+        self._category_name_index = TrigramIndex() if name_index else None
+        # Optional typo tolerant index over the words of product names
+        self._product_fuzzy_index = FuzzyIndex() if fuzzy_index else None
+        # Optional prefix indexes over product names scored by quantity in stock,
+        # and over category names scored by product count
+        self._product_prefix_index = PrefixIndex() if autocomplete else None
+        self._category_prefix_index = PrefixIndex() if autocomplete else None
+        # Min heap of every product id by quantity, for the lowest stock view
+        self._stock_heap = IndexedHeap()
+        # Reorder threshold of the products having one, and a min heap of those
+        # products by quantity minus threshold, so at or below zero means reorder
+        self._reorder_thresholds = {}
+        self._reorder_heap = IndexedHeap()
+        # Stats of every category, keyed by category id
+        self._category_stats = {}
+        # Quantity changes of every stripe meet at the heaps, the category stats and
+        # the prefix indexes, so those have one lock
+        self._stock_heap_lock = threading.Lock()
+        # Likewise product changes meet at the price index, the category buckets and
+        # the name indexes. Locks are taken stripe, then index, then stock heap lock
+        self._index_lock = threading.Lock()
+        # Set by enable_instrumentation
+        self.instrumentation = None
+        # Generation of every index and category, bumped after each change to it
+        # Keys are "categories", "name", "price", "quantity" and ("category", id)
+        # Every bump takes the next number of one counter so a generation never repeats
+        self.query_cache = query_cache
+        self._generations = {}
+        self._generation_counter = itertools.count(1)
+        # Changes are recorded while the change is still locked, so the events
+        # of one product are in the order its changes were made
+        self.change_log = change_log
+        self.price_changes = price_changes
+        # The latest (version, products, categories, category copies) read by
+        # snapshots. Each change publishes a new tuple sharing what didn't change,
+        # so taking a snapshot is reading one attribute
+        self._published = (0, PersistentMap(), {}, {}) if versioned else None
+        # Changes of a versioned inventory are made one at a time, so a change
+        # never sees part of a write batch that snapshots don't have yet
+        self._change_lock = threading.RLock()
+        # Products and categories changed by the write batch of each thread
+        self._write_batch = threading.local()
+        # Units of every product held by stock holds, guarded by the product's
+        # stripe lock. Held units are still on hand but no other sale can take them
+        self._held = {}
+        # Holds by id and the timing wheel expiring them, under the holds lock
+        self._holds = {}
+        self._hold_wheel = TimingWheel()
+        self._hold_ids = itertools.count(1)
+        self._holds_lock = threading.Lock()
+
+    # Mark the passed in generation keys as changed
+    def _bump(self, *keys):
+        generations = self._generations
+        for key in keys:
+            generations[key] = next(self._generation_counter)
+
+    ## ******************************************** ##
+    # Inventory Instrumentation
+    ## ******************************************** ##
+
+    # Start recording calls, latency and result sizes of every public method
+    # Returns the Instrumentation holding the stats
+    def enable_instrumentation(self, exporter=None) -> Instrumentation:
+        if self.instrumentation is None:
+            self.instrumentation = Instrumentation(exporter)
+            for name in dir(type(self)):
+                # expire_holds is housekeeping run by every sale and stock read
+                if name.startswith("_") or name in (
+                    "enable_instrumentation",
+                    "disable_instrumentation",
+                    "expire_holds",
+                ):
+                    continue
+                method = getattr(self, name)
+                if callable(method):
+                    # An attribute on the object hides the method of the class
+                    setattr(self, name, self.instrumentation.wrap(name, method))
+        elif exporter is not None:
+            self.instrumentation.exporter = exporter
+        return self.instrumentation
+
+    # Stop recording, the methods go back to the plain class methods
+    def disable_instrumentation(self):
+        if self.instrumentation is None:
+            return
+        for name in self.instrumentation.methods:
+            self.__dict__.pop(name, None)
+        self.instrumentation = None
+
+    ## ******************************************** ##
+    # Inventory Change Subscriptions
+    ## ******************************************** ##
+
+    # Read the changes recorded in the change log, from cursor or from now on
+    # e.g. with inventory.subscribe() as changes: events = changes.poll(timeout=1)
+    def subscribe(self, cursor: int = None) -> Subscription:
+        if self.change_log is None:
+            raise ValueError("Pass a ChangeLog to the inventory to subscribe to changes")
+        return self.change_log.subscribe(cursor)
+
+    ## ******************************************** ##
+    # Inventory Snapshots
+    ## ******************************************** ##
+
+    # A consistent point in time view of the products and categories, which later
+    # changes don't show up in. Reading it takes no lock and doesn't block changes
+    def read_snapshot(self) -> InventorySnapshot:
+        if self._published is None:
+            raise ValueError("Pass versioned=True to the inventory to read snapshots")
+        return InventorySnapshot(*self._published)
+
+    # Make several changes show up in snapshots together
+    # e.g. with inventory.write_batch(): followed by the changes in the block
+    # The changes are made right away, snapshots get all of them when the block
+    # ends (also when it raises, changes made until then are not undone).
+    # Other threads' changes wait for the block to end
+    @contextmanager
+    def write_batch(self):
+        batch = self._write_batch
+        # A batch inside a batch is part of the outer one
+        if self._published is None or getattr(batch, "products", None) is not None:
+            yield
+            return
+        with self._change_lock:
+            batch.products = {}
+            batch.categories = False
+            try:
+                yield
+            finally:
+                products, categories = batch.products, batch.categories
+                batch.products = None
+                self._publish(products.values(), categories)
+
+    # Publish the passed in changed products, and the categories when they changed,
+    # to the next snapshots, or keep them for the end of the running write batch
+    # Called while holding the change lock
+    def _version(self, products=(), categories: bool = False):
+        if self._published is None:
+            return
+        batch = self._write_batch
+        if getattr(batch, "products", None) is not None:
+            for product in products:
+                batch.products[product.product_id] = product
+            batch.categories = batch.categories or categories
+            return
+        self._publish(products, categories)
+
+    # Replace the published tuple with one having new versions of the products
+    def _publish(self, products, categories: bool):
+        version, versions, category_copies, copies = self._published
+        if products:
+            versions = versions.with_items(
+                (product.product_id, ProductVersion(product)) for product in products
+            )
+        if categories:
+            copies = {
+                category: Category(category.category_id, category.name, category.status)
+                for category in self.categories.values()
+            }
+            category_copies = {copy.category_id: copy for copy in copies.values()}
+        self._published = (version + 1, versions, category_copies, copies)
 
     ## ******************************************** ##
     # Inventory Category Management
@@ -113,6 +2628,7 @@ class Inventory:
         return product_id not in self.products
 
     # Add new category
+    @versioned_change
     def add_new_category(self, category_id: int, name: str, status: bool = True):
         # First check if the category id is unique
         if not self.is_category_id_unique(category_id):
@@ -120,8 +2636,23 @@ class Inventory:
 
         # Add the category using category_id as key
         self.categories[category_id] = Category(category_id, name, status)
+        if self.change_log is not None:
+            self.change_log.append(
+                "add_new_category",
+                category_id,
+                {"name": (None, name), "status": (None, status)},
+            )
+        with self._stock_heap_lock:
+            self._category_stats[category_id] = CategoryStats()
+            if self._category_prefix_index is not None:
+                self._category_prefix_index.add(category_id, name)
+        if self._category_name_index is not None:
+            self._category_name_index.add(category_id, name)
+        self._version(categories=True)
+        self._bump("categories", ("category", category_id))
 
     # Update Category name or status
+    @versioned_change
     def update_category(self, cagetory_id: int, name: str = None, status: bool = None):
         # If passed in category id is not present, return error
         if cagetory_id not in self.categories:
@@ -130,9 +2661,34 @@ class Inventory:
             )
 
         # Use category update method to update the category details
-        self.categories[cagetory_id].update(name, status)
+        category = self.categories[cagetory_id]
+        old_name = category.name
+        old_status = category.status
+        category.update(name, status)
+        if self.change_log is not None:
+            changes = {}
+            if category.name != old_name:
+                changes["name"] = (old_name, category.name)
+            if category.status != old_status:
+                changes["status"] = (old_status, category.status)
+            if changes:
+                self.change_log.append("update_category", cagetory_id, changes)
+        if category.name != old_name or category.status != old_status:
+            self._version(categories=True)
+        if category.name != old_name:
+            if self._category_name_index is not None:
+                self._category_name_index.add(cagetory_id, category.name)
+            if self._category_prefix_index is not None:
+                with self._stock_heap_lock:
+                    self._category_prefix_index.add(
+                        cagetory_id,
+                        category.name,
+                        self._category_stats[cagetory_id].count,
+                    )
+            self._bump("categories")
 
     # Delete existing category
+    @versioned_change
     def delete_category(self, cagetory_id: int):
         # If passed in category id is not present, return error
         if cagetory_id not in self.categories:
@@ -140,10 +2696,40 @@ class Inventory:
                 "Unable to find the category for this passed in cateogry id"
             )
 
-        del self.categories[cagetory_id]
+        category = self.categories.pop(cagetory_id)
+        if self.change_log is not None:
+            self.change_log.append(
+                "delete_category",
+                cagetory_id,
+                {"name": (category.name, None), "status": (category.status, None)},
+            )
+        if self._category_name_index is not None:
+            self._category_name_index.remove(cagetory_id)
+        # Products of a deleted category are no longer found by category searches
+        # and are no longer counted in category stats
+        with self._index_lock:
+            self._category_index.pop(cagetory_id, None)
+        with self._stock_heap_lock:
+            self._category_stats.pop(cagetory_id, None)
+            if self._category_prefix_index is not None:
+                self._category_prefix_index.remove(cagetory_id)
+        self._version(categories=True)
+        self._bump("categories", ("category", cagetory_id))
 
     # A function to search category by name
+    @cached_search(("categories",))
     def search_category_by_name(self, name: str):
+        return self._matching_categories(name)
+
+    # Categories whose name contains name, read without the query cache so the
+    # searches built on it don't count cache hits and misses of their own
+    def _matching_categories(self, name: str):
+        if self._category_name_index is not None:
+            return [
+                self.categories[category_id]
+                for category_id in self._category_name_index.search(name)
+            ]
+
         return [
             category
             for category in self.categories.values()
@@ -155,6 +2741,7 @@ class Inventory:
     ## ******************************************** ##
 
     # Add in a new product
+    @versioned_change
     def add_product(
         self,
         product_id: int,
@@ -176,11 +2763,121 @@ class Inventory:
         category = self.categories[category_id]
 
         # Finally add in the product
-        self.products[product_id] = Product(
-            product_id, name, price, description, category, quantity
+        product = Product(product_id, name, price, description, category, quantity)
+        # Recorded before the product can be found, so no change to it comes first
+        if self.change_log is not None:
+            self.change_log.append("add_product", product_id, added_changes(product))
+        # Found and indexed under its stripe lock, so an update of the new product
+        # waits until it is in every index
+        with self._stock_locks.lock_for(product_id):
+            self.products[product_id] = product
+            self._index_products([product], rebuild=False)
+        self._products_indexed([product])
+
+    # Add newly added products to the search indexes, the stock heap and the category stats
+    # Sorting everything once is cheaper than many inserts for a large load. The
+    # rebuild holds every stripe lock: a quantity changed under its stripe but not
+    # yet passed to _stock_changed would otherwise be counted in the new stats and
+    # then added again. A small load holds the stripe locks of its products
+    def _index_new_products(self, products):
+        rebuild = len(products) > len(self._price_index) // 8
+        with ExitStack() as stack:
+            for lock in self._stock_locks.locks_for(
+                self.products
+                if rebuild
+                else [product.product_id for product in products]
+            ):
+                stack.enter_context(lock)
+            self._index_products(products, rebuild)
+        self._products_indexed(products)
+
+    # Index the products, called while holding their stripe locks (every stripe
+    # lock to rebuild the price index, the stock heap and the category stats)
+    def _index_products(self, products, rebuild: bool):
+        with self._index_lock:
+            for product in products:
+                category_id = product.category.category_id
+                # Products of a deleted category (e.g. loaded from a snapshot) stay
+                # out of the category searches like they do after delete_category
+                if self.categories.get(category_id) is product.category:
+                    self._category_index.setdefault(category_id, {})[
+                        product.product_id
+                    ] = None
+                if self._product_name_index is not None:
+                    self._product_name_index.add(product.product_id, product.name)
+                if self._product_fuzzy_index is not None:
+                    self._product_fuzzy_index.add(product.product_id, product.name)
+
+            if rebuild:
+                self._price_index = SortedIndex(
+                    (product.price, product.product_id)
+                    for product in self.products.values()
+                )
+            else:
+                for product in products:
+                    self._price_index.add((product.price, product.product_id))
+
+            with self._stock_heap_lock:
+                if rebuild:
+                    self._stock_heap = IndexedHeap(
+                        (product.product_id, product.quantity)
+                        for product in self.products.values()
+                    )
+                    for category_id, bucket in self._category_index.items():
+                        if category_id in self._category_stats:
+                            self._category_stats[category_id] = CategoryStats(
+                                self.products[product_id] for product_id in bucket
+                            )
+                else:
+                    for product in products:
+                        self._stock_heap.set(product.product_id, product.quantity)
+                        stats = self._live_category_stats(product.category)
+                        if stats is not None:
+                            stats.add(product.price, product.quantity)
+                self._index_new_prefixes(products)
+
+        # Products loaded with a price history, e.g. from a snapshot
+        if self.price_changes is not None:
+            for product in products:
+                for change in self._history_changes(product):
+                    self.price_changes.add(change)
+
+    # Publish newly indexed products to snapshots and invalidate cached results
+    def _products_indexed(self, products):
+        if products:
+            self._version(products)
+            self._bump(
+                "name",
+                "price",
+                *{("category", product.category.category_id) for product in products},
+            )
+
+    # Add newly added products to the prefix index and rescore their categories
+    # Called while holding the stock heap lock, after the category stats were updated
+    def _index_new_prefixes(self, products):
+        if self._product_prefix_index is None:
+            return
+        for product in products:
+            self._product_prefix_index.add(
+                product.product_id, product.name, product.quantity
+            )
+        self._rescore_categories(
+            {product.category.category_id for product in products}
         )
 
+    # Rank the categories in the prefix index by their current product count
+    # Called while holding the stock heap lock
+    def _rescore_categories(self, category_ids):
+        if self._category_prefix_index is None:
+            return
+        for category_id in category_ids:
+            stats = self._category_stats.get(category_id)
+            if stats is not None:
+                self._category_prefix_index.set_score(category_id, stats.count)
+
     # Update the existing product details
+    # timestamp is the epoch seconds recorded for a price change, defaults to now
+    @versioned_change
     def update_product(
         self,
         product_id: int,
@@ -189,6 +2886,7 @@ class Inventory:
         description: str = None,
         category_id: int = None,
         quantity: int = None,
+        timestamp: float = None,
     ):
         if product_id not in self.products:
             raise ValueError("Unable to find product using the passed in id")
@@ -196,30 +2894,297 @@ class Inventory:
         # Get existing product
         product = self.products[product_id]
 
-        # Check if category changed, if changed get the new category
-        # If new category id exists, get the category by id or use existing
-        category = (
-            self.categories.get(category_id, product.category)
-            if category_id
-            else product.category
-        )
+        # Everything read from the product and every index move is made under its
+        # stripe lock, so two updates of one product can't interleave
+        with self._stock_locks.lock_for(product_id):
+            # Check if category changed, if changed get the new category
+            # If new category id exists, get the category by id or use existing
+            category = (
+                self.categories.get(category_id, product.category)
+                if category_id
+                else product.category
+            )
+
+            # Finally call in product update function to update the values
+            old_name = product.name
+            old_price = product.price
+            old_description = product.description
+            old_category = product.category
+            old_quantity = product.quantity
+            product.update(name, price, description, category, quantity, timestamp)
+            self._stock_changed(product, old_quantity, old_price, old_category)
+            if self.change_log is not None:
+                changes = {
+                    field: (old, new)
+                    for field, old, new in (
+                        ("name", old_name, product.name),
+                        ("price", old_price, product.price),
+                        ("description", old_description, product.description),
+                        (
+                            "category_id",
+                            old_category.category_id,
+                            product.category.category_id,
+                        ),
+                        ("quantity", old_quantity, product.quantity),
+                    )
+                    if old != new
+                }
+                if changes:
+                    self.change_log.append("update_product", product_id, changes)
+            # Same time as the price history, which never goes backwards
+            if self.price_changes is not None and product.price != old_price:
+                self.price_changes.add(
+                    PriceChange(
+                        product._price_history.timestamps[-1],
+                        product_id,
+                        old_price,
+                        product.price,
+                        product.category.category_id,
+                    )
+                )
+            if product.price != old_price and self.price_history_policy is not None:
+                self.price_history_policy.apply(
+                    product._price_history,
+                    time.time() if timestamp is None else timestamp,
+                )
+
+            with self._index_lock:
+                # Move the product in the price index if the price changed
+                if product.price != old_price:
+                    self._price_index.remove((old_price, product_id))
+                    self._price_index.add((product.price, product_id))
 
-        # Finally call in product update function to update the values
-        product.update(name, price, description, category, quantity)
+                # Re-index the name if it changed
+                if product.name != old_name:
+                    if self._product_name_index is not None:
+                        self._product_name_index.add(product_id, product.name)
+                    if self._product_fuzzy_index is not None:
+                        self._product_fuzzy_index.add(product_id, product.name)
+
+                # Move the product to the bucket of its new category
+                if product.category is not old_category:
+                    self._category_index.get(old_category.category_id, {}).pop(
+                        product_id, None
+                    )
+                    self._category_index.setdefault(
+                        product.category.category_id, {}
+                    )[product_id] = None
+
+            if product.name != old_name and self._product_prefix_index is not None:
+                with self._stock_heap_lock:
+                    self._product_prefix_index.add(
+                        product_id, product.name, product.quantity
+                    )
+            self._version((product,))
+
+        # Only the results read from what changed are invalidated
+        changed = []
+        if product.name != old_name:
+            changed.append("name")
+        if product.price != old_price:
+            changed.append("price")
+        if product.category is not old_category:
+            changed.append(("category", old_category.category_id))
+            changed.append(("category", product.category.category_id))
+        if quantity is not None:
+            changed.append("quantity")
+        self._bump(*changed)
 
     # Increase product quantity by quantity
+    @versioned_change
     def increase_product_quantity(self, product_id: int, quantity: int):
         if product_id not in self.products:
             raise ValueError("Unable to find the product using passed in id")
 
-        self.products[product_id].increaseQuantity(quantity)
+        product = self.products[product_id]
+        with self._stock_locks.lock_for(product_id):
+            product.increaseQuantity(quantity)
+            self._stock_changed(product, product.quantity - quantity)
+            if self.change_log is not None:
+                self.change_log.append(
+                    "increase_product_quantity",
+                    product_id,
+                    {"quantity": (product.quantity - quantity, product.quantity)},
+                )
+            self._version((product,))
+        self._bump("quantity")
 
     # Decrease product quantity by quantity
+    # Raise error instead of letting the quantity go below zero
+    @versioned_change
     def decrease_product_quantity(self, product_id: int, quantity: int):
         if product_id not in self.products:
             raise ValueError("Unable to find the product using passed in id")
 
-        self.products[product_id].decreaseQuantity(quantity)
+        # Stock of expired holds can be sold again
+        self.expire_holds()
+        product = self.products[product_id]
+        with self._stock_locks.lock_for(product_id):
+            if self._available(product_id) < quantity:
+                raise ValueError("Not enough quantity in stock for this product")
+            product.decreaseQuantity(quantity)
+            self._stock_changed(product, product.quantity + quantity)
+            if self.change_log is not None:
+                self.change_log.append(
+                    "decrease_product_quantity",
+                    product_id,
+                    {"quantity": (product.quantity + quantity, product.quantity)},
+                )
+            self._version((product,))
+        self._bump("quantity")
+
+    # Take stock of several products at once, e.g. every line of an order
+    # items is a list of (product_id, quantity). Either every quantity is taken,
+    # or when a product doesn't have enough stock nothing changes and error is raised
+    # Like every sale, stock held by holds can't be taken
+    @versioned_change
+    def reserve(self, items):
+        # Add up lines of the same product and check the ids before locking
+        totals = {}
+        for product_id, quantity in items:
+            if product_id not in self.products:
+                raise ValueError("Unable to find the product using passed in id")
+            if quantity < 0:
+                raise ValueError("Quantity to reserve can not be negative")
+            totals[product_id] = totals.get(product_id, 0) + quantity
+
+        self.expire_holds()
+        with ExitStack() as stack:
+            for lock in self._stock_locks.locks_for(totals):
+                stack.enter_context(lock)
+
+            short = [
+                product_id
+                for product_id, quantity in totals.items()
+                if self._available(product_id) < quantity
+            ]
+            if short:
+                raise ValueError(f"Not enough quantity in stock for products {short}")
+
+            for product_id, quantity in totals.items():
+                product = self.products[product_id]
+                product.decreaseQuantity(quantity)
+                self._stock_changed(product, product.quantity + quantity)
+                if self.change_log is not None:
+                    self.change_log.append(
+                        "decrease_product_quantity",
+                        product_id,
+                        {"quantity": (product.quantity + quantity, product.quantity)},
+                    )
+            # One version for the whole order, so no snapshot has part of it
+            self._version([self.products[product_id] for product_id in totals])
+        self._bump("quantity")
+
+    # Change the stock of several products taking their locks only once, e.g. the
+    # restocks and sales a service collected over a millisecond
+    # changes is a list of (product_id, difference), positive to add stock and
+    # negative to take it. Unlike reserve every change stands on its own: returns
+    # a list with None for each change made and the error message of each one not
+    # made, in the order of changes. A malformed change is reported the same way
+    @versioned_change
+    def change_quantities(self, changes):
+        changes = list(changes)
+        outcomes = [None] * len(changes)
+        # Check every change before locking, so a bad one can't stop the loop
+        # after the changes before it were made
+        valid = []
+        for position, change in enumerate(changes):
+            try:
+                product_id, difference = change
+                known = product_id in self.products
+            except (TypeError, ValueError):
+                outcomes[position] = "Invalid change, expected (product_id, difference)"
+                continue
+            if isinstance(difference, bool) or not isinstance(difference, int):
+                outcomes[position] = "Quantity change must be a whole number"
+            elif not known:
+                outcomes[position] = "Unable to find the product using passed in id"
+            else:
+                valid.append((position, product_id, difference))
+
+        changed = {}
+        self.expire_holds()
+        with ExitStack() as stack:
+            for lock in self._stock_locks.locks_for(
+                {product_id for _, product_id, _ in valid}
+            ):
+                stack.enter_context(lock)
+
+            for position, product_id, difference in valid:
+                product = self.products[product_id]
+                if self._available(product_id) + difference < 0:
+                    outcomes[position] = "Not enough quantity in stock for this product"
+                    continue
+                product.increaseQuantity(difference)
+                self._stock_changed(product, product.quantity - difference)
+                if self.change_log is not None:
+                    self.change_log.append(
+                        "increase_product_quantity"
+                        if difference >= 0
+                        else "decrease_product_quantity",
+                        product_id,
+                        {"quantity": (product.quantity - difference, product.quantity)},
+                    )
+                changed[product_id] = product
+            self._version(changed.values())
+        if changed:
+            self._bump("quantity")
+        return outcomes
+
+    # Move the product in the stock heaps and category stats after it changed
+    # Called while holding the lock of the product's stripe, with the quantity,
+    # price and category the product had before (price and category default to
+    # the current ones when only the quantity changed)
+    def _stock_changed(
+        self,
+        product: Product,
+        old_quantity: int,
+        old_price: float = None,
+        old_category: Category = None,
+    ):
+        old_price = product.price if old_price is None else old_price
+        old_category = product.category if old_category is None else old_category
+        with self._stock_heap_lock:
+            if product.quantity != old_quantity:
+                self._stock_heap.set(product.product_id, product.quantity)
+                if self._product_prefix_index is not None:
+                    self._product_prefix_index.set_score(
+                        product.product_id, product.quantity
+                    )
+                threshold = self._reorder_thresholds.get(product.product_id)
+                if threshold is not None:
+                    self._reorder_heap.set(
+                        product.product_id, product.quantity - threshold
+                    )
+
+            old_stats = self._live_category_stats(old_category)
+            if product.category is old_category:
+                if product.price == old_price:
+                    if old_stats is not None and product.quantity != old_quantity:
+                        old_stats.change_quantity(
+                            product.price, product.quantity - old_quantity
+                        )
+                    return
+                new_stats = old_stats
+            else:
+                new_stats = self._live_category_stats(product.category)
+
+            if old_stats is not None:
+                old_stats.remove(old_price, old_quantity)
+            if new_stats is not None:
+                new_stats.add(product.price, product.quantity)
+            if product.category is not old_category:
+                self._rescore_categories(
+                    (old_category.category_id, product.category.category_id)
+                )
+
+    # Stats of the category, None when it was deleted
+    # A category added again with the id of a deleted one has new stats,
+    # which the products of the deleted category are not part of
+    def _live_category_stats(self, category: Category):
+        if self.categories.get(category.category_id) is not category:
+            return None
+        return self._category_stats.get(category.category_id)
 
     # View product price history
     def get_product_price_history(self, product_id: int):
@@ -228,38 +3193,711 @@ class Inventory:
 
         return self.products[product_id].price_history
 
+    # Price of the product at the passed in epoch seconds, e.g. the time of an order
+    # None if the product was not added yet at that time
+    def price_at(self, product_id: int, timestamp: float):
+        if product_id not in self.products:
+            raise ValueError("Unable to find the product using passed in id")
+
+        return self.products[product_id].price_at(timestamp)
+
+    # Price changes of the product between start and end epoch seconds (both inclusive)
+    def price_history_between(self, product_id: int, start: float, end: float):
+        if product_id not in self.products:
+            raise ValueError("Unable to find the product using passed in id")
+
+        return self.products[product_id].price_history_between(start, end)
+
+    # Price changes of every product between start and end epoch seconds (both
+    # inclusive), oldest first. Passing None for a bound leaves that side open
+    # Without a PriceChangeIndex the price histories of all products are scanned,
+    # which only have what the price history policy kept and the current category
+    def price_changes_between(self, start: float = None, end: float = None):
+        if self.price_changes is not None:
+            return self.price_changes.between(start, end)
+        return sorted(
+            (
+                change
+                for product in list(self.products.values())
+                for change in self._history_changes(product, start, end)
+            ),
+            key=lambda change: change.timestamp,
+        )
+
+    # The k price changes between start and end with the largest relative change,
+    # up or down, the largest first
+    def largest_price_changes(
+        self, start: float = None, end: float = None, k: int = 10
+    ):
+        return nlargest(
+            k,
+            self.price_changes_between(start, end),
+            key=lambda change: abs(change.relative_change),
+        )
+
+    # Price changes between start and end added up by category id,
+    # see summarize_price_changes for the fields
+    def price_change_rollup(self, start: float = None, end: float = None):
+        return summarize_price_changes(self.price_changes_between(start, end))
+
+    # Price changes kept in the price history of the product between start and end
+    # The history doesn't know older categories, so all get the current one
+    @staticmethod
+    def _history_changes(product: Product, start: float = None, end: float = None):
+        history = product._price_history
+        if history is None:
+            return
+        timestamps, prices = history.timestamps, history.prices
+        # The first entry is the price when added (or the oldest one kept)
+        lo = 1 if start is None else max(bisect_left(timestamps, start), 1)
+        hi = len(timestamps) if end is None else bisect_right(timestamps, end)
+        category_id = product.category.category_id
+        for position in range(lo, hi):
+            yield PriceChange(
+                timestamps[position],
+                product.product_id,
+                prices[position - 1],
+                prices[position],
+                category_id,
+            )
+
     # Search product by name
+    @cached_search(("name",))
     def search_product_by_name(self, name: str):
+        if self._product_name_index is not None:
+            return [
+                self.products[product_id]
+                for product_id in self._product_name_index.search(name)
+            ]
+
         return [
             product
             for product in self.products.values()
             if name.lower() in product.name.lower()
         ]
 
-    # Search product by price range
-    def search_product_by_price_range(self, min_price: float, max_price: float):
+    # Search product by name allowing typos, e.g. "cauliflower" finds "Caluliflower"
+    # Every searched word has to be close to a word of the name: one edit is allowed
+    # for words of 4 to 6 letters and two for longer ones (shorter words must match)
+    # Returns up to limit products, the smallest total number of edits first
+    @cached_search(("name",))
+    def search_product_by_name_fuzzy(self, name: str, limit: int = 10):
+        if self._product_fuzzy_index is not None:
+            return [
+                self.products[product_id]
+                for product_id in self._product_fuzzy_index.search(name, limit)
+            ]
+
+        # Without the index compare the searched words with the words of every name
+        fuzzy = FuzzyIndex()
+        searched = [(word, fuzzy.allowed_distance(word)) for word in fuzzy.words(name)]
+        if not searched:
+            return []
+        scored = []
+        for order, product in enumerate(self.products.values()):
+            words = fuzzy.words(product.name)
+            total = 0
+            for word, allowed in searched:
+                best = min(
+                    (fuzzy.distance(word, other, allowed) for other in words),
+                    default=allowed + 1,
+                )
+                if best > allowed:
+                    break
+                total += best
+            else:
+                scored.append((total, order, product))
+        return [product for _, _, product in nsmallest(limit, scored)]
+
+    # Complete a typed prefix of a product name, e.g. "ca" finds "Carrot" and "Cabbage"
+    # Returns up to limit products whose name starts with the prefix (ignoring case),
+    # the most in stock first and then by name
+    def autocomplete_product_name(self, prefix: str, limit: int = 10):
+        if self._product_prefix_index is not None:
+            return [
+                self.products[product_id]
+                for product_id in self._product_prefix_index.complete(prefix, limit)
+            ]
+
+        prefix = prefix.casefold()
+        return nsmallest(
+            limit,
+            (
+                product
+                for product in self.products.values()
+                if product.name.casefold().startswith(prefix)
+            ),
+            key=lambda product: (
+                -product.quantity,
+                product.name.casefold(),
+                product.product_id,
+            ),
+        )
+
+    # Complete a typed prefix of a category name
+    # Returns up to limit categories whose name starts with the prefix (ignoring case),
+    # the ones with the most products first and then by name
+    def autocomplete_category_name(self, prefix: str, limit: int = 10):
+        if self._category_prefix_index is not None:
+            return [
+                self.categories[category_id]
+                for category_id in self._category_prefix_index.complete(prefix, limit)
+            ]
+
+        prefix = prefix.casefold()
+        with self._stock_heap_lock:
+            counts = {
+                category_id: stats.count
+                for category_id, stats in self._category_stats.items()
+            }
+        return nsmallest(
+            limit,
+            (
+                category
+                for category in self.categories.values()
+                if category.name.casefold().startswith(prefix)
+            ),
+            key=lambda category: (
+                -counts.get(category.category_id, 0),
+                category.name.casefold(),
+                category.category_id,
+            ),
+        )
+
+    # Search product by price range, results are ordered by price
+    # Leave min_price or max_price as None to search an open ended range
+    @cached_search(("price",))
+    def search_product_by_price_range(
+        self, min_price: float = None, max_price: float = None
+    ):
+        # Bounds are (price,) tuples so every product id at that price is included
+        lower = None if min_price is None else (min_price,)
+        upper = None if max_price is None else (max_price, float("inf"))
         return [
-            product
-            for product in self.products.values()
-            if min_price <= product.price <= max_price
+            self.products[product_id]
+            for _, product_id in self._price_index.irange(lower, upper)
         ]
 
+    # Search product costing at least min_price, ordered by price
+    def search_product_by_min_price(self, min_price: float):
+        return self.search_product_by_price_range(min_price=min_price)
+
+    # Search product costing at most max_price, ordered by price
+    def search_product_by_max_price(self, max_price: float):
+        return self.search_product_by_price_range(max_price=max_price)
+
     # Search product by category id
+    @cached_search(lambda inventory, category_id: (("category", category_id),))
     def search_product_by_category_id(self, category_id: int):
         return [
-            product
-            for product in self.products.values()
-            if product.category.category_id == category_id
+            self.products[product_id]
+            for product_id in self._category_index.get(category_id, ())
         ]
 
     # Search product by category name
+    # Find the few matching categories first and then collect their products
+    # The result depends on the category names and on each matching category
+    @cached_search(
+        lambda inventory, name: (
+            "categories",
+            *(
+                ("category", category.category_id)
+                for category in inventory._matching_categories(name)
+            ),
+        )
+    )
     def search_product_by_category_name(self, name: str):
         return [
-            product
-            for product in self.products.values()
-            if name.lower() in product.category.name.lower()
+            self.products[product_id]
+            for category in self._matching_categories(name)
+            for product_id in self._category_index.get(category.category_id, ())
         ]
 
+    # Product count, total units, stock value and min, max and average price
+    # of the products of a category, read without walking the products
+    def get_category_stats(self, category_id: int):
+        with self._stock_heap_lock:
+            stats = self._category_stats.get(category_id)
+            if stats is None:
+                raise ValueError(
+                    "Unable to find the category for this passed in cateogry id"
+                )
+            return stats.summary()
+
+    # Stats of every category, keyed by category id
+    def get_all_category_stats(self):
+        with self._stock_heap_lock:
+            return {
+                category_id: stats.summary()
+                for category_id, stats in self._category_stats.items()
+            }
+
+    # Start a query combining filters on name, price, category and quantity
+    # e.g. inventory.query().name("milk").price(max_price=5).order_by("price").limit(10)
+    def query(self) -> Query:
+        return Query(self)
+
+    ## ******************************************** ##
+    # Inventory Reorder Management
+    ## ******************************************** ##
+
+    # Set the stock at or below which the product needs to be reordered
+    # Pass None as threshold to stop tracking the product
+    def set_reorder_threshold(self, product_id: int, threshold: int):
+        if product_id not in self.products:
+            raise ValueError("Unable to find the product using passed in id")
+        if threshold is not None and threshold < 0:
+            raise ValueError("Reorder threshold can not be negative")
+
+        product = self.products[product_id]
+        with self._stock_locks.lock_for(product_id):
+            with self._stock_heap_lock:
+                old_threshold = self._reorder_thresholds.get(product_id)
+                if threshold is None:
+                    self._reorder_thresholds.pop(product_id, None)
+                    self._reorder_heap.remove(product_id)
+                else:
+                    self._reorder_thresholds[product_id] = threshold
+                    self._reorder_heap.set(product_id, product.quantity - threshold)
+            # A full change log can make the append wait, so it is made after the
+            # heap lock is released, like the stock changes do
+            if self.change_log is not None and threshold != old_threshold:
+                self.change_log.append(
+                    "set_reorder_threshold",
+                    product_id,
+                    {"reorder_threshold": (old_threshold, threshold)},
+                )
+
+    # Reorder threshold of the product, None if it has none
+    def get_reorder_threshold(self, product_id: int):
+        if product_id not in self.products:
+            raise ValueError("Unable to find the product using passed in id")
+
+        return self._reorder_thresholds.get(product_id)
+
+    # The k products with the least stock, lowest first
+    # Takes O(k log k) however many products there are
+    def lowest_stock(self, k: int):
+        with self._stock_heap_lock:
+            product_ids = [
+                product_id
+                for product_id, _ in itertools.islice(self._stock_heap.smallest(), k)
+            ]
+        return [self.products[product_id] for product_id in product_ids]
+
+    # Products whose stock is at or below their reorder threshold,
+    # the ones furthest below it first
+    # Only the returned products are visited, not every product with a threshold
+    def below_threshold(self):
+        with self._stock_heap_lock:
+            product_ids = [
+                product_id for product_id, _ in self._reorder_heap.smallest(0)
+            ]
+        return [self.products[product_id] for product_id in product_ids]
+
+    ## ******************************************** ##
+    # Inventory Stock Holds
+    ## ******************************************** ##
+
+    # Hold stock of several products for ttl seconds, e.g. the items of a cart
+    # items is a list of (product_id, quantity). Held stock stays on hand but other
+    # sales can't take it. Commit the hold at checkout to take the stock, or
+    # release it, otherwise it goes back by itself once it expires.
+    # Either every quantity is held, or when a product doesn't have enough
+    # available stock nothing is held and error is raised. Returns the hold id,
+    # a new one unless hold_id (e.g. the cart id) is passed
+    # Holds are kept in memory only, they are not part of snapshots or the log
+    def hold_stock(self, items, ttl: float, hold_id=None):
+        totals = {}
+        for product_id, quantity in items:
+            if product_id not in self.products:
+                raise ValueError("Unable to find the product using passed in id")
+            if quantity < 0:
+                raise ValueError("Quantity to hold can not be negative")
+            totals[product_id] = totals.get(product_id, 0) + quantity
+
+        self.expire_holds()
+        # Take the id first, the hold only becomes known once its stock is held
+        with self._holds_lock:
+            if hold_id is None:
+                hold_id = next(self._hold_ids)
+                while hold_id in self._holds:
+                    hold_id = next(self._hold_ids)
+            elif hold_id in self._holds:
+                raise ValueError("Hold Id must be unique. This id already exists")
+            self._holds[hold_id] = None
+
+        try:
+            with ExitStack() as stack:
+                for lock in self._stock_locks.locks_for(totals):
+                    stack.enter_context(lock)
+                short = [
+                    product_id
+                    for product_id, quantity in totals.items()
+                    if self._available(product_id) < quantity
+                ]
+                if short:
+                    raise ValueError(
+                        f"Not enough available stock for products {short}"
+                    )
+                for product_id, quantity in totals.items():
+                    self._held[product_id] = self._held.get(product_id, 0) + quantity
+        except BaseException:
+            with self._holds_lock:
+                del self._holds[hold_id]
+            raise
+
+        hold = StockHold(hold_id, totals, time.time() + ttl)
+        with self._holds_lock:
+            self._holds[hold_id] = hold
+            self._hold_wheel.schedule(hold_id, hold.expires_at)
+        return hold_id
+
+    # Give the stock of the hold back, e.g. an item removed from the cart
+    def release_hold(self, hold_id):
+        self._release_held([self._take_hold(hold_id)])
+
+    # Take the held stock out of the inventory, e.g. at checkout
+    # Returns the (product_id, quantity) taken. When a count or an update lowered
+    # the stock below what is held, nothing is taken, the hold stays and error is raised
+    @versioned_change
+    def commit_hold(self, hold_id):
+        hold = self._take_hold(hold_id)
+        try:
+            with ExitStack() as stack:
+                for lock in self._stock_locks.locks_for(hold.items):
+                    stack.enter_context(lock)
+                short = [
+                    product_id
+                    for product_id, quantity in hold.items.items()
+                    if self.products[product_id].quantity < quantity
+                ]
+                if short:
+                    raise ValueError(
+                        f"Not enough quantity in stock for products {short}"
+                    )
+
+                for product_id, quantity in hold.items.items():
+                    self._unhold(product_id, quantity)
+                    product = self.products[product_id]
+                    product.decreaseQuantity(quantity)
+                    self._stock_changed(product, product.quantity + quantity)
+                    if self.change_log is not None:
+                        self.change_log.append(
+                            "decrease_product_quantity",
+                            product_id,
+                            {
+                                "quantity": (
+                                    product.quantity + quantity,
+                                    product.quantity,
+                                )
+                            },
+                        )
+                self._version(
+                    [self.products[product_id] for product_id in hold.items]
+                )
+        except ValueError:
+            with self._holds_lock:
+                self._holds[hold_id] = hold
+                self._hold_wheel.schedule(hold_id, hold.expires_at)
+            raise
+        self._bump("quantity")
+        return list(hold.items.items())
+
+    # Keep the hold for ttl seconds from now, e.g. when the cart is used again
+    def extend_hold(self, hold_id, ttl: float):
+        self.expire_holds()
+        with self._holds_lock:
+            hold = self._holds.get(hold_id)
+            if hold is None:
+                raise ValueError("Unable to find the hold using passed in id")
+            hold.expires_at = time.time() + ttl
+            self._hold_wheel.schedule(hold_id, hold.expires_at)
+
+    # Give back the stock of every hold that expired by now, returns their ids
+    # Called by the hold methods, the sales and the stock reads, a timer can call
+    # it too so expired holds go back even while no one asks
+    # Only the holds that expired are visited, the timing wheel never scans the rest
+    def expire_holds(self, now: float = None):
+        # Nothing is held, so sales don't pay for the lock
+        if not self._hold_wheel:
+            return []
+        with self._holds_lock:
+            expired = [
+                self._holds.pop(hold_id)
+                for hold_id in self._hold_wheel.advance(now)
+            ]
+        if expired:
+            self._release_held(expired)
+        return [hold.hold_id for hold in expired]
+
+    # The hold with the passed in id, None if it is unknown or already gone
+    def get_hold(self, hold_id):
+        self.expire_holds()
+        with self._holds_lock:
+            return self._holds.get(hold_id)
+
+    # Units of the product held by holds
+    def held_quantity(self, product_id: int) -> int:
+        if product_id not in self.products:
+            raise ValueError("Unable to find the product using passed in id")
+        self.expire_holds()
+        return self._held.get(product_id, 0)
+
+    # Units of the product that can still be sold: on hand (Product.quantity)
+    # minus held. Below zero when a count or an update lowered the stock on
+    # hand under what is held
+    def available_quantity(self, product_id: int) -> int:
+        if product_id not in self.products:
+            raise ValueError("Unable to find the product using passed in id")
+        self.expire_holds()
+        return self._available(product_id)
+
+    # Units of the product that can be sold without expiring holds first
+    # Called holding the product's stripe lock
+    def _available(self, product_id: int) -> int:
+        return self.products[product_id].quantity - self._held.get(product_id, 0)
+
+    # Forget the hold with the passed in id and stop its expiry, returns the hold
+    def _take_hold(self, hold_id) -> StockHold:
+        with self._holds_lock:
+            hold = self._holds.get(hold_id)
+            if hold is None:
+                raise ValueError("Unable to find the hold using passed in id")
+            del self._holds[hold_id]
+            self._hold_wheel.cancel(hold_id)
+        return hold
+
+    # Give the units of the holds back, taking the locks of their stripes once
+    def _release_held(self, holds):
+        totals = {}
+        for hold in holds:
+            for product_id, quantity in hold.items.items():
+                totals[product_id] = totals.get(product_id, 0) + quantity
+        with ExitStack() as stack:
+            for lock in self._stock_locks.locks_for(totals):
+                stack.enter_context(lock)
+            for product_id, quantity in totals.items():
+                self._unhold(product_id, quantity)
+
+    # Lower the units held of the product, called holding its stripe lock
+    def _unhold(self, product_id: int, quantity: int):
+        left = self._held[product_id] - quantity
+        if left:
+            self._held[product_id] = left
+        else:
+            del self._held[product_id]
+
+    ## ******************************************** ##
+    # Inventory Stock Reconciliation
+    ## ******************************************** ##
+
+    # Set the stock of the products to the quantities counted in a warehouse, from
+    # dicts like {"id": 1, "quantity": 40}, and return the variance report
+    # Rows can come from a list, a generator, read_csv_rows or read_json_lines
+    # The feed is read and checked first without holding any lock. Then all the
+    # counts are set in one pass holding the locks of their stripes, so no other
+    # stock change lands in the middle of the reconciliation, and a versioned
+    # inventory publishes them as one snapshot. Searches never wait for it.
+    # A bad row, an unknown product or a product counted twice is reported in the
+    # result and the rest of the rows are still applied
+    def reconcile_counts(self, rows) -> ReconciliationResult:
+        result = ReconciliationResult()
+        # Local names avoid attribute lookups in the loop
+        products = self.products
+        counts = {}
+        for row_number, row in enumerate(rows, start=1):
+            try:
+                product_id = int(row["id"])
+                counted = int(row["quantity"])
+            except (KeyError, TypeError, ValueError, AttributeError) as error:
+                result.errors.append((row_number, row, f"Invalid row: {error!r}"))
+                continue
+
+            if product_id not in products:
+                result.errors.append(
+                    (row_number, row, "Unable to find the product using passed in id")
+                )
+            elif counted < 0:
+                result.errors.append(
+                    (row_number, row, "Counted quantity can not be negative")
+                )
+            elif product_id in counts:
+                result.errors.append(
+                    (row_number, row, "Product was already counted in this feed")
+                )
+            else:
+                counts[product_id] = counted
+
+        self._apply_counts(counts, result)
+        return result
+
+    # Set the counted quantities while holding the locks of their stripes
+    # and add the variances to the result
+    @versioned_change
+    def _apply_counts(self, counts: dict, result: ReconciliationResult):
+        products = self.products
+        changed = []
+        with ExitStack() as stack:
+            for lock in self._stock_locks.locks_for(counts):
+                stack.enter_context(lock)
+
+            for product_id, counted in counts.items():
+                product = products[product_id]
+                if product.quantity != counted:
+                    changed.append((product, product.quantity))
+                    product.quantity = counted
+            self._stock_counts_changed(changed)
+            if self.change_log is not None:
+                for product, old_quantity in changed:
+                    self.change_log.append(
+                        "update_product",
+                        product.product_id,
+                        {"quantity": (old_quantity, product.quantity)},
+                    )
+            self._version([product for product, _ in changed])
+
+        result.counted += len(counts)
+        for product, old_quantity in changed:
+            difference = product.quantity - old_quantity
+            result.variances.append(
+                (product.product_id, old_quantity, product.quantity)
+            )
+            if difference > 0:
+                result.units_found += difference
+            else:
+                result.units_missing -= difference
+            result.value_difference += product.price * difference
+        if changed:
+            self._bump("quantity")
+
+    # Move products whose quantity changed in the stock heaps, the category stats
+    # and the prefix index, from (product, old quantity) pairs
+    # Called while holding the locks of their stripes
+    def _stock_counts_changed(self, changed):
+        if len(changed) <= len(self.products) // 8:
+            for product, old_quantity in changed:
+                self._stock_changed(product, old_quantity)
+            return
+
+        # Building the heaps again is cheaper than moving many products in them.
+        # A product of another stripe changing at the same time moves itself in
+        # the new heaps once it gets the stock heap lock
+        with self._stock_heap_lock:
+            self._stock_heap = IndexedHeap(
+                (product.product_id, product.quantity)
+                for product in self.products.values()
+            )
+            self._reorder_heap = IndexedHeap(
+                (product_id, self.products[product_id].quantity - threshold)
+                for product_id, threshold in self._reorder_thresholds.items()
+            )
+            for product, old_quantity in changed:
+                stats = self._live_category_stats(product.category)
+                if stats is not None:
+                    stats.change_quantity(
+                        product.price, product.quantity - old_quantity
+                    )
+                if self._product_prefix_index is not None:
+                    self._product_prefix_index.set_score(
+                        product.product_id, product.quantity
+                    )
+
+    ## ******************************************** ##
+    # Inventory Bulk Loading
+    ## ******************************************** ##
+
+    # Add many categories at once from dicts like {"id": 1, "name": "Produce", "status": True}
+    # Rows can come from a list, a generator, read_csv_rows or read_json_lines
+    # A bad row is reported in the result and the rest of the rows are still added
+    def add_categories_bulk(self, rows) -> BulkLoadResult:
+        result = BulkLoadResult()
+        for row_number, row in enumerate(rows, start=1):
+            try:
+                category_id = int(row["id"])
+                name = str(row["name"])
+                status = parse_status(row.get("status", True))
+            except (KeyError, TypeError, ValueError, AttributeError) as error:
+                result.errors.append((row_number, row, f"Invalid row: {error!r}"))
+                continue
+
+            if not self.is_category_id_unique(category_id):
+                result.errors.append(
+                    (row_number, row, "Category Id must be unique. This id already exists")
+                )
+                continue
+
+            self.add_new_category(category_id, name, status)
+            result.loaded += 1
+        return result
+
+    # Add many products at once from dicts like the ones used by the test cases
+    # {"id", "name", "price", "description", "category", "quantity"}
+    # Rows can come from a list, a generator, read_csv_rows or read_json_lines
+    # Rows are checked batch_size at a time and the indexes are built once at the end
+    # A bad row is reported in the result and the rest of the rows are still added
+    @versioned_change
+    def add_products_bulk(self, rows, batch_size: int = 10000) -> BulkLoadResult:
+        result = BulkLoadResult()
+        added = []
+        batch = []
+        try:
+            for row_number, row in enumerate(rows, start=1):
+                batch.append((row_number, row))
+                if len(batch) == batch_size:
+                    added.extend(self._add_product_batch(batch, result))
+                    batch = []
+            added.extend(self._add_product_batch(batch, result))
+        finally:
+            # Index whatever was added even when reading the rows failed
+            self._index_new_products(added)
+        return result
+
+    # Check a batch of (row number, row) and add the valid rows, returns the new products
+    def _add_product_batch(self, batch, result: BulkLoadResult):
+        # Local names avoid attribute lookups in the loop
+        products = self.products
+        categories = self.categories
+        change_log = self.change_log
+        added = []
+        for row_number, row in batch:
+            try:
+                product_id = int(row["id"])
+                name = str(row["name"])
+                price = float(row["price"])
+                description = str(row.get("description", ""))
+                category_id = int(row["category"])
+                quantity = int(row["quantity"])
+            except (KeyError, TypeError, ValueError, AttributeError) as error:
+                result.errors.append((row_number, row, f"Invalid row: {error!r}"))
+                continue
+
+            if product_id in products:
+                result.errors.append(
+                    (row_number, row, "Product with the same id already exists.")
+                )
+                continue
+            if category_id not in categories:
+                result.errors.append(
+                    (row_number, row, "Passed in category id is invalid")
+                )
+                continue
+
+            product = Product(
+                product_id,
+                name,
+                price,
+                description,
+                categories[category_id],
+                quantity,
+            )
+            if change_log is not None:
+                change_log.append("add_product", product_id, added_changes(product))
+            products[product_id] = product
+            added.append(product)
+        result.loaded += len(added)
+        return added
+
     # Finally a product to print the inventory class
     def __repr__(self):
         return f"Inventory Details \nCategories:{list(self.categories.values())}, \n\nProducts:{list(self.products.values())})"
@@ -269,394 +3907,634 @@ class Inventory:
 ## Test Cases
 ## ************************************* ##
 
-# Building the inventory class
-inventory = Inventory()
-print("##########################################")
-print("Initializing the Grocery Store Inventory")
-print("##########################################")
-
-# Loading categories to the inventory
-print("")
-print("##########################################")
-print("Loading categories to the inventory ...")
-# Creating a list of categories to be loaded
-categoriesList = [
-    {"id": 1, "name": "Vegetables", "status": True},
-    {"id": 2, "name": "Diary", "status": True},
-    {"id": 3, "name": "Meat", "status": True},
-    {"id": 4, "name": "Bakery", "status": True},
-    {"id": 5, "name": "Liquor", "status": True},
-    {"id": 6, "name": "Drinks", "status": True},
-    {"id": 7, "name": "Cleaning", "status": True},
-    {"id": 8, "name": "Health", "status": True},
-    {"id": 9, "name": "House", "status": True},
-]
-# A variable to store category addition execution times
-loadingCategoryExecutionTimes = []
-
-print("Loading categories ")
-for category in categoriesList:
-    # Calculating the execution time to load
+# Only run the test cases when this file is executed directly, not when imported
+if __name__ == "__main__":
+    # Building the inventory class, with trigram indexes for the name searches,
+    # the typo tolerant index for the fuzzy name search and the prefix indexes
+    # for the name completions
+    inventory = Inventory(name_index=True, fuzzy_index=True, autocomplete=True)
+    print("##########################################")
+    print("Initializing the Grocery Store Inventory")
+    print("##########################################")
+
+    # Loading categories to the inventory
+    print("")
+    print("##########################################")
+    print("Loading categories to the inventory ...")
+    # Creating a list of categories to be loaded
+    categoriesList = [
+        {"id": 1, "name": "Vegetables", "status": True},
+        {"id": 2, "name": "Diary", "status": True},
+        {"id": 3, "name": "Meat", "status": True},
+        {"id": 4, "name": "Bakery", "status": True},
+        {"id": 5, "name": "Liquor", "status": True},
+        {"id": 6, "name": "Drinks", "status": True},
+        {"id": 7, "name": "Cleaning", "status": True},
+        {"id": 8, "name": "Health", "status": True},
+        {"id": 9, "name": "House", "status": True},
+    ]
+    print("Loading categories ")
+    # Calculating the execution time to load all categories at once
+    start_time = time.time()
+    result = inventory.add_categories_bulk(categoriesList)
+    end_time = time.time()
+    exec_time = end_time - start_time
+    print(f"{result} in {exec_time} seconds")
+    for row_number, row, error in result.errors:
+        print(f"Category row {row_number} {row} failed: {error}")
+
+    print("##########################################")
+    print("")
+    print("##########################################")
+    print("Loading products to the inventory")
+
+    productsList = [
+        # Products for category vegetables (1)
+        {
+            "id": 1,
+            "name": "Mustard Greens Spinach",
+            "price": 1.49,
+            "description": "Spinach",
+            "category": 1,
+            "quantity": 100,
+        },
+        {
+            "id": 2,
+            "name": "Caluliflower",
+            "price": 3.50,
+            "description": "Per piece",
+            "category": 1,
+            "quantity": 50,
+        },
+        {
+            "id": 3,
+            "name": "Potato",
+            "price": 5.50,
+            "description": "5 lb bag",
+            "category": 1,
+            "quantity": 80,
+        },
+        {
+            "id": 4,
+            "name": "Coriander",
+            "price": 0.50,
+            "description": "Per piece",
+            "category": 1,
+            "quantity": 200,
+        },
+        # Products for category Diary (2)
+        {
+            "id": 5,
+            "name": "Whole Milk",
+            "price": 3.99,
+            "description": "Per piece",
+            "category": 2,
+            "quantity": 20,
+        },
+        {
+            "id": 6,
+            "name": "Eggnog",
+            "price": 4.99,
+            "description": "Per piece",
+            "category": 2,
+            "quantity": 10,
+        },
+        {
+            "id": 7,
+            "name": "Greek Yogurt",
+            "price": 5.99,
+            "description": "Per piece",
+            "category": 2,
+            "quantity": 30,
+        },
+        # Products for category Meat (3)
+        {
+            "id": 8,
+            "name": "Chicken Breast",
+            "price": 15.99,
+            "description": "3.99 per lbs",
+            "category": 3,
+            "quantity": 8,
+        },
+        {
+            "id": 9,
+            "name": "Chicken Leg Quarter",
+            "price": 6.99,
+            "description": "1.99 per lbs",
+            "category": 3,
+            "quantity": 12,
+        },
+        {
+            "id": 10,
+            "name": "Chicken Thigh",
+            "price": 10.99,
+            "description": "2.99 per lbs",
+            "category": 3,
+            "quantity": 15,
+        },
+        # Products for category Bakery (4)
+        {
+            "id": 11,
+            "name": "White Bread",
+            "price": 3.99,
+            "description": "Per piece",
+            "category": 4,
+            "quantity": 15,
+        },
+        {
+            "id": 12,
+            "name": "Bagel",
+            "price": 5.99,
+            "description": "Per Packet 4 pcs",
+            "category": 4,
+            "quantity": 7,
+        },
+        # Products for category Liquor (5)
+        {
+            "id": 13,
+            "name": "Corona Beer",
+            "price": 10.99,
+            "description": "4 cans",
+            "category": 5,
+            "quantity": 10,
+        },
+        {
+            "id": 14,
+            "name": "Hennessy",
+            "price": 80.99,
+            "description": "750 ml",
+            "category": 5,
+            "quantity": 10,
+        },
+        # Products for category Drinks (6)
+        {
+            "id": 15,
+            "name": "Coke",
+            "price": 1.99,
+            "description": "1 L",
+            "category": 6,
+            "quantity": 10,
+        },
+        {
+            "id": 16,
+            "name": "Fanta",
+            "price": 1.99,
+            "description": "1 L",
+            "category": 6,
+            "quantity": 13,
+        },
+        {
+            "id": 17,
+            "name": "Diet Coke",
+            "price": 2.50,
+            "description": "1 L",
+            "category": 6,
+            "quantity": 20,
+        },
+        {
+            "id": 18,
+            "name": "Diet Fanta",
+            "price": 3.50,
+            "description": "1 L",
+            "category": 6,
+            "quantity": 25,
+        },
+        # Products for category Cleaning (7)
+        {
+            "id": 19,
+            "name": "Dish Wash Liquid",
+            "price": 3.50,
+            "description": "500 ml",
+            "category": 7,
+            "quantity": 10,
+        },
+        {
+            "id": 20,
+            "name": "Dish Wash Scrub",
+            "price": 1.50,
+            "description": "Per piece",
+            "category": 7,
+            "quantity": 40,
+        },
+        # Products for category Health (8)
+        {
+            "id": 21,
+            "name": "Toothpaste",
+            "price": 2.50,
+            "description": "Per piece",
+            "category": 8,
+            "quantity": 20,
+        },
+        {
+            "id": 22,
+            "name": "Toothbrush",
+            "price": 4.50,
+            "description": "Per piece",
+            "category": 8,
+            "quantity": 25,
+        },
+        # Products for category House (9)
+        {
+            "id": 23,
+            "name": "Carpet Cleaner",
+            "price": 5.50,
+            "description": "Per piece",
+            "category": 9,
+            "quantity": 5,
+        },
+        {
+            "id": 24,
+            "name": "Mop",
+            "price": 14.50,
+            "description": "Per piece",
+            "category": 9,
+            "quantity": 2,
+        },
+    ]
+
+    # Calculating the execution time to load all products at once
+    start_time = time.time()
+    result = inventory.add_products_bulk(productsList)
+    end_time = time.time()
+    exec_time = end_time - start_time
+    print(f"{result} in {exec_time} seconds")
+    for row_number, row, error in result.errors:
+        print(f"Product row {row_number} {row} failed: {error}")
+    print("##########################################")
+
+    print("")
+    print("##########################################")
+    print("Current inventory status")
+    print(inventory)
+
+
+    print("")
+    print("##########################################")
+    print("Testing the functions")
+
+    print("")
+    print("##########################################")
+    print("Test for class Category")
+    print("##########################################")
+    print("Updating category 1 name from Vegetables to Produce")
+    print("Before Update: ", inventory.categories[1])
+    start_time = time.time()
+    inventory.update_category(1, "Produce")
+    end_time = time.time()
+    exec_time = end_time - start_time
+    print("After Update: ", inventory.categories[1])
+    print(f"Update took about {exec_time} seconds")
+
+    print("")
+    print("Adding a new category with id 10")
+    inventory.add_new_category(10, "Electronics", True)
+    print("\nUpdated categories list")
+    for i in range(len(inventory.categories)):
+        print(inventory.categories[i + 1])
+
+    print("\nFind the category by name - produce")
     start_time = time.time()
-    inventory.add_new_category(category["id"], category["name"], category["status"])
+    categories = inventory.search_category_by_name("Produce")
     end_time = time.time()
     exec_time = end_time - start_time
-    # Add this execution times to a list
-    loadingCategoryExecutionTimes.append(
-        {"categoryId": category["id"], "execution_time": exec_time}
+    print(f"Categories found {list(categories)} in {exec_time} seconds")
+
+    print("\nDeleting category - electornic")
+    print(
+        f"Before delete using search to find electronics - {inventory.search_category_by_name("Electronics")}"
     )
+    start_time = time.time()
+    inventory.delete_category(10)
+    end_time = time.time()
     print(
-        f"Category with Id: {category['id']}, Name: {category['name']}, Status: {category['status']} loaded in {exec_time} seconds"
+        f"After delete using search to find electronics - {inventory.search_category_by_name("Electronics")}"
     )
+    print("##########################################")
 
-print("##########################################")
-print("")
-print("##########################################")
-print("Loading products to the inventory")
-
-productsList = [
-    # Products for category vegetables (1)
-    {
-        "id": 1,
-        "name": "Mustard Greens Spinach",
-        "price": 1.49,
-        "description": "Spinach",
-        "category": 1,
-        "quantity": 100,
-    },
-    {
-        "id": 2,
-        "name": "Caluliflower",
-        "price": 3.50,
-        "description": "Per piece",
-        "category": 1,
-        "quantity": 50,
-    },
-    {
-        "id": 3,
-        "name": "Potato",
-        "price": 5.50,
-        "description": "5 lb bag",
-        "category": 1,
-        "quantity": 80,
-    },
-    {
-        "id": 4,
-        "name": "Coriander",
-        "price": 0.50,
-        "description": "Per piece",
-        "category": 1,
-        "quantity": 200,
-    },
-    # Products for category Diary (2)
-    {
-        "id": 5,
-        "name": "Whole Milk",
-        "price": 3.99,
-        "description": "Per piece",
-        "category": 2,
-        "quantity": 20,
-    },
-    {
-        "id": 6,
-        "name": "Eggnog",
-        "price": 4.99,
-        "description": "Per piece",
-        "category": 2,
-        "quantity": 10,
-    },
-    {
-        "id": 7,
-        "name": "Greek Yogurt",
-        "price": 5.99,
-        "description": "Per piece",
-        "category": 2,
-        "quantity": 30,
-    },
-    # Products for category Meat (3)
-    {
-        "id": 8,
-        "name": "Chicken Breast",
-        "price": 15.99,
-        "description": "3.99 per lbs",
-        "category": 3,
-        "quantity": 8,
-    },
-    {
-        "id": 9,
-        "name": "Chicken Leg Quarter",
-        "price": 6.99,
-        "description": "1.99 per lbs",
-        "category": 3,
-        "quantity": 12,
-    },
-    {
-        "id": 10,
-        "name": "Chicken Thigh",
-        "price": 10.99,
-        "description": "2.99 per lbs",
-        "category": 3,
-        "quantity": 15,
-    },
-    # Products for category Bakery (4)
-    {
-        "id": 11,
-        "name": "White Bread",
-        "price": 3.99,
-        "description": "Per piece",
-        "category": 4,
-        "quantity": 15,
-    },
-    {
-        "id": 12,
-        "name": "Bagel",
-        "price": 5.99,
-        "description": "Per Packet 4 pcs",
-        "category": 4,
-        "quantity": 7,
-    },
-    # Products for category Liquor (5)
-    {
-        "id": 13,
-        "name": "Corona Beer",
-        "price": 10.99,
-        "description": "4 cans",
-        "category": 5,
-        "quantity": 10,
-    },
-    {
-        "id": 14,
-        "name": "Hennessy",
-        "price": 80.99,
-        "description": "750 ml",
-        "category": 5,
-        "quantity": 10,
-    },
-    # Products for category Drinks (6)
-    {
-        "id": 15,
-        "name": "Coke",
-        "price": 1.99,
-        "description": "1 L",
-        "category": 6,
-        "quantity": 10,
-    },
-    {
-        "id": 16,
-        "name": "Fanta",
-        "price": 1.99,
-        "description": "1 L",
-        "category": 6,
-        "quantity": 13,
-    },
-    {
-        "id": 17,
-        "name": "Diet Coke",
-        "price": 2.50,
-        "description": "1 L",
-        "category": 6,
-        "quantity": 20,
-    },
-    {
-        "id": 18,
-        "name": "Diet Fanta",
-        "price": 3.50,
-        "description": "1 L",
-        "category": 6,
-        "quantity": 25,
-    },
-    # Products for category Cleaning (7)
-    {
-        "id": 19,
-        "name": "Dish Wash Liquid",
-        "price": 3.50,
-        "description": "500 ml",
-        "category": 7,
-        "quantity": 10,
-    },
-    {
-        "id": 20,
-        "name": "Dish Wash Scrub",
-        "price": 1.50,
-        "description": "Per piece",
-        "category": 7,
-        "quantity": 40,
-    },
-    # Products for category Health (8)
-    {
-        "id": 21,
-        "name": "Toothpaste",
-        "price": 2.50,
-        "description": "Per piece",
-        "category": 8,
-        "quantity": 20,
-    },
-    {
-        "id": 22,
-        "name": "Toothbrush",
-        "price": 4.50,
-        "description": "Per piece",
-        "category": 8,
-        "quantity": 25,
-    },
-    # Products for category House (9)
-    {
-        "id": 23,
-        "name": "Carpet Cleaner",
-        "price": 5.50,
-        "description": "Per piece",
-        "category": 9,
-        "quantity": 5,
-    },
-    {
-        "id": 24,
-        "name": "Mop",
-        "price": 14.50,
-        "description": "Per piece",
-        "category": 9,
-        "quantity": 2,
-    },
-]
-
-# A variable to store product addition execution times
-loadingProductsExecutionTimes = []
-for product in productsList:
-    # Calculating the execution time to load
+    print("\n\n##########################################")
+    print("Test for class Products")
+    print("##########################################")
+
+    print("Updating product 1 price from 1.49 to 1.99")
+    print("Before Update: ", inventory.products[1])
     start_time = time.time()
-    inventory.add_product(
-        product["id"],
-        product["name"],
-        product["price"],
-        product["description"],
-        product["category"],
-        product["quantity"],
-    )
+    inventory.update_product(1, None, 1.99, None, None, None)
     end_time = time.time()
     exec_time = end_time - start_time
-    # Add this execution times to a list
-    loadingProductsExecutionTimes.append(
-        {"product_id": product["id"], "execution_time": exec_time}
+    print("After Update: ", inventory.products[1])
+    print(f"Update took about {exec_time} seconds")
+
+    print("\nIncrease the quanity of product id 1 by 25")
+    start_time = time.time()
+    inventory.increase_product_quantity(1, 25)
+    end_time = time.time()
+    exec_time = end_time - start_time
+    print("After Update: ", inventory.products[1])
+    print(f"Update took about {exec_time} seconds")
+
+    print("\nDecrease the quanity of product id 1 by 5")
+    start_time = time.time()
+    inventory.decrease_product_quantity(1, 5)
+    end_time = time.time()
+    exec_time = end_time - start_time
+    print("After Update: ", inventory.products[1])
+    print(f"Update took about {exec_time} seconds")
+
+    print("\nGet product price history")
+    start_time = time.time()
+    priceHistory = inventory.get_product_price_history(1)
+    end_time = time.time()
+    exec_time = end_time - start_time
+    print("Price History of product 1: ", priceHistory)
+    print(f"Extraction took about {exec_time} seconds")
+
+    print("\nGet product price at the time it was added")
+    start_time = time.time()
+    price = inventory.price_at(1, priceHistory[0][0])
+    end_time = time.time()
+    exec_time = end_time - start_time
+    print("Price of product 1 when it was added: ", price)
+    print(f"Extraction took about {exec_time} seconds")
+
+    print("\nSearch product by name")
+    start_time = time.time()
+    products = inventory.search_product_by_name("mustard greens")
+    end_time = time.time()
+    exec_time = end_time - start_time
+    print("Searching for product with name mustard greens: ", products)
+    print(f"Extraction took about {exec_time} seconds")
+
+    print("\nSearch product by price range")
+    start_time = time.time()
+    products = inventory.search_product_by_price_range(5.99, 10.99)
+    end_time = time.time()
+    exec_time = end_time - start_time
+    print("Searching for product with within price range 5.99-10.99: ", products)
+    print(f"Extraction took about {exec_time} seconds")
+
+    print("\nSearch product with price of at least 15.00")
+    start_time = time.time()
+    products = inventory.search_product_by_min_price(15.00)
+    end_time = time.time()
+    exec_time = end_time - start_time
+    print("Searching for product with price 15.00 or more: ", products)
+    print(f"Extraction took about {exec_time} seconds")
+
+    print("\nSearch product with price of at most 1.50")
+    start_time = time.time()
+    products = inventory.search_product_by_max_price(1.50)
+    end_time = time.time()
+    exec_time = end_time - start_time
+    print("Searching for product with price 1.50 or less: ", products)
+    print(f"Extraction took about {exec_time} seconds")
+
+    print("\nSearch product by category id")
+    start_time = time.time()
+    products = inventory.search_product_by_category_id(1)
+    end_time = time.time()
+    exec_time = end_time - start_time
+    print("Searching for product with category 1 ", products)
+    print(f"Extraction took about {exec_time} seconds")
+
+    print("\nSearch product by category name produce")
+    start_time = time.time()
+    products = inventory.search_product_by_category_name("produce")
+    end_time = time.time()
+    exec_time = end_time - start_time
+    print("Searching for product with category 1 ", products)
+    print(f"Extraction took about {exec_time} seconds")
+    print("##########################################")
+
+    print("\n\n##########################################")
+    print("Test for inventory instrumentation")
+    print("##########################################")
+    instrumentation = inventory.enable_instrumentation(print_instrumentation_report)
+    inventory.search_product_by_name("chicken")
+    inventory.search_product_by_price_range(1.00, 5.00)
+    inventory.search_product_by_category_id(6)
+    inventory.increase_product_quantity(24, 10)
+    try:
+        inventory.decrease_product_quantity(24, 1000)
+    except ValueError as error:
+        print("Decrease of product 24 by 1000 failed:", error)
+    instrumentation.export()
+    inventory.disable_instrumentation()
+    print("##########################################")
+
+    print("\n\n##########################################")
+    print("Test for the query cache")
+    print("##########################################")
+    inventory.query_cache = QueryCache(max_entries=256)
+    print("Searching category 1 twice, the second search is read from the cache")
+    first = inventory.search_product_by_category_id(1)
+    second = inventory.search_product_by_category_id(1)
+    print("Same result both times:", first == second)
+    print("Stats:", inventory.query_cache.stats())
+
+    print("\nMoving product 1 to category 2, the cached result of category 1 is stale")
+    inventory.update_product(1, category_id=2)
+    products = inventory.search_product_by_category_id(1)
+    print("Product 1 still in category 1:", inventory.products[1] in products)
+    print("Stats:", inventory.query_cache.stats())
+    print("##########################################")
+
+    print("\n\n##########################################")
+    print("Test for reorder thresholds")
+    print("##########################################")
+    print("Products with the least stock:")
+    for product in inventory.lowest_stock(3):
+        print(" ", product)
+
+    print("\nReorder products 1 and 2 when 50 or fewer are left, product 3 at 5")
+    inventory.set_reorder_threshold(1, 50)
+    inventory.set_reorder_threshold(2, 50)
+    inventory.set_reorder_threshold(3, 5)
+    print("Products to reorder:", inventory.below_threshold())
+
+    print("\nDecrease the quanity of product id 3 to its threshold")
+    inventory.update_product(3, quantity=5)
+    print("Products to reorder:", inventory.below_threshold())
+    print("##########################################")
+
+    print("\n\n##########################################")
+    print("Test for the query builder")
+    print("##########################################")
+    print("Products of category 1 under 5.00 with at least 10 in stock, cheapest first")
+    query = (
+        inventory.query()
+        .category(1)
+        .price(max_price=5.00)
+        .quantity(min_quantity=10)
+        .order_by("price")
+    )
+    print("Plan:", query.explain())
+    for product in query:
+        print(" ", product)
+
+    print("\nEvery product by price, 5 per page")
+    page = inventory.query().order_by("price").limit(5).all()
+    page_number = 1
+    while page:
+        print(f"Page {page_number}:", [product.product_id for product in page])
+        page = inventory.query().order_by("price").after(page[-1]).limit(5).all()
+        page_number += 1
+    print("##########################################")
+
+    print("\n\n##########################################")
+    print("Test for category stats")
+    print("##########################################")
+    print("Stats of category 6:", inventory.get_category_stats(6))
+    print("\nIncrease the quanity of product id 15 by 10")
+    inventory.increase_product_quantity(15, 10)
+    print("Stats of category 6:", inventory.get_category_stats(6))
+    print("\nStats of every category")
+    for category_id, stats in inventory.get_all_category_stats().items():
+        print(f"  {category_id}: {stats}")
+    print("##########################################")
+
+    print("\n\n##########################################")
+    print("Test for the fuzzy name search")
+    print("##########################################")
+    for searched in ["cauliflower", "chiken brest", "mustrd greens"]:
+        start_time = time.time()
+        products = inventory.search_product_by_name_fuzzy(searched, limit=3)
+        end_time = time.time()
+        exec_time = end_time - start_time
+        print(f"Searching for {searched}: ", products)
+        print(f"Extraction took about {exec_time} seconds")
+    print("##########################################")
+
+    print("\n\n##########################################")
+    print("Test for the name autocomplete")
+    print("##########################################")
+    for typed in ["c", "ch", "Chicken B"]:
+        start_time = time.time()
+        products = inventory.autocomplete_product_name(typed, limit=3)
+        end_time = time.time()
+        exec_time = end_time - start_time
+        print(f"Completing {typed}: ", [product.name for product in products])
+        print(f"Extraction took about {exec_time} seconds")
+    # Selling most of the stock of the first completion moves it down the list
+    first = inventory.autocomplete_product_name("c", limit=1)[0]
+    inventory.decrease_product_quantity(first.product_id, first.quantity - 1)
+    print(
+        "After selling most of the stock: ",
+        [product.name for product in inventory.autocomplete_product_name("c", limit=3)],
+    )
+    print(
+        "Completing categories starting with d: ",
+        inventory.autocomplete_category_name("d"),
+    )
+    print("##########################################")
+
+    print("\n\n##########################################")
+    print("Test for the change subscriptions")
+    print("##########################################")
+    inventory.change_log = ChangeLog(capacity=1024)
+    with inventory.subscribe() as changes:
+        inventory.update_product(1, price=2.49, quantity=100)
+        inventory.decrease_product_quantity(1, 5)
+        inventory.add_new_category(11, "Frozen Food")
+        inventory.update_category(11, status=False)
+        print("Changes since subscribing:")
+        for event in changes.poll():
+            print(f"  {event}")
+        cursor = changes.cursor
+    inventory.increase_product_quantity(1, 5)
+    with inventory.subscribe(cursor) as changes:
+        print("Continuing from the saved cursor: ", changes.poll())
+    print("##########################################")
+
+    print("\n\n##########################################")
+    print("Test for the snapshot reads")
+    print("##########################################")
+    # A versioned inventory keeps point in time snapshots readers scan without locks
+    versioned = Inventory(versioned=True)
+    versioned.add_new_category(1, "Produce")
+    versioned.add_product(1, "Apple", 1.99, "Per piece", 1, 50)
+    versioned.add_product(2, "Banana", 0.59, "Per piece", 1, 80)
+    before = versioned.read_snapshot()
+    # Moving stock in one write batch, a snapshot has both changes or neither
+    with versioned.write_batch():
+        versioned.decrease_product_quantity(1, 10)
+        versioned.increase_product_quantity(2, 10)
+    versioned.update_category(1, name="Fresh Produce")
+    after = versioned.read_snapshot()
+    print(f"Snapshot {before.version}: ", before.search_product_by_category_name("produce"))
+    print(f"Snapshot {after.version}: ", after.search_product_by_category_name("fresh"))
+    print("Categories in the first snapshot: ", list(before.categories.values()))
+    print("##########################################")
+
+    print("\n\n##########################################")
+    print("Test for the price change reports")
+    print("##########################################")
+    inventory.price_changes = PriceChangeIndex()
+    # Reprice some products, one change every 10 minutes from now on
+    start = time.time()
+    for step, (product_id, price) in enumerate(
+        [(3, 1.29), (15, 12.99), (22, 4.49), (3, 0.99), (24, 11.99), (15, 10.99)]
+    ):
+        inventory.update_product(
+            product_id, price=price, timestamp=start + step * 600
+        )
+    print("Changes in the first 30 minutes:")
+    for change in inventory.price_changes_between(start, start + 1800):
+        print(f"  {change}")
+    print("Largest 3 changes:")
+    for change in inventory.largest_price_changes(start, k=3):
+        print(f"  {change} ({change.relative_change:+.1%})")
+    print("Changes by category: ", inventory.price_change_rollup(start))
+    print("##########################################")
+
+    print("\n\n##########################################")
+    print("Test for the stock reconciliation")
+    print("##########################################")
+    # A warehouse count feed, as read_csv_rows would give it
+    count_feed = [
+        {"id": "2", "quantity": "18"},
+        {"id": "5", "quantity": "0"},
+        {"id": "9", "quantity": "12"},
+        {"id": "9", "quantity": "13"},
+        {"id": "404", "quantity": "7"},
+    ]
+    print("Before: ", [inventory.products[i].quantity for i in (2, 5, 9)])
+    report = inventory.reconcile_counts(count_feed)
+    print(report)
+    print("Variances (id, on record, counted): ", report.variances)
+    for row_number, row, error in report.errors:
+        print(f"  Row {row_number} {row}: {error}")
+    print("After: ", [inventory.products[i].quantity for i in (2, 5, 9)])
+    print("##########################################")
+
+    print("\n\n##########################################")
+    print("Test for the stock holds")
+    print("##########################################")
+    # Two carts hold stock of product 16, only what is left can still be sold
+    first_cart = inventory.hold_stock([(16, 5), (17, 2)], ttl=900)
+    second_cart = inventory.hold_stock([(16, 3)], ttl=0.5, hold_id="cart-42")
+    print(
+        "Product 16 on hand:",
+        inventory.products[16].quantity,
+        "held:",
+        inventory.held_quantity(16),
+        "available:",
+        inventory.available_quantity(16),
     )
+    try:
+        inventory.decrease_product_quantity(16, inventory.products[16].quantity)
+    except ValueError as error:
+        print("Selling all the stock on hand: ", error)
+    print("Checking out the first cart: ", inventory.commit_hold(first_cart))
+    # The second cart is abandoned, once its hold expires a sale can take the stock
+    time.sleep(1.5)
+    print("Selling the 8 on hand after the second cart expired")
+    inventory.decrease_product_quantity(16, 8)
     print(
-        f"Product with Id: {product['id']}, Name: {product['name']} loaded in {exec_time} seconds"
+        "Product 16 on hand:",
+        inventory.products[16].quantity,
+        "held:",
+        inventory.held_quantity(16),
+        "hold cart-42:",
+        inventory.get_hold("cart-42"),
     )
-print("##########################################")
-
-print("")
-print("##########################################")
-print("Current inventory status")
-print(inventory)
-
-
-print("")
-print("##########################################")
-print("Testing the functions")
-
-print("")
-print("##########################################")
-print("Test for class Category")
-print("##########################################")
-print("Updating category 1 name from Vegetables to Produce")
-print("Before Update: ", inventory.categories[1])
-start_time = time.time()
-inventory.update_category(1, "Produce")
-end_time = time.time()
-exec_time = end_time - start_time
-print("After Update: ", inventory.categories[1])
-print(f"Update took about {exec_time} seconds")
-
-print("")
-print("Adding a new category with id 10")
-inventory.add_new_category(10, "Electronics", True)
-print("\nUpdated categories list")
-for i in range(len(inventory.categories)):
-    print(inventory.categories[i + 1])
-
-print("\nFind the category by name - produce")
-start_time = time.time()
-categories = inventory.search_category_by_name("Produce")
-end_time = time.time()
-exec_time = end_time - start_time
-print(f"Categories found {list(categories)} in {exec_time} seconds")
-
-print("\nDeleting category - electornic")
-print(
-    f"Before delete using search to find electronics - {inventory.search_category_by_name("Electronics")}"
-)
-start_time = time.time()
-inventory.delete_category(10)
-end_time = time.time()
-print(
-    f"After delete using search to find electronics - {inventory.search_category_by_name("Electronics")}"
-)
-print("##########################################")
-
-print("\n\n##########################################")
-print("Test for class Products")
-print("##########################################")
-
-print("Updating product 1 price from 1.49 to 1.99")
-print("Before Update: ", inventory.products[1])
-start_time = time.time()
-inventory.update_product(1, None, 1.99, None, None, None)
-end_time = time.time()
-exec_time = end_time - start_time
-print("After Update: ", inventory.products[1])
-print(f"Update took about {exec_time} seconds")
-
-print("\nIncrease the quanity of product id 1 by 25")
-start_time = time.time()
-inventory.increase_product_quantity(1, 25)
-end_time = time.time()
-exec_time = end_time - start_time
-print("After Update: ", inventory.products[1])
-print(f"Update took about {exec_time} seconds")
-
-print("\nDecrease the quanity of product id 1 by 5")
-start_time = time.time()
-inventory.decrease_product_quantity(1, 5)
-end_time = time.time()
-exec_time = end_time - start_time
-print("After Update: ", inventory.products[1])
-print(f"Update took about {exec_time} seconds")
-
-print("\nGet product price history")
-start_time = time.time()
-priceHistory = inventory.get_product_price_history(1)
-end_time = time.time()
-exec_time = end_time - start_time
-print("Price History of product 1: ", priceHistory)
-print(f"Extraction took about {exec_time} seconds")
-
-print("\nSearch product by name")
-start_time = time.time()
-products = inventory.search_product_by_name("mustard greens")
-end_time = time.time()
-exec_time = end_time - start_time
-print("Searching for product with name mustard greens: ", products)
-print(f"Extraction took about {exec_time} seconds")
-
-print("\nSearch product by price range")
-start_time = time.time()
-products = inventory.search_product_by_price_range(5.99, 10.99)
-end_time = time.time()
-exec_time = end_time - start_time
-print("Searching for product with within price range 5.99-10.99: ", products)
-print(f"Extraction took about {exec_time} seconds")
-
-print("\nSearch product by category id")
-start_time = time.time()
-products = inventory.search_product_by_category_id(1)
-end_time = time.time()
-exec_time = end_time - start_time
-print("Searching for product with category 1 ", products)
-print(f"Extraction took about {exec_time} seconds")
-
-print("\nSearch product by category name produce")
-start_time = time.time()
-products = inventory.search_product_by_category_name("produce")
-end_time = time.time()
-exec_time = end_time - start_time
-print("Searching for product with category 1 ", products)
-print(f"Extraction took about {exec_time} seconds")
-print("##########################################")
+    print("##########################################")
@@ -0,0 +1,1367 @@
+## *************************************************************** ##
+## MSCS 532 - Algorithms and Data Structures
+## Project Phase 2
+## Inventory Management System - Benchmarks
+## Shrisan kapali - 005032249
+## *************************************************************** ##
+
+## Benchmarks for the inventory on large synthetic catalogs
+## Run one of the benchmarks from the terminal, for example
+##   py benchmark.py memory --sizes 10000 100000
+##   py benchmark.py operations --sizes 1000 100000 --output new.json
+##   py benchmark.py compare old.json new.json
+##   py benchmark.py shards --workers 1 2 4 8
+##   py benchmark.py snapshots --readers 1 2 4 8
+##   py benchmark.py catalog --sizes 100000 1000000
+##   py benchmark.py service --connections 16 --depth 8
+##   py benchmark.py reconcile --sizes 100000 1000000
+##   py benchmark.py reconcile --store columnar --sizes 100000 1000000
+##   py benchmark.py holds --holds 10000 100000 1000000
+import argparse
+import asyncio
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+from inventory_service import InventoryClient, InventoryService
+from mapped_catalog import MappedInventory, export_catalog
+from Project_Phase_2 import ChangeLog, Inventory, PriceChangeIndex, QueryCache
+from sharded_inventory import ShardedInventory
+
+# Names used to build the synthetic catalog
+CATEGORY_NAMES = [
+    "Produce",
+    "Diary",
+    "Meat",
+    "Bakery",
+    "Liquor",
+    "Drinks",
+    "Cleaning",
+    "Health",
+    "House",
+    "Electronics",
+]
+PRODUCT_WORDS = [
+    "Chicken",
+    "Greek",
+    "Whole",
+    "Diet",
+    "White",
+    "Dish",
+    "Carpet",
+    "Organic",
+    "Fresh",
+    "Frozen",
+    "Spicy",
+    "Sweet",
+]
+DESCRIPTIONS = ["Per piece", "1 L", "500 ml", "5 lb bag", "Per Packet 4 pcs"]
+
+
+# Generate size product rows spread across the categories
+# The same seed always generates the same rows
+def synthetic_rows(size: int, seed: int = 532, first_id: int = 1):
+    rng = random.Random(seed)
+    for product_id in range(first_id, first_id + size):
+        yield {
+            "id": product_id,
+            "name": f"{rng.choice(PRODUCT_WORDS)} {rng.choice(PRODUCT_WORDS)} {product_id}",
+            "price": round(rng.uniform(0.5, 100.0), 2),
+            "description": rng.choice(DESCRIPTIONS),
+            "category": rng.randint(1, len(CATEGORY_NAMES)),
+            "quantity": rng.randint(0, 500),
+        }
+
+
+# Build a synthetic inventory with size products
+def build_inventory(size: int, inventory=None, seed: int = 532):
+    inventory = Inventory() if inventory is None else inventory
+    for category_id, name in enumerate(CATEGORY_NAMES, start=1):
+        inventory.add_new_category(category_id, name)
+
+    rows = synthetic_rows(size, seed)
+    # ColumnarInventory has no bulk load, it is filled one product at a time
+    if hasattr(inventory, "add_products_bulk"):
+        inventory.add_products_bulk(rows)
+    else:
+        for row in rows:
+            inventory.add_product(
+                row["id"],
+                row["name"],
+                row["price"],
+                row["description"],
+                row["category"],
+                row["quantity"],
+            )
+    return inventory
+
+
+# Write benchmark results to a JSON file, with the machine they were measured on
+def write_json(path: str, benchmark: str, results, label: str = None):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "benchmark": benchmark,
+                "label": label,
+                "python": platform.python_version(),
+                "machine": platform.platform(),
+                "results": results,
+            },
+            file,
+            indent=2,
+        )
+
+
+## ******************************************** ##
+# Memory benchmark
+## ******************************************** ##
+
+
+# Report the bytes used per product, including the inventory indexes
+# Uses tracemalloc, which slows down building the catalog a few times
+def benchmark_memory(sizes, make_inventory=Inventory):
+    results = []
+    print(f"{'Products':>12} {'Total MB':>12} {'Bytes/product':>14}")
+    for size in sizes:
+        gc.collect()
+        tracemalloc.start()
+        inventory = build_inventory(size, make_inventory())
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del inventory
+
+        results.append(
+            {"products": size, "bytes": used, "bytes_per_product": used / size}
+        )
+        print(f"{size:>12} {used / 2**20:>12.1f} {used / size:>14.1f}")
+    return results
+
+
+## ******************************************** ##
+# Stock mutation throughput benchmark
+## ******************************************** ##
+
+
+# Every thread reserves 1 to 3 random products (like a checkout) and puts the
+# stock back, reports the stock operations per second for every thread count
+# A small catalog (size) means more threads fight over the same products
+def benchmark_threads(thread_counts, size: int, operations: int, lock_stripes: int):
+    inventory = build_inventory(size, Inventory(lock_stripes=lock_stripes))
+    product_ids = list(inventory.products)
+    total_stock = sum(product.quantity for product in inventory.products.values())
+
+    results = []
+    print(f"{'Threads':>8} {'Ops/sec':>12} {'Rejected':>10}")
+    for thread_count in thread_counts:
+        per_thread = operations // thread_count
+        rejected = [0] * thread_count
+        barrier = threading.Barrier(thread_count + 1)
+
+        def checkout(worker: int):
+            rng = random.Random(worker)
+            barrier.wait()
+            for _ in range(per_thread):
+                items = [(rng.choice(product_ids), 1) for _ in range(rng.randint(1, 3))]
+                try:
+                    inventory.reserve(items)
+                except ValueError:
+                    rejected[worker] += 1
+                    continue
+                for product_id, quantity in items:
+                    inventory.increase_product_quantity(product_id, quantity)
+
+        threads = [
+            threading.Thread(target=checkout, args=(worker,))
+            for worker in range(thread_count)
+        ]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        done = per_thread * thread_count
+        results.append(
+            {
+                "threads": thread_count,
+                "operations": done,
+                "ops_per_second": done / elapsed,
+                "rejected": sum(rejected),
+            }
+        )
+        print(f"{thread_count:>8} {done / elapsed:>12.0f} {sum(rejected):>10}")
+
+    # Every reserve was put back, so no update may have been lost
+    assert total_stock == sum(p.quantity for p in inventory.products.values())
+    return results
+
+
+## ******************************************** ##
+# Snapshot read throughput benchmark
+## ******************************************** ##
+
+
+# Reader threads scan snapshots of a versioned inventory with a category name
+# search while one writer keeps reserving and restocking products, each order in
+# one write batch. Reports scans and orders per second for every reader count.
+# Every order is put back in its batch, so every scan must see the same total stock
+def benchmark_snapshots(reader_counts, size: int, duration: float):
+    inventory = build_inventory(size, Inventory(versioned=True))
+    product_ids = list(inventory.products)
+    total_stock = sum(product.quantity for product in inventory.products.values())
+
+    results = []
+    print(f"{'Readers':>8} {'Scans/sec':>12} {'Orders/sec':>12}")
+    for reader_count in reader_counts:
+        stop = threading.Event()
+        scans = [0] * reader_count
+        orders = [0]
+        torn = []
+
+        def reader(worker: int):
+            while not stop.is_set():
+                snapshot = inventory.read_snapshot()
+                snapshot.search_product_by_category_name("e")
+                stock = sum(product.quantity for product in snapshot.products.values())
+                if stock != total_stock:
+                    torn.append(snapshot.version)
+                scans[worker] += 1
+
+        def writer():
+            rng = random.Random(reader_count)
+            while not stop.is_set():
+                items = [(rng.choice(product_ids), 1) for _ in range(rng.randint(1, 3))]
+                with inventory.write_batch():
+                    try:
+                        inventory.reserve(items)
+                    except ValueError:
+                        continue
+                    for product_id, quantity in items:
+                        inventory.increase_product_quantity(product_id, quantity)
+                orders[0] += 1
+
+        threads = [threading.Thread(target=writer)] + [
+            threading.Thread(target=reader, args=(worker,))
+            for worker in range(reader_count)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        # A scan seeing part of an order would have a different total stock
+        assert not torn, f"Snapshots {torn[:10]} saw part of a write batch"
+        results.append(
+            {
+                "readers": reader_count,
+                "scans_per_second": sum(scans) / elapsed,
+                "orders_per_second": orders[0] / elapsed,
+            }
+        )
+        print(
+            f"{reader_count:>8} {sum(scans) / elapsed:>12.1f} "
+            f"{orders[0] / elapsed:>12.0f}"
+        )
+    return results
+
+
+## ******************************************** ##
+# Stock reconciliation benchmark
+## ******************************************** ##
+
+
+# A full count feed of the inventory, the variance share of the products is
+# counted with a different quantity than on record
+def count_feed(inventory, variance: float, rng: random.Random):
+    return [
+        {
+            "id": product.product_id,
+            "quantity": max(product.quantity + rng.randint(-5, 5), 0)
+            if rng.random() < variance
+            else product.quantity,
+        }
+        for product in inventory.products.values()
+    ]
+
+
+# Apply a full count feed one update_product call per row, then another with
+# reconcile_counts, while a reader thread keeps asking for the lowest stock.
+# Reports the seconds each took and the longest the reader waited for an answer.
+# ColumnarInventory is not made for threads, it is measured without the reader
+def benchmark_reconcile(sizes, variance: float, make_inventory=Inventory):
+    results = []
+    print(
+        f"{'Products':>10} {'Per row s':>10} {'Reconcile s':>12} "
+        f"{'Variances':>10} {'Reader max ms':>14}"
+    )
+    for size in sizes:
+        inventory = build_inventory(size, make_inventory())
+        rng = random.Random(size)
+
+        feed = count_feed(inventory, variance, rng)
+        start = time.perf_counter()
+        for row in feed:
+            inventory.update_product(row["id"], quantity=row["quantity"])
+        per_row = time.perf_counter() - start
+
+        stop = threading.Event()
+        waits = []
+
+        def reader():
+            while not stop.is_set():
+                asked = time.perf_counter()
+                inventory.lowest_stock(10)
+                waits.append(time.perf_counter() - asked)
+
+        feed = count_feed(inventory, variance, rng)
+        thread = threading.Thread(target=reader)
+        if hasattr(inventory, "lowest_stock"):
+            thread.start()
+        start = time.perf_counter()
+        report = inventory.reconcile_counts(feed)
+        reconcile = time.perf_counter() - start
+        stop.set()
+        if thread.is_alive():
+            thread.join()
+        max_wait = max(waits) if waits else None
+
+        results.append(
+            {
+                "size": size,
+                "per_row_seconds": per_row,
+                "reconcile_seconds": reconcile,
+                "variances": len(report.variances),
+                "reader_max_wait_seconds": max_wait,
+            }
+        )
+        print(
+            f"{size:>10} {per_row:>10.2f} {reconcile:>12.2f} "
+            f"{len(report.variances):>10} "
+            + (f"{max_wait * 1e3:>14.1f}" if waits else f"{'-':>14}")
+        )
+        del inventory, feed
+        gc.collect()
+    return results
+
+
+## ******************************************** ##
+# Stock hold benchmark
+## ******************************************** ##
+
+
+# Place hold_count cart holds of 1 to 3 products with a TTL of 1 to 60 minutes,
+# then expire them all at once. Reports the microseconds per hold placed, per
+# available stock read and per hold expired, which stay flat as holds grow
+def benchmark_holds(hold_counts, size: int):
+    results = []
+    print(f"{'Holds':>10} {'Hold us':>10} {'Available us':>13} {'Expire us':>10}")
+    for hold_count in hold_counts:
+        inventory = build_inventory(size)
+        for product in inventory.products.values():
+            product.quantity = 10**9
+        rng = random.Random(hold_count)
+        carts = [
+            [
+                (rng.randint(1, size), rng.randint(1, 3))
+                for _ in range(rng.randint(1, 3))
+            ]
+            for _ in range(hold_count)
+        ]
+        ttls = [rng.uniform(60, 3600) for _ in range(hold_count)]
+
+        start = time.perf_counter()
+        for items, ttl in zip(carts, ttls):
+            inventory.hold_stock(items, ttl)
+        hold = (time.perf_counter() - start) / hold_count
+
+        product_ids = [rng.randint(1, size) for _ in range(10**4)]
+        start = time.perf_counter()
+        for product_id in product_ids:
+            inventory.available_quantity(product_id)
+        available = (time.perf_counter() - start) / len(product_ids)
+
+        start = time.perf_counter()
+        expired = inventory.expire_holds(time.time() + 3601)
+        expire = (time.perf_counter() - start) / hold_count
+        assert len(expired) == hold_count
+
+        results.append(
+            {
+                "holds": hold_count,
+                "hold_seconds": hold,
+                "available_seconds": available,
+                "expire_seconds": expire,
+            }
+        )
+        print(
+            f"{hold_count:>10} {hold * 1e6:>10.2f} {available * 1e6:>13.2f} "
+            f"{expire * 1e6:>10.2f}"
+        )
+        del inventory, carts
+        gc.collect()
+    return results
+
+
+## ******************************************** ##
+# Memory mapped catalog benchmark
+## ******************************************** ##
+
+
+# Open the catalog in a worker process and answer one search, like a web worker
+# starting up. Sends back the seconds it took
+def open_catalog_worker(path: str, results):
+    start = time.perf_counter()
+    with MappedInventory(path) as inventory:
+        inventory.search_product_by_price_range(10.0, 11.0)
+    results.put(time.perf_counter() - start)
+
+
+# Compare a worker building its own Inventory with one mapping an exported
+# catalog: startup time, a product lookup and a name search for every size.
+# workers processes open the catalog at once to show the startup of each
+def benchmark_catalog(sizes, workers: int, path: str = "catalog.bin"):
+    results = []
+    print(
+        f"{'Products':>12} {'Build s':>9} {'Open ms':>9} {'Worker ms':>10} "
+        f"{'File MB':>9} {'Lookup us':>10} {'Name ms':>9} {'Mapped ms':>10}"
+    )
+    for size in sizes:
+        start = time.perf_counter()
+        inventory = build_inventory(size)
+        build = time.perf_counter() - start
+        export_catalog(inventory, path)
+
+        start = time.perf_counter()
+        catalog = MappedInventory(path)
+        opened = time.perf_counter() - start
+
+        queue = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=open_catalog_worker, args=(path, queue))
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        worker = max(queue.get() for _ in processes)
+        for process in processes:
+            process.join()
+
+        rng = random.Random(size)
+        lookup = measure(lambda _: catalog.products[rng.randint(1, size)].price)
+        # A rare name, a live scan of every product against one scan of the pages
+        name = measure(
+            lambda _: inventory.search_product_by_name(" 1234"), repeat=20, warmup=2
+        )
+        mapped = measure(
+            lambda _: catalog.search_product_by_name(" 1234"), repeat=20, warmup=2
+        )
+        result = {
+            "products": size,
+            "build_seconds": build,
+            "open_seconds": opened,
+            "worker_seconds": worker,
+            "file_bytes": os.path.getsize(path),
+            "lookup_ns": lookup["p50_ns"],
+            "name_search_ns": name["p50_ns"],
+            "mapped_name_search_ns": mapped["p50_ns"],
+        }
+        results.append(result)
+        print(
+            f"{size:>12} {build:>9.2f} {opened * 1e3:>9.2f} {worker * 1e3:>10.2f} "
+            f"{result['file_bytes'] / 2**20:>9.1f} {lookup['p50_ns'] / 1e3:>10.1f} "
+            f"{name['p50_ns'] / 1e6:>9.2f} {mapped['p50_ns'] / 1e6:>10.2f}"
+        )
+        catalog.close()
+        del inventory
+        gc.collect()
+    os.remove(path)
+    return results
+
+
+## ******************************************** ##
+# Inventory service load benchmark
+## ******************************************** ##
+
+
+# Serve a synthetic inventory in this process until it is stopped, used as the
+# target of the load generator. Sends the port it listens on to ports
+def serve_benchmark_inventory(size: int, ports, options: dict):
+    inventory = build_inventory(size)
+
+    async def serve():
+        service = InventoryService(inventory, **options)
+        ports.put(await service.start())
+        await service.serve_forever()
+
+    asyncio.run(serve())
+
+
+# Send requests for duration seconds from connections connections, each with
+# depth requests on the way at once. The mix is like a storefront: product
+# lookups, a few popular searches asked by many users, and stock changes.
+# Returns the latency of every request in seconds and the service stats
+async def generate_load(
+    port: int, size: int, connections: int, depth: int, duration: float
+):
+    clients = [await InventoryClient.connect(port=port) for _ in range(connections)]
+    latencies = []
+    # Popular price ranges and category names searched by many users at once
+    popular_prices = [round(1.0 + 4.9 * step, 2) for step in range(20)]
+    popular_categories = [name.lower() for name in CATEGORY_NAMES]
+    end = time.perf_counter() + duration
+
+    async def user(client: InventoryClient, seed: int):
+        rng = random.Random(seed)
+        while time.perf_counter() < end:
+            roll = rng.random()
+            start = time.perf_counter()
+            try:
+                if roll < 0.4:
+                    await client.call("get_product", product_id=rng.randint(1, size))
+                elif roll < 0.6:
+                    price = rng.choice(popular_prices)
+                    await client.call(
+                        "search_product_by_price_range",
+                        min_price=price,
+                        max_price=price + 0.05,
+                    )
+                elif roll < 0.65:
+                    await client.call(
+                        "autocomplete_category_name",
+                        prefix=rng.choice(popular_categories)[:2],
+                    )
+                elif roll < 0.85:
+                    await client.call(
+                        "decrease_product_quantity",
+                        product_id=rng.randint(1, size),
+                        quantity=1,
+                    )
+                else:
+                    await client.call(
+                        "increase_product_quantity",
+                        product_id=rng.randint(1, size),
+                        quantity=1,
+                    )
+            except ValueError:
+                pass  # out of stock is an answer too
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            user(client, number * depth + slot)
+            for number, client in enumerate(clients)
+            for slot in range(depth)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    stats = await clients[0].call("service_stats")
+    for client in clients:
+        await client.close()
+    return latencies, elapsed, stats
+
+
+# Requests per second and latency percentiles of the inventory service, first
+# with every request run on its own and then with read coalescing and quantity
+# micro batching. The service runs in its own process like a real one would
+def benchmark_service(
+    size: int, connections: int, depth: int, duration: float, batch_window: float
+):
+    setups = (
+        ("one by one", {"coalesce_reads": False, "max_batch": 1}),
+        ("coalesced", {"batch_window": batch_window}),
+    )
+    results = []
+    print(
+        f"{'Service':>12} {'Requests/sec':>13} {'p50 ms':>8} {'p99 ms':>8} "
+        f"{'p99.9 ms':>9} {'Coalesced':>10} {'Batch size':>11}"
+    )
+    for label, options in setups:
+        ports = multiprocessing.Queue()
+        server = multiprocessing.Process(
+            target=serve_benchmark_inventory, args=(size, ports, options), daemon=True
+        )
+        server.start()
+        try:
+            port = ports.get()
+            latencies, elapsed, stats = asyncio.run(
+                generate_load(port, size, connections, depth, duration)
+            )
+        finally:
+            server.terminate()
+            server.join()
+
+        latencies.sort()
+        batches = stats["quantity_batches"]
+        result = {
+            "service": label,
+            "requests": len(latencies),
+            "requests_per_second": len(latencies) / elapsed,
+            "p50_ms": percentile(latencies, 50) * 1e3,
+            "p99_ms": percentile(latencies, 99) * 1e3,
+            "p999_ms": percentile(latencies, 99.9) * 1e3,
+            "coalesced_reads": stats["coalesced_reads"],
+            "mean_batch_size": stats["batched_changes"] / batches if batches else 0,
+        }
+        results.append(result)
+        print(
+            f"{label:>12} {result['requests_per_second']:>13.0f} "
+            f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+            f"{result['p999_ms']:>9.2f} {result['coalesced_reads']:>10} "
+            f"{result['mean_batch_size']:>11.1f}"
+        )
+    return results
+
+
+## ******************************************** ##
+# Sharded inventory throughput benchmark
+## ******************************************** ##
+
+
+# Searches and single product operations per second of a ShardedInventory
+# for every worker count. clients threads send the requests at the same time.
+# Searches go to every shard, so they get faster as each shard holds fewer products,
+# single product operations go to one shard, so more shards serve more at once.
+# The row with 0 workers is a plain Inventory in this process for comparison.
+def benchmark_shards(
+    worker_counts, size: int, operations: int, clients: int, name_index: bool = False
+):
+    results = []
+    print(f"{'Workers':>8} {'Searches/sec':>14} {'Single ops/sec':>16}")
+    for workers in worker_counts:
+        if workers == 0:
+            inventory = Inventory(name_index=name_index)
+        else:
+            inventory = ShardedInventory(workers, name_index=name_index)
+        build_inventory(size, inventory)
+
+        # A rare name (one product) and a 1% price range, both read every shard
+        def search(rng: random.Random):
+            if rng.random() < 0.5:
+                inventory.search_product_by_name(f" {rng.randint(1, size)}")
+            else:
+                price = round(rng.uniform(0.5, 100.0), 2)
+                inventory.search_product_by_price_range(price, price + 1)
+
+        # Restock then sell one unit, both sent to the shard of the product
+        def single(rng: random.Random):
+            product_id = rng.randint(1, size)
+            inventory.increase_product_quantity(product_id, 1)
+            inventory.decrease_product_quantity(product_id, 1)
+
+        result = {"workers": workers}
+        for name, operation in (("searches", search), ("single", single)):
+            per_client = max(1, operations // clients)
+            barrier = threading.Barrier(clients + 1)
+
+            def client(seed: int):
+                rng = random.Random(seed)
+                barrier.wait()
+                for _ in range(per_client):
+                    operation(rng)
+
+            threads = [
+                threading.Thread(target=client, args=(seed,))
+                for seed in range(clients)
+            ]
+            for thread in threads:
+                thread.start()
+            barrier.wait()
+            start = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            result[f"{name}_per_second"] = (
+                per_client * clients / (time.perf_counter() - start)
+            )
+
+        if workers:
+            inventory.close()
+        del inventory
+        gc.collect()
+        results.append(result)
+        print(
+            f"{workers:>8} {result['searches_per_second']:>14.0f} "
+            f"{result['single_per_second']:>16.0f}"
+        )
+    return results
+
+
+## ******************************************** ##
+# Operation latency benchmark
+## ******************************************** ##
+
+
+# Value at the passed in percentile (0-100) of already sorted samples
+def percentile(samples, percent: float):
+    rank = max(0, min(len(samples) - 1, round(percent / 100 * len(samples)) - 1))
+    return samples[rank]
+
+
+# Time one operation: warmup calls first, then repeat timed samples in nanoseconds
+# setup runs before every call without being timed and its result is passed to run
+def measure(run, setup=None, repeat: int = 200, warmup: int = 20):
+    samples = []
+    for sample in range(warmup + repeat):
+        argument = setup() if setup else None
+        start = time.perf_counter_ns()
+        run(argument)
+        elapsed = time.perf_counter_ns() - start
+        if sample >= warmup:
+            samples.append(elapsed)
+
+    samples.sort()
+    return {
+        "samples": len(samples),
+        "min_ns": samples[0],
+        "p50_ns": percentile(samples, 50),
+        "p90_ns": percentile(samples, 90),
+        "p99_ns": percentile(samples, 99),
+        "max_ns": samples[-1],
+        "mean_ns": sum(samples) / len(samples),
+    }
+
+
+# (name, setup, run) of every Inventory operation for a catalog of size products
+# Read only operations come first, then changes that keep the catalog size and
+# last the operations that grow the catalog, so every search sees size products
+# The fuzzy name search compares every name without its index, so it is only
+# measured with fuzzy_index set
+def inventory_operations(
+    inventory, size: int, rng: random.Random, fuzzy_index: bool = False
+):
+    next_id = [size + 1]
+    temporary_categories = iter(range(10**6, 2 * 10**6))
+    random_id = lambda: rng.randint(1, size)
+    random_price = lambda: round(rng.uniform(0.5, 100.0), 2)
+
+    # A product word with one letter dropped, like a typo
+    def misspelled_word():
+        word = rng.choice(PRODUCT_WORDS)
+        position = rng.randrange(len(word))
+        return word[:position] + word[position + 1 :]
+
+    # Every 100th product gets a reorder threshold, quantities are 0 to 500
+    # so about 2% of those are at or below it
+    if hasattr(inventory, "set_reorder_threshold"):
+        for product_id in range(1, size + 1, 100):
+            inventory.set_reorder_threshold(product_id, 10)
+
+    # Every 100th product is repriced once, so the price change reports of the
+    # last hour read 1% of the catalog
+    if hasattr(inventory, "price_change_rollup"):
+        for product_id in range(50, size + 1, 100):
+            inventory.update_product(product_id, price=random_price())
+    last_hour = lambda: time.time() - 3600
+
+    # Reserve the next count product ids for new products
+    def new_ids(count: int) -> int:
+        first = next_id[0]
+        next_id[0] += count
+        return first
+
+    # Add a category that delete_category can then remove
+    def new_category():
+        category_id = next(temporary_categories)
+        inventory.add_new_category(category_id, "Temporary")
+        return category_id
+
+    # Put one unit back first so the stock of the product never runs out
+    def restocked_id():
+        product_id = random_id()
+        inventory.increase_product_quantity(product_id, 1)
+        return product_id
+
+    fuzzy_operations = [
+        (
+            "search_product_by_name_fuzzy",
+            misspelled_word,
+            inventory.search_product_by_name_fuzzy,
+        ),
+        (
+            "search_product_by_name_fuzzy_2_words",
+            lambda: f"{misspelled_word()} {misspelled_word()}",
+            inventory.search_product_by_name_fuzzy,
+        ),
+    ]
+
+    return (fuzzy_operations if fuzzy_index else []) + [
+        (
+            "search_category_by_name",
+            None,
+            lambda _: inventory.search_category_by_name("ea"),
+        ),
+        (
+            "search_product_by_name",
+            lambda: rng.choice(PRODUCT_WORDS).lower(),
+            inventory.search_product_by_name,
+        ),
+        (
+            "search_product_by_name_rare",
+            lambda: f" {random_id()}",
+            inventory.search_product_by_name,
+        ),
+        (
+            "search_product_by_price_range_1pct",
+            random_price,
+            lambda price: inventory.search_product_by_price_range(price, price + 1),
+        ),
+        (
+            "search_product_by_min_price_top_1pct",
+            None,
+            lambda _: inventory.search_product_by_min_price(99.0),
+        ),
+        (
+            "search_product_by_max_price_bottom_1pct",
+            None,
+            lambda _: inventory.search_product_by_max_price(1.5),
+        ),
+        (
+            "search_product_by_category_id",
+            lambda: rng.randint(1, 10),
+            inventory.search_product_by_category_id,
+        ),
+        (
+            "search_product_by_category_name",
+            lambda: rng.choice(CATEGORY_NAMES).lower(),
+            inventory.search_product_by_category_name,
+        ),
+        (
+            "query_category_by_price_page_20",
+            lambda: rng.randint(1, 10),
+            lambda category_id: inventory.query()
+            .category(category_id)
+            .order_by("price")
+            .limit(20)
+            .all(),
+        ),
+        (
+            "query_price_keyset_page_20",
+            lambda: inventory.products[random_id()],
+            lambda last: inventory.query().order_by("price").after(last).limit(20).all(),
+        ),
+        (
+            "query_name_and_price_20",
+            random_price,
+            lambda price: inventory.query()
+            .name(rng.choice(PRODUCT_WORDS))
+            .price(price, price + 10)
+            .limit(20)
+            .all(),
+        ),
+        (
+            "get_category_stats",
+            lambda: rng.randint(1, 10),
+            inventory.get_category_stats,
+        ),
+        (
+            "autocomplete_product_name",
+            lambda: rng.choice(PRODUCT_WORDS)[:2],
+            inventory.autocomplete_product_name,
+        ),
+        (
+            "autocomplete_product_name_2_words",
+            lambda: f"{rng.choice(PRODUCT_WORDS)} {rng.choice(PRODUCT_WORDS)[:2]}",
+            inventory.autocomplete_product_name,
+        ),
+        (
+            "autocomplete_category_name",
+            lambda: rng.choice(CATEGORY_NAMES)[:1],
+            inventory.autocomplete_category_name,
+        ),
+        ("lowest_stock_10", None, lambda _: inventory.lowest_stock(10)),
+        ("below_threshold", None, lambda _: inventory.below_threshold()),
+        (
+            "get_product_price_history",
+            random_id,
+            inventory.get_product_price_history,
+        ),
+        (
+            "price_at",
+            random_id,
+            lambda product_id: inventory.price_at(product_id, time.time()),
+        ),
+        (
+            "price_history_between",
+            random_id,
+            lambda product_id: inventory.price_history_between(
+                product_id, 0, time.time()
+            ),
+        ),
+        (
+            "price_changes_between_last_hour",
+            last_hour,
+            inventory.price_changes_between,
+        ),
+        (
+            "largest_price_changes_10_last_hour",
+            last_hour,
+            lambda start: inventory.largest_price_changes(start, k=10),
+        ),
+        (
+            "price_change_rollup_last_hour",
+            last_hour,
+            inventory.price_change_rollup,
+        ),
+        (
+            "update_category",
+            None,
+            lambda _: inventory.update_category(rng.randint(1, 10), status=True),
+        ),
+        ("delete_category", new_category, inventory.delete_category),
+        (
+            "update_product_price",
+            random_id,
+            lambda product_id: inventory.update_product(
+                product_id, price=random_price()
+            ),
+        ),
+        (
+            "update_product_category",
+            random_id,
+            lambda product_id: inventory.update_product(
+                product_id, category_id=rng.randint(1, 10)
+            ),
+        ),
+        (
+            "update_product_name",
+            random_id,
+            lambda product_id: inventory.update_product(
+                product_id, name=f"Renamed product {product_id}"
+            ),
+        ),
+        (
+            "set_reorder_threshold",
+            random_id,
+            lambda product_id: inventory.set_reorder_threshold(product_id, 10),
+        ),
+        (
+            "increase_product_quantity",
+            random_id,
+            lambda product_id: inventory.increase_product_quantity(product_id, 1),
+        ),
+        (
+            "decrease_product_quantity",
+            restocked_id,
+            lambda product_id: inventory.decrease_product_quantity(product_id, 1),
+        ),
+        (
+            "reserve_3_items",
+            lambda: [(restocked_id(), 1) for _ in range(3)],
+            inventory.reserve,
+        ),
+        (
+            "add_new_category",
+            lambda: next(temporary_categories),
+            lambda category_id: inventory.add_new_category(category_id, "Seasonal"),
+        ),
+        (
+            "add_product",
+            lambda: new_ids(1),
+            lambda product_id: inventory.add_product(
+                product_id, f"New product {product_id}", 9.99, "Per piece", 1, 10
+            ),
+        ),
+        (
+            "add_products_bulk_100",
+            lambda: list(synthetic_rows(100, rng.random(), new_ids(100))),
+            inventory.add_products_bulk,
+        ),
+    ]
+
+
+# Latency percentiles of every Inventory operation for every catalog size
+# With instrumented set, the inventory records its own stats to show the overhead
+# With query_cache set, repeated searches are answered by a QueryCache
+# With fuzzy_index set, the inventory keeps the typo tolerant name index
+# With autocomplete set, the inventory keeps the prefix indexes of the names
+# With change_log set, every change is recorded in a ChangeLog
+# With price_changes set, the price change reports read a PriceChangeIndex
+# instead of scanning the price histories
+def benchmark_operations(
+    sizes,
+    repeat: int,
+    warmup: int,
+    name_index: bool = False,
+    only=None,
+    instrumented: bool = False,
+    query_cache: bool = False,
+    fuzzy_index: bool = False,
+    autocomplete: bool = False,
+    change_log: bool = False,
+    price_changes: bool = False,
+):
+    results = {}
+    for size in sizes:
+        build_start = time.perf_counter_ns()
+        inventory = build_inventory(
+            size,
+            Inventory(
+                name_index=name_index,
+                query_cache=QueryCache() if query_cache else None,
+                fuzzy_index=fuzzy_index,
+                autocomplete=autocomplete,
+                change_log=ChangeLog() if change_log else None,
+                price_changes=PriceChangeIndex() if price_changes else None,
+            ),
+        )
+        build_ns = time.perf_counter_ns() - build_start
+        if instrumented:
+            inventory.enable_instrumentation()
+        print(f"\n{size} products, built in {build_ns / 1e9:.2f} s")
+        print(f"{'Operation':<42} {'p50 us':>10} {'p90 us':>10} {'p99 us':>10}")
+
+        results[str(size)] = {"build_ns": build_ns, "operations": {}}
+        rng = random.Random(size)
+        for name, setup, run in inventory_operations(
+            inventory, size, rng, fuzzy_index
+        ):
+            if only and name not in only:
+                continue
+            stats = measure(run, setup, repeat, warmup)
+            results[str(size)]["operations"][name] = stats
+            print(
+                f"{name:<42} {stats['p50_ns'] / 1e3:>10.1f} "
+                f"{stats['p90_ns'] / 1e3:>10.1f} {stats['p99_ns'] / 1e3:>10.1f}"
+            )
+        if inventory.query_cache is not None:
+            results[str(size)]["query_cache"] = inventory.query_cache.stats()
+            print("Query cache:", inventory.query_cache.stats())
+        del inventory
+        gc.collect()
+    return results
+
+
+# Compare the median latency of two operations result files
+# Returns the operations that got slower by more than threshold times
+def compare_results(old_path: str, new_path: str, threshold: float):
+    with open(old_path, encoding="utf-8") as file:
+        old = json.load(file)["results"]
+    with open(new_path, encoding="utf-8") as file:
+        new = json.load(file)["results"]
+
+    regressions = []
+    print(f"{'Size':>10} {'Operation':<42} {'Old p50 us':>11} {'New p50 us':>11} {'Ratio':>7}")
+    for size, result in new.items():
+        if size not in old:
+            continue
+        for name, stats in result["operations"].items():
+            old_stats = old[size]["operations"].get(name)
+            if old_stats is None:
+                continue
+            ratio = stats["p50_ns"] / max(old_stats["p50_ns"], 1)
+            flag = "  <- slower" if ratio > threshold else ""
+            print(
+                f"{size:>10} {name:<42} {old_stats['p50_ns'] / 1e3:>11.1f} "
+                f"{stats['p50_ns'] / 1e3:>11.1f} {ratio:>7.2f}{flag}"
+            )
+            if ratio > threshold:
+                regressions.append((size, name, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inventory benchmarks")
+    benchmarks = parser.add_subparsers(dest="benchmark", required=True)
+
+    memory = benchmarks.add_parser("memory", help="bytes used per product")
+    memory.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10**4, 10**5, 10**6, 10**7],
+        help="catalog sizes to measure",
+    )
+    memory.add_argument(
+        "--store",
+        choices=["inventory", "columnar"],
+        default="inventory",
+        help="measure Inventory or the NumPy ColumnarInventory",
+    )
+    memory.add_argument(
+        "--name-index",
+        action="store_true",
+        help="include the trigram name indexes of Inventory",
+    )
+    memory.add_argument(
+        "--fuzzy-index",
+        action="store_true",
+        help="include the typo tolerant name index of Inventory",
+    )
+    memory.add_argument(
+        "--autocomplete",
+        action="store_true",
+        help="include the name prefix indexes of Inventory",
+    )
+    memory.add_argument(
+        "--versioned",
+        action="store_true",
+        help="include the snapshot versions of Inventory",
+    )
+    memory.add_argument("--output", help="write the results to this JSON file")
+
+    threads = benchmarks.add_parser(
+        "threads", help="reserve and restock throughput across threads"
+    )
+    threads.add_argument(
+        "--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32]
+    )
+    threads.add_argument("--size", type=int, default=10**5, help="catalog size")
+    threads.add_argument(
+        "--operations", type=int, default=10**5, help="orders per thread count"
+    )
+    threads.add_argument(
+        "--lock-stripes", type=int, default=64, help="1 means one global lock"
+    )
+    threads.add_argument("--output", help="write the results to this JSON file")
+
+    snapshots = benchmarks.add_parser(
+        "snapshots", help="snapshot scans per second while changes continue"
+    )
+    snapshots.add_argument("--readers", type=int, nargs="+", default=[1, 2, 4, 8])
+    snapshots.add_argument("--size", type=int, default=10**5, help="catalog size")
+    snapshots.add_argument(
+        "--duration", type=float, default=5.0, help="seconds per reader count"
+    )
+    snapshots.add_argument("--output", help="write the results to this JSON file")
+
+    reconcile = benchmarks.add_parser(
+        "reconcile", help="applying a full count feed per row vs reconcile_counts"
+    )
+    reconcile.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10**4, 10**5, 10**6],
+        help="catalog sizes to measure",
+    )
+    reconcile.add_argument(
+        "--variance",
+        type=float,
+        default=0.05,
+        help="share of the products counted with a different quantity",
+    )
+    reconcile.add_argument(
+        "--store",
+        choices=["inventory", "columnar"],
+        default="inventory",
+        help="measure Inventory or the NumPy ColumnarInventory",
+    )
+    reconcile.add_argument("--output", help="write the results to this JSON file")
+
+    holds = benchmarks.add_parser(
+        "holds", help="placing, reading and expiring stock holds"
+    )
+    holds.add_argument(
+        "--holds",
+        type=int,
+        nargs="+",
+        default=[10**4, 10**5, 10**6],
+        help="outstanding holds to measure",
+    )
+    holds.add_argument("--size", type=int, default=10**4, help="catalog size")
+    holds.add_argument("--output", help="write the results to this JSON file")
+
+    catalog = benchmarks.add_parser(
+        "catalog", help="building an Inventory vs mapping an exported catalog"
+    )
+    catalog.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10**4, 10**5, 10**6],
+        help="catalog sizes to measure",
+    )
+    catalog.add_argument(
+        "--workers", type=int, default=4, help="processes opening the catalog"
+    )
+    catalog.add_argument("--output", help="write the results to this JSON file")
+
+    service = benchmarks.add_parser(
+        "service", help="requests per second and tail latency of the service"
+    )
+    service.add_argument("--size", type=int, default=10**5, help="catalog size")
+    service.add_argument(
+        "--connections", type=int, default=16, help="client connections"
+    )
+    service.add_argument(
+        "--depth", type=int, default=8, help="requests on the way per connection"
+    )
+    service.add_argument(
+        "--duration", type=float, default=10.0, help="seconds of load per setup"
+    )
+    service.add_argument(
+        "--batch-window",
+        type=float,
+        default=0.001,
+        help="seconds quantity changes are collected for",
+    )
+    service.add_argument("--output", help="write the results to this JSON file")
+
+    shards = benchmarks.add_parser(
+        "shards", help="throughput of ShardedInventory for every worker count"
+    )
+    shards.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[0, 1, 2, 4, 8],
+        help="worker process counts, 0 is a plain Inventory",
+    )
+    shards.add_argument("--size", type=int, default=10**6, help="catalog size")
+    shards.add_argument(
+        "--operations", type=int, default=2000, help="operations of each kind"
+    )
+    shards.add_argument(
+        "--clients", type=int, default=16, help="threads sending requests"
+    )
+    shards.add_argument(
+        "--name-index",
+        action="store_true",
+        help="search names with the trigram indexes",
+    )
+    shards.add_argument("--output", help="write the results to this JSON file")
+
+    operations = benchmarks.add_parser(
+        "operations", help="latency percentiles of every Inventory operation"
+    )
+    operations.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10**3, 10**4, 10**5, 10**6, 10**7],
+        help="catalog sizes to measure",
+    )
+    operations.add_argument("--repeat", type=int, default=200, help="timed samples")
+    operations.add_argument("--warmup", type=int, default=20, help="untimed calls")
+    operations.add_argument(
+        "--name-index",
+        action="store_true",
+        help="search names with the trigram indexes",
+    )
+    operations.add_argument(
+        "--fuzzy-index",
+        action="store_true",
+        help="keep the typo tolerant name index and measure the fuzzy search",
+    )
+    operations.add_argument(
+        "--autocomplete",
+        action="store_true",
+        help="complete name prefixes with the prefix indexes",
+    )
+    operations.add_argument(
+        "--change-log",
+        action="store_true",
+        help="record every change in a ChangeLog to measure its overhead",
+    )
+    operations.add_argument(
+        "--price-changes",
+        action="store_true",
+        help="answer the price change reports from a PriceChangeIndex",
+    )
+    operations.add_argument(
+        "--only", nargs="+", help="only measure these operations"
+    )
+    operations.add_argument(
+        "--instrumented",
+        action="store_true",
+        help="turn on Inventory instrumentation to measure its overhead",
+    )
+    operations.add_argument(
+        "--query-cache",
+        action="store_true",
+        help="answer repeated searches from a QueryCache",
+    )
+    operations.add_argument("--label", help="version label stored in the results")
+    operations.add_argument("--output", help="write the results to this JSON file")
+
+    compare = benchmarks.add_parser(
+        "compare", help="compare two operations result files"
+    )
+    compare.add_argument("old", help="results of the previous version")
+    compare.add_argument("new", help="results of the new version")
+    compare.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="flag operations whose median got this many times slower",
+    )
+
+    args = parser.parse_args()
+    if args.benchmark == "memory":
+        if args.store == "columnar":
+            from columnar_inventory import ColumnarInventory
+
+            make_inventory = ColumnarInventory
+        else:
+            make_inventory = lambda: Inventory(
+                name_index=args.name_index,
+                fuzzy_index=args.fuzzy_index,
+                autocomplete=args.autocomplete,
+                versioned=args.versioned,
+            )
+        results = benchmark_memory(args.sizes, make_inventory)
+    elif args.benchmark == "threads":
+        results = benchmark_threads(
+            args.threads, args.size, args.operations, args.lock_stripes
+        )
+    elif args.benchmark == "snapshots":
+        results = benchmark_snapshots(args.readers, args.size, args.duration)
+    elif args.benchmark == "reconcile":
+        if args.store == "columnar":
+            from columnar_inventory import ColumnarInventory
+
+            results = benchmark_reconcile(
+                args.sizes, args.variance, ColumnarInventory
+            )
+        else:
+            results = benchmark_reconcile(args.sizes, args.variance)
+    elif args.benchmark == "holds":
+        results = benchmark_holds(args.holds, args.size)
+    elif args.benchmark == "catalog":
+        results = benchmark_catalog(args.sizes, args.workers)
+    elif args.benchmark == "service":
+        results = benchmark_service(
+            args.size, args.connections, args.depth, args.duration, args.batch_window
+        )
+    elif args.benchmark == "shards":
+        results = benchmark_shards(
+            args.workers, args.size, args.operations, args.clients, args.name_index
+        )
+    elif args.benchmark == "operations":
+        results = benchmark_operations(
+            args.sizes,
+            args.repeat,
+            args.warmup,
+            args.name_index,
+            args.only,
+            args.instrumented,
+            args.query_cache,
+            args.fuzzy_index,
+            args.autocomplete,
+            args.change_log,
+            args.price_changes,
+        )
+    elif args.benchmark == "compare":
+        regressions = compare_results(args.old, args.new, args.threshold)
+        # A non zero exit code lets a CI job fail on a performance regression
+        sys.exit(1 if regressions else 0)
+
+    if args.output:
+        write_json(args.output, args.benchmark, results, getattr(args, "label", None))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,538 @@
+## *************************************************************** ##
+## MSCS 532 - Algorithms and Data Structures
+## Project Phase 2
+## Inventory Management System - Columnar product store
+## Shrisan kapali - 005032249
+## *************************************************************** ##
+
+## An alternative to Inventory that keeps product fields in NumPy arrays (one array per field)
+## instead of one Python object per product. Filters and totals run as vectorized operations.
+## Requires numpy (pip install -r requirements.txt)
+from collections.abc import Mapping
+import time
+
+import numpy as np
+
+from Project_Phase_2 import (
+    Category,
+    PriceHistory,
+    PriceHistoryPolicy,
+    ReconciliationResult,
+)
+
+
+# Defining class StringTable
+# Every distinct string is stored once and referenced by its position
+# Descriptions like "Per piece" repeat a lot, so this keeps only one copy of them
+class StringTable:
+    # Constructor to initialize an empty table
+    def __init__(self):
+        self.strings = []
+        self._positions = {}
+
+    # Return the position of the string, adding it to the table when new
+    def intern(self, value: str) -> int:
+        position = self._positions.get(value)
+        if position is None:
+            position = len(self.strings)
+            self.strings.append(value)
+            self._positions[value] = position
+        return position
+
+    # Return the positions of every string for which the match function is true
+    def find(self, match) -> np.ndarray:
+        return np.fromiter(
+            (position for position, value in enumerate(self.strings) if match(value)),
+            dtype=np.int32,
+        )
+
+
+# Defining class ProductView
+# A thin view over one row of the columnar store that behaves like a Product
+# It holds no data itself, every attribute is read from the store arrays
+class ProductView:
+    __slots__ = ("_store", "_row")
+
+    # Constructor to initialize the view over a row
+    def __init__(self, store, row: int):
+        self._store = store
+        self._row = row
+
+    @property
+    def product_id(self) -> int:
+        return int(self._store._ids[self._row])
+
+    @property
+    def name(self) -> str:
+        return self._store._strings.strings[self._store._names[self._row]]
+
+    @property
+    def price(self) -> float:
+        return float(self._store._prices[self._row])
+
+    @property
+    def description(self) -> str:
+        return self._store._strings.strings[self._store._descriptions[self._row]]
+
+    @property
+    def category(self) -> Category:
+        store = self._store
+        return store._category_objects[int(store._category_positions[self._row])]
+
+    @property
+    def quantity(self) -> int:
+        return int(self._store._quantities[self._row])
+
+    @property
+    def price_history(self):
+        return list(self._store._row_price_history(self._row))
+
+    # Price of the product at the passed in epoch seconds
+    def price_at(self, timestamp: float):
+        return self._store._row_price_history(self._row).price_at(timestamp)
+
+    # Price changes between start and end epoch seconds (both inclusive)
+    def price_history_between(self, start: float, end: float):
+        return self._store._row_price_history(self._row).between(start, end)
+
+    # A function to update product information, same arguments as Product.update
+    def update(
+        self,
+        name: str = None,
+        price: float = None,
+        description: str = None,
+        category: Category = None,
+        quantity: int = None,
+    ):
+        self._store._update_row(self._row, name, price, description, category, quantity)
+
+    # A function to increase quantity
+    def increaseQuantity(self, increaseBy: int):
+        self._store._quantities[self._row] += increaseBy
+
+    # A function to decrease quantity
+    def decreaseQuantity(self, increaseBy: int):
+        self._store._quantities[self._row] -= increaseBy
+
+    # Two views are equal when they look at the same row of the same store
+    def __eq__(self, other):
+        return (
+            isinstance(other, ProductView)
+            and self._store is other._store
+            and self._row == other._row
+        )
+
+    def __hash__(self):
+        return hash((id(self._store), self._row))
+
+    # A function to print the product, same layout as Product
+    def __repr__(self):
+        return f"Product Id: {self.product_id}, Product Price: {self.price}, Product Name: {self.name}, Description: {self.description}, Quantity: {self.quantity}, Category:{self.category.name}"
+
+
+# Defining class ProductTable
+# Read only mapping of product id to ProductView, so code written against
+# Inventory.products (e.g. inventory.products[1]) keeps working
+class ProductTable(Mapping):
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, product_id: int) -> ProductView:
+        return ProductView(self._store, self._store._rows[product_id])
+
+    def __contains__(self, product_id) -> bool:
+        return product_id in self._store._rows
+
+    def __iter__(self):
+        return iter(self._store._rows)
+
+    def __len__(self) -> int:
+        return len(self._store._rows)
+
+
+# Defining class ColumnarInventory
+# Same operations as Inventory, but products are stored column by column:
+# ids, prices, quantities and category positions in NumPy arrays, names and
+# descriptions as positions in a string table. Arrays grow by doubling like a
+# Python list. A row points to its category by the position of the category in
+# the list of every category ever added, so a category added again with the id
+# of a deleted one doesn't get the rows of the deleted one, same as Inventory.
+class ColumnarInventory:
+    # Starting size of the arrays
+    INITIAL_CAPACITY = 1024
+
+    # Intialize the store with empty categories and empty columns
+    # Pass a PriceHistoryPolicy to limit how much price history every product keeps
+    def __init__(self, price_history_policy: PriceHistoryPolicy = None):
+        self.categories = {}
+        self.price_history_policy = price_history_policy
+        # Every category ever added, so rows of a deleted category can still show it
+        self._category_objects = []
+        # Position in _category_objects of every category not deleted, by id
+        self._category_position = {}
+        self.products = ProductTable(self)
+
+        self._size = 0
+        self._rows = {}  # product id -> row in the arrays
+        self._strings = StringTable()
+        self._ids = np.empty(self.INITIAL_CAPACITY, dtype=np.int64)
+        self._prices = np.empty(self.INITIAL_CAPACITY, dtype=np.float64)
+        self._quantities = np.empty(self.INITIAL_CAPACITY, dtype=np.int64)
+        self._category_positions = np.empty(self.INITIAL_CAPACITY, dtype=np.int64)
+        self._names = np.empty(self.INITIAL_CAPACITY, dtype=np.int32)
+        self._descriptions = np.empty(self.INITIAL_CAPACITY, dtype=np.int32)
+        self._added_at = np.empty(self.INITIAL_CAPACITY, dtype=np.float64)
+        # Price history is only kept for products whose price changed
+        self._price_history = {}
+
+    # Build a columnar copy of an existing Inventory
+    @classmethod
+    def from_inventory(cls, inventory):
+        store = cls()
+        for category in inventory.categories.values():
+            store.add_new_category(category.category_id, category.name, category.status)
+        for product in inventory.products.values():
+            store.add_product(
+                product.product_id,
+                product.name,
+                product.price,
+                product.description,
+                product.category.category_id,
+                product.quantity,
+            )
+        return store
+
+    ## ******************************************** ##
+    # Category Management
+    ## ******************************************** ##
+
+    # Add new category
+    def add_new_category(self, category_id: int, name: str, status: bool = True):
+        if category_id in self.categories:
+            raise ValueError("Category Id must be unique. This id already exists")
+
+        category = Category(category_id, name, status)
+        self.categories[category_id] = category
+        self._category_position[category_id] = len(self._category_objects)
+        self._category_objects.append(category)
+
+    # Update Category name or status
+    def update_category(self, cagetory_id: int, name: str = None, status: bool = None):
+        if cagetory_id not in self.categories:
+            raise ValueError(
+                "Unable to find the category for this passed in cateogry id"
+            )
+
+        self.categories[cagetory_id].update(name, status)
+
+    # Delete existing category
+    def delete_category(self, cagetory_id: int):
+        if cagetory_id not in self.categories:
+            raise ValueError(
+                "Unable to find the category for this passed in cateogry id"
+            )
+
+        del self.categories[cagetory_id]
+        del self._category_position[cagetory_id]
+
+    # A function to search category by name
+    def search_category_by_name(self, name: str):
+        return [
+            category
+            for category in self.categories.values()
+            if name.lower() in category.name.lower()
+        ]
+
+    ## ******************************************** ##
+    # Product Management
+    ## ******************************************** ##
+
+    # Double the size of every column
+    def _grow(self):
+        for column in (
+            "_ids",
+            "_prices",
+            "_quantities",
+            "_category_positions",
+            "_names",
+            "_descriptions",
+            "_added_at",
+        ):
+            old = getattr(self, column)
+            new = np.empty(len(old) * 2, dtype=old.dtype)
+            new[: self._size] = old[: self._size]
+            setattr(self, column, new)
+
+    # Add in a new product
+    def add_product(
+        self,
+        product_id: int,
+        name: str,
+        price: float,
+        description: str,
+        category_id: int,
+        quantity: int,
+    ):
+        if product_id in self._rows:
+            raise ValueError("Product with the same id already exists.")
+        if category_id not in self.categories:
+            raise ValueError("Passed in category id is invalid")
+
+        if self._size == len(self._ids):
+            self._grow()
+
+        row = self._size
+        self._ids[row] = product_id
+        self._prices[row] = price
+        self._quantities[row] = quantity
+        self._category_positions[row] = self._category_position[category_id]
+        self._names[row] = self._strings.intern(name)
+        self._descriptions[row] = self._strings.intern(description)
+        self._added_at[row] = time.time()
+        self._rows[product_id] = row
+        self._size += 1
+
+    # Change the fields of one row, same rules as Product.update
+    def _update_row(self, row, name, price, description, category, quantity):
+        if name:
+            self._names[row] = self._strings.intern(name)
+        if price is not None and price != self._prices[row]:
+            history = self._row_price_history(row)
+            self._price_history[int(self._ids[row])] = history
+            history.append(time.time(), price)
+            self._prices[row] = price
+            if self.price_history_policy is not None:
+                self.price_history_policy.apply(history, time.time())
+        if description:
+            self._descriptions[row] = self._strings.intern(description)
+        if category:
+            self._category_positions[row] = self._category_position[
+                category.category_id
+            ]
+        if quantity is not None:
+            self._quantities[row] = quantity
+
+    # PriceHistory of a row, the first entry is the price the product was added with
+    def _row_price_history(self, row: int) -> PriceHistory:
+        history = self._price_history.get(int(self._ids[row]))
+        if history is None:
+            history = PriceHistory(float(self._added_at[row]), float(self._prices[row]))
+        return history
+
+    # Update the existing product details
+    def update_product(
+        self,
+        product_id: int,
+        name: str = None,
+        price: float = None,
+        description: str = None,
+        category_id: int = None,
+        quantity: int = None,
+    ):
+        if product_id not in self._rows:
+            raise ValueError("Unable to find product using the passed in id")
+
+        # Unknown category ids keep the current category, same as Inventory
+        category = self.categories.get(category_id) if category_id else None
+        self._update_row(
+            self._rows[product_id], name, price, description, category, quantity
+        )
+
+    # Increase product quantity by quantity
+    def increase_product_quantity(self, product_id: int, quantity: int):
+        if product_id not in self._rows:
+            raise ValueError("Unable to find the product using passed in id")
+
+        self._quantities[self._rows[product_id]] += quantity
+
+    # Decrease product quantity by quantity
+    # Raise error instead of letting the quantity go below zero
+    def decrease_product_quantity(self, product_id: int, quantity: int):
+        if product_id not in self._rows:
+            raise ValueError("Unable to find the product using passed in id")
+
+        row = self._rows[product_id]
+        if self._quantities[row] < quantity:
+            raise ValueError("Not enough quantity in stock for this product")
+        self._quantities[row] -= quantity
+
+    # View product price history
+    def get_product_price_history(self, product_id: int):
+        if product_id not in self._rows:
+            raise ValueError("Unable to find the product using passed in id")
+
+        return list(self._row_price_history(self._rows[product_id]))
+
+    # Price of the product at the passed in epoch seconds, e.g. the time of an order
+    # None if the product was not added yet at that time
+    def price_at(self, product_id: int, timestamp: float):
+        if product_id not in self._rows:
+            raise ValueError("Unable to find the product using passed in id")
+
+        return self._row_price_history(self._rows[product_id]).price_at(timestamp)
+
+    # Price changes of the product between start and end epoch seconds (both inclusive)
+    def price_history_between(self, product_id: int, start: float, end: float):
+        if product_id not in self._rows:
+            raise ValueError("Unable to find the product using passed in id")
+
+        return self._row_price_history(self._rows[product_id]).between(start, end)
+
+    ## ******************************************** ##
+    # Stock Reconciliation
+    ## ******************************************** ##
+
+    # Set the stock to the quantities counted in a warehouse, same rows, checks
+    # and result as Inventory.reconcile_counts. The feed is read into arrays once,
+    # then the rows of the products are found by binary search over the sorted
+    # ids and the variances computed and the counts set for the whole feed with
+    # array operations
+    def reconcile_counts(self, rows) -> ReconciliationResult:
+        result = ReconciliationResult()
+        feed = list(rows)
+        try:
+            product_ids = [int(row["id"]) for row in feed]
+            counts = [int(row["quantity"]) for row in feed]
+            parsed = np.ones(len(feed), dtype=bool)
+        except (KeyError, TypeError, ValueError, AttributeError):
+            product_ids, counts, parsed = self._parse_counts(feed, result)
+
+        ids = np.array(product_ids, dtype=np.int64)
+        counted = np.array(counts, dtype=np.int64)
+        order = np.argsort(self._ids[: self._size], kind="stable")
+        sorted_ids = self._ids[: self._size][order]
+        found = np.searchsorted(sorted_ids, ids)
+        known = found < self._size
+        known[known] = sorted_ids[found[known]] == ids[known]
+        valid = known & parsed & (counted >= 0)
+        # Only the first count of a product is applied
+        first = np.zeros(len(ids), dtype=bool)
+        valid_positions = np.flatnonzero(valid)
+        _, first_valid = np.unique(ids[valid_positions], return_index=True)
+        first[valid_positions[first_valid]] = True
+
+        for position in np.flatnonzero(parsed & ~first).tolist():
+            if not known[position]:
+                message = "Unable to find the product using passed in id"
+            elif counted[position] < 0:
+                message = "Counted quantity can not be negative"
+            else:
+                message = "Product was already counted in this feed"
+            result.errors.append((position + 1, feed[position], message))
+        result.errors.sort(key=lambda error: error[0])
+
+        targets = order[found[first]]
+        new_quantities = counted[first]
+        old_quantities = self._quantities[targets]
+        self._quantities[targets] = new_quantities
+        result.counted = len(targets)
+
+        changed = old_quantities != new_quantities
+        changed_rows = targets[changed]
+        differences = new_quantities[changed] - old_quantities[changed]
+        result.variances = list(
+            zip(
+                self._ids[changed_rows].tolist(),
+                old_quantities[changed].tolist(),
+                new_quantities[changed].tolist(),
+            )
+        )
+        result.units_found = int(differences[differences > 0].sum())
+        result.units_missing = int(-differences[differences < 0].sum())
+        result.value_difference = float(
+            np.dot(self._prices[changed_rows], differences)
+        )
+        return result
+
+    # Read the ids and counts of a feed with invalid rows one row at a time,
+    # an invalid row is reported and left out by the returned mask
+    def _parse_counts(self, feed: list, result: ReconciliationResult):
+        product_ids, counts = [], []
+        parsed = np.ones(len(feed), dtype=bool)
+        for position, row in enumerate(feed):
+            try:
+                product_id = int(row["id"])
+                counted = int(row["quantity"])
+            except (KeyError, TypeError, ValueError, AttributeError) as error:
+                result.errors.append((position + 1, row, f"Invalid row: {error!r}"))
+                product_id, counted = 0, 0
+                parsed[position] = False
+            product_ids.append(product_id)
+            counts.append(counted)
+        return product_ids, counts, parsed
+
+    ## ******************************************** ##
+    # Vectorized searches and totals
+    ## ******************************************** ##
+
+    # Turn an array of row numbers in a list of product views
+    def _views(self, rows: np.ndarray):
+        return [ProductView(self, row) for row in rows.tolist()]
+
+    # Search product by name, each distinct name is checked only once
+    def search_product_by_name(self, name: str):
+        name = name.lower()
+        matches = self._strings.find(lambda value: name in value.lower())
+        rows = np.flatnonzero(np.isin(self._names[: self._size], matches))
+        return self._views(rows)
+
+    # Search product by price range, results are ordered by price
+    # Leave min_price or max_price as None to search an open ended range
+    def search_product_by_price_range(
+        self, min_price: float = None, max_price: float = None
+    ):
+        prices = self._prices[: self._size]
+        mask = np.ones(self._size, dtype=bool)
+        if min_price is not None:
+            mask &= prices >= min_price
+        if max_price is not None:
+            mask &= prices <= max_price
+        rows = np.flatnonzero(mask)
+        return self._views(rows[np.argsort(prices[rows], kind="stable")])
+
+    # Search product by category id
+    def search_product_by_category_id(self, category_id: int):
+        # Products of a deleted category are not returned, same as Inventory
+        position = self._category_position.get(category_id)
+        if position is None:
+            return []
+        return self._views(
+            np.flatnonzero(self._category_positions[: self._size] == position)
+        )
+
+    # Search product by category name
+    def search_product_by_category_name(self, name: str):
+        positions = [
+            self._category_position[category.category_id]
+            for category in self.search_category_by_name(name)
+        ]
+        return self._views(
+            np.flatnonzero(np.isin(self._category_positions[: self._size], positions))
+        )
+
+    # Search product with quantity at or below the passed in quantity
+    def search_product_by_low_quantity(self, max_quantity: int):
+        return self._views(np.flatnonzero(self._quantities[: self._size] <= max_quantity))
+
+    # Total units in stock
+    def total_quantity(self) -> int:
+        return int(self._quantities[: self._size].sum())
+
+    # Total stock value, sum of price x quantity
+    def total_stock_value(self) -> float:
+        return float(
+            np.dot(self._prices[: self._size], self._quantities[: self._size])
+        )
+
+    # Stock value of every category, keyed by category id
+    def stock_value_by_category(self):
+        positions = self._category_positions[: self._size]
+        values = self._prices[: self._size] * self._quantities[: self._size]
+        return {
+            category_id: float(values[positions == position].sum())
+            for category_id, position in self._category_position.items()
+        }
+
+    # Finally a function to print the store, same layout as Inventory
+    def __repr__(self):
+        return f"Inventory Details \nCategories:{list(self.categories.values())}, \n\nProducts:{list(self.products.values())})"
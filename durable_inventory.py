@@ -0,0 +1,590 @@
+## *************************************************************** ##
+## MSCS 532 - Algorithms and Data Structures
+## Project Phase 2
+## Inventory Management System - Durable inventory
+## Shrisan kapali - 005032249
+## *************************************************************** ##
+
+## An Inventory that survives restarts. Every change is appended to a log file
+## (write ahead log) and the whole inventory is written to a compact binary
+## snapshot from time to time. On start the latest snapshot is loaded and only
+## the log written after it is replayed, so restart time depends on the log tail.
+from array import array
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+from Project_Phase_2 import Category, Inventory, PriceHistory, Product
+
+# Every log record is (payload length, crc32 of payload) followed by the payload
+LOG_HEADER = struct.Struct("<II")
+
+# Snapshot layout: header, then the categories, the products and the reorder thresholds
+SNAPSHOT_MAGIC = b"INVSNAP2"
+SNAPSHOT_HEADER = struct.Struct("<8sQQQ")  # magic, lsn, categories, products
+SNAPSHOT_CATEGORY = struct.Struct("<qBI")  # id, flags, name length
+# id, price, created at, quantity, category position, name length,
+# description length, price history length
+SNAPSHOT_PRODUCT = struct.Struct("<qddqqIII")
+# After the products: the number of reorder thresholds, then (product id, threshold)
+# of each, which is the end of the snapshot
+SNAPSHOT_COUNT = struct.Struct("<Q")
+SNAPSHOT_THRESHOLD = struct.Struct("<qq")
+CATEGORY_ACTIVE = 1
+CATEGORY_DELETED = 2  # still referenced by products, but no longer in categories
+
+
+# Force the directory entry of a renamed or new file to disk
+def fsync_directory(directory: str):
+    # Directories can't be opened on Windows, renames there are already durable
+    if os.name == "nt":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# Defining class DurableInventory
+# Same operations as Inventory, every change is also written to the log
+# Log records are written in groups (group commit): they are flushed and fsynced
+# once group_size records are waiting or flush_interval seconds have passed,
+# so at most the last uncommitted group is lost on a crash. A flusher thread
+# commits records still waiting after flush_interval when no change follows
+# them. Call commit() to force the waiting records to disk.
+# With snapshot_every set, a snapshot is taken after that many changes.
+# Changes are applied and logged under one write lock so the log order is the
+# order the changes were made in.
+class DurableInventory(Inventory):
+    # Constructor to open (or create) the inventory stored in directory
+    def __init__(
+        self,
+        directory: str,
+        name_index: bool = False,
+        price_history_policy=None,
+        group_size: int = 128,
+        flush_interval: float = 0.05,
+        snapshot_every: int = None,
+        query_cache=None,
+        fuzzy_index: bool = False,
+        autocomplete: bool = False,
+        change_log=None,
+        versioned: bool = False,
+        price_changes=None,
+    ):
+        super().__init__(
+            name_index,
+            price_history_policy,
+            query_cache=query_cache,
+            fuzzy_index=fuzzy_index,
+            autocomplete=autocomplete,
+            change_log=change_log,
+            versioned=versioned,
+            price_changes=price_changes,
+        )
+        # Reentrant because the bulk loads call the logged single operations
+        # The same lock as the change lock of a versioned inventory, so a change
+        # and a write batch can't each hold one and wait for the other
+        self._write_lock = self._change_lock
+        self.directory = directory
+        self.group_size = group_size
+        self.flush_interval = flush_interval
+        self.snapshot_every = snapshot_every
+
+        self._lsn = 0  # sequence number of the last logged change
+        self._pending = []
+        self._last_commit = time.monotonic()
+        self._changes_since_snapshot = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+        self._log_file = open(self._log_path(self._lsn + 1), "ab")
+
+        # Commits the waiting records once flush_interval passed, also when no
+        # later change comes to do it
+        self._closed = False
+        self._records_waiting = threading.Condition(self._write_lock)
+        self._flusher = threading.Thread(
+            target=self._flush_waiting, name="inventory-log-flusher", daemon=True
+        )
+        self._flusher.start()
+
+    ## ******************************************** ##
+    # Logged operations
+    ## ******************************************** ##
+
+    # Add new category
+    def add_new_category(self, category_id: int, name: str, status: bool = True):
+        with self._write_lock:
+            super().add_new_category(category_id, name, status)
+            self._log("add_category", [category_id, name, status])
+            self._maybe_snapshot()
+
+    # Update Category name or status
+    def update_category(self, cagetory_id: int, name: str = None, status: bool = None):
+        with self._write_lock:
+            super().update_category(cagetory_id, name, status)
+            self._log("update_category", [cagetory_id, name, status])
+            self._maybe_snapshot()
+
+    # Delete existing category
+    def delete_category(self, cagetory_id: int):
+        with self._write_lock:
+            super().delete_category(cagetory_id)
+            self._log("delete_category", [cagetory_id])
+            self._maybe_snapshot()
+
+    # Add in a new product
+    def add_product(
+        self,
+        product_id: int,
+        name: str,
+        price: float,
+        description: str,
+        category_id: int,
+        quantity: int,
+    ):
+        with self._write_lock:
+            super().add_product(
+                product_id, name, price, description, category_id, quantity
+            )
+            self._log_added_product(self.products[product_id])
+            self._maybe_snapshot()
+
+    # Add many products at once, see Inventory.add_products_bulk
+    def add_products_bulk(self, rows, batch_size: int = 10000):
+        with self._write_lock:
+            result = super().add_products_bulk(rows, batch_size)
+            self._maybe_snapshot()
+        return result
+
+    # Products added by add_products_bulk are logged one record per product
+    def _add_product_batch(self, batch, result):
+        added = super()._add_product_batch(batch, result)
+        for product in added:
+            self._log_added_product(product)
+        return added
+
+    # Update the existing product details
+    def update_product(
+        self,
+        product_id: int,
+        name: str = None,
+        price: float = None,
+        description: str = None,
+        category_id: int = None,
+        quantity: int = None,
+        timestamp: float = None,
+    ):
+        # Log the time of the change so a replay records the same price history
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._write_lock:
+            super().update_product(
+                product_id, name, price, description, category_id, quantity, timestamp
+            )
+            self._log(
+                "update_product",
+                [product_id, name, price, description, category_id, quantity],
+                timestamp,
+            )
+            self._maybe_snapshot()
+
+    # Increase product quantity by quantity
+    def increase_product_quantity(self, product_id: int, quantity: int):
+        with self._write_lock:
+            super().increase_product_quantity(product_id, quantity)
+            self._log("increase_quantity", [product_id, quantity])
+            self._maybe_snapshot()
+
+    # Decrease product quantity by quantity
+    def decrease_product_quantity(self, product_id: int, quantity: int):
+        with self._write_lock:
+            super().decrease_product_quantity(product_id, quantity)
+            self._log("decrease_quantity", [product_id, quantity])
+            self._maybe_snapshot()
+
+    # Take stock of several products at once, see Inventory.reserve
+    def reserve(self, items):
+        items = list(items)
+        with self._write_lock:
+            super().reserve(items)
+            self._log("reserve", [items])
+            self._maybe_snapshot()
+
+    # Change the stock of several products, see Inventory.change_quantities
+    # Only the changes made are logged, so replaying them can't fail
+    def change_quantities(self, changes):
+        changes = list(changes)
+        with self._write_lock:
+            outcomes = super().change_quantities(changes)
+            made = [
+                change for change, outcome in zip(changes, outcomes) if outcome is None
+            ]
+            if made:
+                self._log("change_quantities", [made])
+                self._maybe_snapshot()
+        return outcomes
+
+    # Take the stock of a hold, logged like the reserve it amounts to
+    # Holds themselves are not logged, a restart gives their stock back
+    def commit_hold(self, hold_id):
+        with self._write_lock:
+            items = super().commit_hold(hold_id)
+            self._log("reserve", [items])
+            self._maybe_snapshot()
+        return items
+
+    # Set the stock to warehouse counts, see Inventory.reconcile_counts
+    # Only the counts that changed a quantity are logged, as one record
+    def reconcile_counts(self, rows):
+        with self._write_lock:
+            result = super().reconcile_counts(rows)
+            if result.variances:
+                counts = [
+                    [product_id, counted] for product_id, _, counted in result.variances
+                ]
+                self._log("reconcile_counts", [counts])
+                self._maybe_snapshot()
+        return result
+
+    # Set or clear the reorder threshold of a product
+    def set_reorder_threshold(self, product_id: int, threshold: int):
+        with self._write_lock:
+            super().set_reorder_threshold(product_id, threshold)
+            self._log("set_reorder_threshold", [product_id, threshold])
+            self._maybe_snapshot()
+
+    ## ******************************************** ##
+    # Write ahead log
+    ## ******************************************** ##
+
+    # Path of the log file whose first record has the passed in sequence number
+    def _log_path(self, first_lsn: int) -> str:
+        return os.path.join(self.directory, f"log-{first_lsn:020d}.wal")
+
+    # Path of the snapshot holding every change up to the passed in sequence number
+    def _snapshot_path(self, lsn: int) -> str:
+        return os.path.join(self.directory, f"snapshot-{lsn:020d}.bin")
+
+    # Sorted (sequence number, path) of the files starting with prefix
+    def _files(self, prefix: str):
+        files = []
+        for file_name in os.listdir(self.directory):
+            if file_name.startswith(prefix) and not file_name.endswith(".tmp"):
+                lsn = int(file_name[len(prefix) :].split(".")[0])
+                files.append((lsn, os.path.join(self.directory, file_name)))
+        return sorted(files)
+
+    # Log the add of a product, including the time it was added
+    def _log_added_product(self, product: Product):
+        self._log(
+            "add_product",
+            [
+                product.product_id,
+                product.name,
+                product.price,
+                product.description,
+                product.category.category_id,
+                product.quantity,
+            ],
+            product.created_at,
+        )
+
+    # Queue a log record and commit the group when it is full or old enough
+    def _log(self, operation: str, arguments: list, timestamp: float = None):
+        self._lsn += 1
+        payload = json.dumps(
+            [self._lsn, timestamp, operation, arguments], separators=(",", ":")
+        ).encode("utf-8")
+        self._pending.append(LOG_HEADER.pack(len(payload), zlib.crc32(payload)))
+        self._pending.append(payload)
+        # The first record waiting, wake the flusher to time its commit
+        if len(self._pending) == 2:
+            self._records_waiting.notify()
+
+        if (
+            len(self._pending) >= 2 * self.group_size
+            or time.monotonic() - self._last_commit >= self.flush_interval
+        ):
+            self.commit()
+
+        self._changes_since_snapshot += 1
+
+    # Take a snapshot once snapshot_every changes were logged since the last one
+    # Only called between operations, so a snapshot never holds half of an operation
+    def _maybe_snapshot(self):
+        if self.snapshot_every and self._changes_since_snapshot >= self.snapshot_every:
+            self.snapshot()
+
+    # Runs in the flusher thread until close, waiting releases the write lock
+    def _flush_waiting(self):
+        with self._write_lock:
+            while not self._closed:
+                if not self._pending:
+                    self._records_waiting.wait()
+                    continue
+                remaining = self._last_commit + self.flush_interval - time.monotonic()
+                if remaining > 0:
+                    self._records_waiting.wait(remaining)
+                else:
+                    self.commit()
+
+    # Write the waiting log records and force them to disk
+    def commit(self):
+        with self._write_lock:
+            if self._pending:
+                self._log_file.write(b"".join(self._pending))
+                self._log_file.flush()
+                os.fsync(self._log_file.fileno())
+                self._pending = []
+            self._last_commit = time.monotonic()
+
+    # Apply one log record without logging it again
+    def _apply(self, timestamp: float, operation: str, arguments: list):
+        if operation == "add_category":
+            super().add_new_category(*arguments)
+        elif operation == "update_category":
+            super().update_category(*arguments)
+        elif operation == "delete_category":
+            super().delete_category(*arguments)
+        elif operation == "add_product":
+            super().add_product(*arguments)
+            self.products[arguments[0]].created_at = timestamp
+        elif operation == "update_product":
+            super().update_product(*arguments, timestamp=timestamp)
+        elif operation == "increase_quantity":
+            super().increase_product_quantity(*arguments)
+        elif operation == "decrease_quantity":
+            super().decrease_product_quantity(*arguments)
+        elif operation == "reserve":
+            super().reserve(*arguments)
+        elif operation == "change_quantities":
+            super().change_quantities(*arguments)
+        elif operation == "reconcile_counts":
+            super().reconcile_counts(
+                {"id": product_id, "quantity": counted}
+                for product_id, counted in arguments[0]
+            )
+        elif operation == "set_reorder_threshold":
+            super().set_reorder_threshold(*arguments)
+        else:
+            raise ValueError(f"Unknown log operation {operation}")
+
+    # Replay the records of one log file newer than the loaded snapshot
+    # Returns the length of the valid part of the file, a torn write at the
+    # end of the file (crash in the middle of a commit) stops the replay
+    def _replay_log(self, path: str) -> int:
+        with open(path, "rb") as file:
+            data = file.read()
+
+        offset = 0
+        while offset + LOG_HEADER.size <= len(data):
+            length, crc = LOG_HEADER.unpack_from(data, offset)
+            start = offset + LOG_HEADER.size
+            payload = data[start : start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+
+            lsn, timestamp, operation, arguments = json.loads(payload)
+            if lsn > self._lsn:
+                self._apply(timestamp, operation, arguments)
+                self._lsn = lsn
+            offset = start + length
+        return offset
+
+    # Load the latest snapshot and replay the log written after it
+    def _recover(self):
+        snapshots = self._files("snapshot-")
+        if snapshots:
+            self._load_snapshot(snapshots[-1][1])
+
+        logs = self._files("log-")
+        for position, (_, path) in enumerate(logs):
+            valid_length = self._replay_log(path)
+            if valid_length < os.path.getsize(path):
+                if position != len(logs) - 1:
+                    raise ValueError(f"Log file {path} is corrupt")
+                # Drop the torn write so new records follow the last valid one
+                with open(path, "r+b") as file:
+                    file.truncate(valid_length)
+
+    ## ******************************************** ##
+    # Snapshots
+    ## ******************************************** ##
+
+    # Write the whole inventory to a new snapshot and start a new log file
+    # Older snapshots and log files are removed once the snapshot is on disk
+    def snapshot(self):
+        with self._write_lock:
+            self.commit()
+            path = self._snapshot_path(self._lsn)
+            with open(path + ".tmp", "wb") as file:
+                self._write_snapshot(file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(path + ".tmp", path)
+            fsync_directory(self.directory)
+
+            self._log_file.close()
+            self._log_file = open(self._log_path(self._lsn + 1), "ab")
+            for lsn, old_path in self._files("snapshot-"):
+                if lsn < self._lsn:
+                    os.remove(old_path)
+            for lsn, old_path in self._files("log-"):
+                if lsn <= self._lsn:
+                    os.remove(old_path)
+            self._changes_since_snapshot = 0
+
+    # Write the categories and products in the snapshot layout
+    def _write_snapshot(self, file):
+        # Deleted categories are kept when products still point to them
+        # Position of every category in the snapshot, keyed by the category object
+        positions = {id(category): None for category in self.categories.values()}
+        categories = list(self.categories.values())
+        for product in self.products.values():
+            if id(product.category) not in positions:
+                positions[id(product.category)] = None
+                categories.append(product.category)
+        for position, category in enumerate(categories):
+            positions[id(category)] = position
+
+        file.write(
+            SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC, self._lsn, len(categories), len(self.products)
+            )
+        )
+        for category in categories:
+            flags = CATEGORY_ACTIVE if category.status else 0
+            if self.categories.get(category.category_id) is not category:
+                flags |= CATEGORY_DELETED
+            name = category.name.encode("utf-8")
+            file.write(SNAPSHOT_CATEGORY.pack(category.category_id, flags, len(name)))
+            file.write(name)
+
+        for product in self.products.values():
+            name = product.name.encode("utf-8")
+            description = product.description.encode("utf-8")
+            history = product._price_history
+            file.write(
+                SNAPSHOT_PRODUCT.pack(
+                    product.product_id,
+                    product.price,
+                    product.created_at,
+                    product.quantity,
+                    positions[id(product.category)],
+                    len(name),
+                    len(description),
+                    0 if history is None else len(history),
+                )
+            )
+            file.write(name)
+            file.write(description)
+            if history is not None:
+                file.write(history.timestamps.tobytes())
+                file.write(history.prices.tobytes())
+
+        file.write(SNAPSHOT_COUNT.pack(len(self._reorder_thresholds)))
+        for product_id, threshold in self._reorder_thresholds.items():
+            file.write(SNAPSHOT_THRESHOLD.pack(product_id, threshold))
+
+    # Read a snapshot written by snapshot() and rebuild the indexes once
+    def _load_snapshot(self, path: str):
+        with open(path, "rb") as file:
+            data = file.read()
+        try:
+            self._read_snapshot(path, data)
+        except struct.error:
+            raise ValueError(f"{path} is cut short") from None
+
+    # Load the categories, products and reorder thresholds of the snapshot data
+    def _read_snapshot(self, path: str, data: bytes):
+        magic, lsn, category_count, product_count = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not an inventory snapshot")
+        offset = SNAPSHOT_HEADER.size
+
+        # Categories by position, products point to them with it so a deleted
+        # category and a new one with the same id stay apart
+        categories = {}
+        for position in range(category_count):
+            category_id, flags, name_length = SNAPSHOT_CATEGORY.unpack_from(data, offset)
+            offset += SNAPSHOT_CATEGORY.size
+            name = data[offset : offset + name_length].decode("utf-8")
+            offset += name_length
+            if flags & CATEGORY_DELETED:
+                categories[position] = Category(
+                    category_id, name, bool(flags & CATEGORY_ACTIVE)
+                )
+            else:
+                super().add_new_category(
+                    category_id, name, bool(flags & CATEGORY_ACTIVE)
+                )
+                categories[position] = self.categories[category_id]
+
+        products = []
+        for _ in range(product_count):
+            (
+                product_id,
+                price,
+                created_at,
+                quantity,
+                category_position,
+                name_length,
+                description_length,
+                history_length,
+            ) = SNAPSHOT_PRODUCT.unpack_from(data, offset)
+            offset += SNAPSHOT_PRODUCT.size
+            name = data[offset : offset + name_length].decode("utf-8")
+            offset += name_length
+            description = data[offset : offset + description_length].decode("utf-8")
+            offset += description_length
+
+            product = Product(
+                product_id,
+                name,
+                price,
+                description,
+                categories[category_position],
+                quantity,
+            )
+            product.created_at = created_at
+            if history_length:
+                timestamps, prices = array("d"), array("d")
+                timestamps.frombytes(data[offset : offset + 8 * history_length])
+                offset += 8 * history_length
+                prices.frombytes(data[offset : offset + 8 * history_length])
+                offset += 8 * history_length
+                product._price_history = PriceHistory.from_arrays(timestamps, prices)
+            self.products[product_id] = product
+            products.append(product)
+
+        self._index_new_products(products)
+
+        (threshold_count,) = SNAPSHOT_COUNT.unpack_from(data, offset)
+        offset += SNAPSHOT_COUNT.size
+        for _ in range(threshold_count):
+            product_id, threshold = SNAPSHOT_THRESHOLD.unpack_from(data, offset)
+            offset += SNAPSHOT_THRESHOLD.size
+            super().set_reorder_threshold(product_id, threshold)
+        if offset != len(data):
+            raise ValueError(f"{path} has data after its reorder thresholds")
+        self._lsn = lsn
+
+    # Commit the waiting records and close the log file
+    def close(self):
+        with self._write_lock:
+            self._closed = True
+            self._records_waiting.notify()
+        self._flusher.join()
+        self.commit()
+        self._log_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
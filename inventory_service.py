@@ -0,0 +1,415 @@
+## *************************************************************** ##
+## MSCS 532 - Algorithms and Data Structures
+## Project Phase 2
+## Inventory Management System - Inventory service
+## Shrisan kapali - 005032249
+## *************************************************************** ##
+
+## Serve an Inventory to other programs over a local TCP connection with asyncio.
+## Every request and response is one line of JSON, and a client can send many
+## requests on one connection without waiting for the answers (pipelining).
+##   {"id": 1, "method": "search_product_by_name", "params": {"name": "milk"}}
+##   {"id": 1, "ok": true, "result": [...]}  or  {"id": 1, "ok": false, "error": "..."}
+## Answers carry the id of their request and are sent as soon as they are ready,
+## so a slow search doesn't hold back the answers after it. Requests sent without
+## waiting run in any order: wait for the answer to a change before reading it back.
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import json
+
+from Project_Phase_2 import (
+    Category,
+    PriceChange,
+    Product,
+    ReconciliationResult,
+    StockHold,
+)
+
+# Searches and lookups. Identical ones asked while one is running share its result
+READ_METHODS = frozenset(
+    {
+        "get_product",
+        "is_category_id_unique",
+        "is_product_id_unique",
+        "search_category_by_name",
+        "search_product_by_name",
+        "search_product_by_name_fuzzy",
+        "autocomplete_product_name",
+        "autocomplete_category_name",
+        "search_product_by_price_range",
+        "search_product_by_min_price",
+        "search_product_by_max_price",
+        "search_product_by_category_id",
+        "search_product_by_category_name",
+        "get_category_stats",
+        "get_all_category_stats",
+        "get_product_price_history",
+        "price_at",
+        "price_history_between",
+        "price_changes_between",
+        "largest_price_changes",
+        "price_change_rollup",
+        "get_reorder_threshold",
+        "get_hold",
+        "available_quantity",
+        "held_quantity",
+        "lowest_stock",
+        "below_threshold",
+    }
+)
+# Changes, made one at a time in the order they arrive
+WRITE_METHODS = frozenset(
+    {
+        "add_new_category",
+        "update_category",
+        "delete_category",
+        "add_product",
+        "update_product",
+        "reserve",
+        "reconcile_counts",
+        "hold_stock",
+        "release_hold",
+        "commit_hold",
+        "extend_hold",
+        "set_reorder_threshold",
+    }
+)
+# Quantity changes are collected and made together, with the sign of the change
+QUANTITY_METHODS = {"increase_product_quantity": 1, "decrease_product_quantity": -1}
+
+
+# A product as a dict with the keys of the bulk load rows
+def product_row(product: Product) -> dict:
+    return {
+        "id": product.product_id,
+        "name": product.name,
+        "price": product.price,
+        "description": product.description,
+        "category": product.category.category_id,
+        "quantity": product.quantity,
+    }
+
+
+# Turn the result of an Inventory method into values JSON can write
+def to_json(value):
+    if isinstance(value, Category):
+        return {"id": value.category_id, "name": value.name, "status": value.status}
+    if isinstance(value, Product):
+        return product_row(value)
+    if isinstance(value, PriceChange):
+        return {
+            "timestamp": value.timestamp,
+            "product_id": value.product_id,
+            "old_price": value.old_price,
+            "new_price": value.new_price,
+            "category_id": value.category_id,
+        }
+    if isinstance(value, ReconciliationResult):
+        return {
+            "counted": value.counted,
+            "variances": to_json(value.variances),
+            "units_found": value.units_found,
+            "units_missing": value.units_missing,
+            "value_difference": value.value_difference,
+            "errors": [[row_number, message] for row_number, _, message in value.errors],
+        }
+    if isinstance(value, StockHold):
+        # Items as [product_id, quantity] pairs like hold_stock takes them, JSON
+        # object keys would turn the product ids into strings
+        return {
+            "hold_id": value.hold_id,
+            "items": [
+                [product_id, quantity] for product_id, quantity in value.items.items()
+            ],
+            "expires_at": value.expires_at,
+        }
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    return value
+
+
+# Defining class InventoryService
+# Serves one Inventory (or DurableInventory) on host and port, port 0 picks a free one
+# The inventory is only used from one thread, so the event loop never waits for
+# it and no two calls run at the same time. Three things keep that thread busy
+# with useful work only:
+# - identical reads asked while one of them runs are answered by that one run
+#   (coalesce_reads), a read asked after a change finished always runs again
+# - increase and decrease quantity requests are collected for batch_window seconds
+#   (or until max_batch of them) and made with one Inventory.change_quantities call,
+#   which takes the stock locks once for all of them
+# - results are turned into JSON once, in that thread, and shared by every reader
+class InventoryService:
+    # Constructor to initialize the service, start() opens the port
+    def __init__(
+        self,
+        inventory,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        batch_window: float = 0.001,
+        max_batch: int = 1024,
+        coalesce_reads: bool = True,
+        max_pipeline: int = 256,
+    ):
+        self.inventory = inventory
+        self.host = host
+        self.port = port
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.coalesce_reads = coalesce_reads
+        # Requests of one connection being answered at once, reading the
+        # connection waits when there are more
+        self.max_pipeline = max_pipeline
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="inventory")
+        self._server = None
+        self._reads = {}  # (method, params) -> future of the running read
+        self._batch = []  # (product_id, difference, future) waiting to be made
+        self._flush_handle = None
+        self.stats = {
+            "requests": 0,
+            "errors": 0,
+            "coalesced_reads": 0,
+            "quantity_batches": 0,
+            "batched_changes": 0,
+        }
+
+    # Open the port and start accepting connections, returns the port
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(
+            self._serve_connection, self.host, self.port, limit=2**24
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    # Serve until the task is cancelled
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        await self._server.serve_forever()
+
+    # Stop accepting connections and make the quantity changes still waiting
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        waiting = [future for _, _, future in self._batch]
+        self._flush()
+        if waiting:
+            await asyncio.gather(*waiting, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    # Read requests of one connection and answer each one when it is ready
+    async def _serve_connection(self, reader, writer):
+        room = asyncio.Semaphore(self.max_pipeline)
+        answering = set()
+        try:
+            while line := await reader.readline():
+                await room.acquire()
+                task = asyncio.ensure_future(self._answer(line, writer))
+                answering.add(task)
+                task.add_done_callback(answering.discard)
+                task.add_done_callback(lambda _: room.release())
+            if answering:
+                await asyncio.gather(*answering)
+        # A line longer than the limit is a ValueError
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    # Answer one request line, the result is already JSON text
+    async def _answer(self, line: bytes, writer):
+        self.stats["requests"] += 1
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            params = request.get("params") or {}
+            result = await self._dispatch(request["method"], params)
+            answer = '{"id": %s, "ok": true, "result": %s}' % (
+                json.dumps(request_id),
+                result,
+            )
+        # Any error of the inventory is answered, so the client never waits for nothing
+        except Exception as error:
+            self.stats["errors"] += 1
+            message = str(error) if isinstance(error, ValueError) else repr(error)
+            answer = json.dumps({"id": request_id, "ok": False, "error": message})
+        if writer.is_closing():
+            return
+        writer.write(answer.encode("utf-8") + b"\n")
+        await writer.drain()
+
+    # Run the method the way its kind needs, returns the result as JSON text
+    async def _dispatch(self, method: str, params: dict) -> str:
+        if method in QUANTITY_METHODS:
+            return await self._change_quantity(method, params)
+        if method in READ_METHODS:
+            return await self._read(method, params)
+        if method in WRITE_METHODS:
+            result = await self._run(method, params)
+            # Reads asked from now on must see this change
+            self._reads.clear()
+            return result
+        if method == "service_stats":
+            return json.dumps(self.stats)
+        raise ValueError(f"Unknown method {method}")
+
+    # Call the inventory method in the inventory thread
+    def _run(self, method: str, params: dict):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, self._call, method, params)
+
+    # Runs in the inventory thread
+    def _call(self, method: str, params: dict) -> str:
+        if method == "get_product":
+            product = self.inventory.products.get(params["product_id"])
+            if product is None:
+                raise ValueError("Unable to find the product using passed in id")
+            return json.dumps(product_row(product))
+        return json.dumps(to_json(getattr(self.inventory, method)(**params)))
+
+    # Share the running read with the same method and params, or start one
+    async def _read(self, method: str, params: dict) -> str:
+        if not self.coalesce_reads:
+            return await self._run(method, params)
+        key = (method, json.dumps(params, sort_keys=True))
+        running = self._reads.get(key)
+        if running is not None:
+            self.stats["coalesced_reads"] += 1
+            return await asyncio.shield(running)
+        running = asyncio.ensure_future(self._run(method, params))
+        self._reads[key] = running
+
+        # A read started after a change finished may have replaced this one
+        def forget(_):
+            if self._reads.get(key) is running:
+                del self._reads[key]
+
+        running.add_done_callback(forget)
+        return await asyncio.shield(running)
+
+    # Wait for the next batch of quantity changes to be made
+    async def _change_quantity(self, method: str, params: dict) -> str:
+        quantity = params["quantity"]
+        # Checked before joining the batch, a bad quantity only fails its request
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 0:
+            raise ValueError("Quantity must be a whole number of 0 or more")
+        difference = QUANTITY_METHODS[method] * quantity
+        future = asyncio.get_running_loop().create_future()
+        self._batch.append((params["product_id"], difference, future))
+        if len(self._batch) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self.batch_window, self._flush
+            )
+        await future
+        return "null"
+
+    # Make the waiting quantity changes with one call
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        self.stats["quantity_batches"] += 1
+        self.stats["batched_changes"] += len(batch)
+        changes = [(product_id, difference) for product_id, difference, _ in batch]
+        done = asyncio.get_running_loop().run_in_executor(
+            self._executor, self.inventory.change_quantities, changes
+        )
+        done.add_done_callback(lambda done: self._finish_batch(batch, done))
+
+    # Answer every change of the batch with its own outcome
+    def _finish_batch(self, batch, done):
+        self._reads.clear()
+        error = done.exception()
+        outcomes = [None] * len(batch) if error is not None else done.result()
+        for (_, _, future), outcome in zip(batch, outcomes):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            elif outcome is not None:
+                future.set_exception(ValueError(outcome))
+            else:
+                future.set_result(None)
+
+
+# Defining class InventoryClient
+# Connection to an InventoryService. Calls from many tasks share the connection,
+# each request is sent right away and its answer is matched by id
+# e.g. products = await client.call("search_product_by_name", name="milk")
+class InventoryClient:
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._ids = itertools.count(1)
+        self._waiting = {}  # request id -> future of the answer
+        self._receiver = asyncio.ensure_future(self._receive())
+
+    # Open a connection to the service on host and port
+    @classmethod
+    async def connect(cls, host: str = "127.0.0.1", port: int = 8765):
+        reader, writer = await asyncio.open_connection(host, port, limit=2**24)
+        return cls(reader, writer)
+
+    # Call an Inventory method by name with keyword arguments, returns its result
+    # Products come back as dicts with the keys of the bulk load rows
+    # Raise ValueError with the service's message when the call failed
+    async def call(self, method: str, **params):
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[request_id] = future
+        request = {"id": request_id, "method": method, "params": params}
+        self._writer.write(json.dumps(request).encode("utf-8") + b"\n")
+        await self._writer.drain()
+        return await future
+
+    # Hand every answer to the call waiting for it
+    async def _receive(self):
+        try:
+            while line := await self._reader.readline():
+                answer = json.loads(line)
+                future = self._waiting.pop(answer["id"], None)
+                if future is None or future.done():
+                    continue
+                if answer["ok"]:
+                    future.set_result(answer["result"])
+                else:
+                    future.set_exception(ValueError(answer["error"]))
+        finally:
+            for future in self._waiting.values():
+                if not future.done():
+                    future.set_exception(
+                        ConnectionError("Connection to the inventory service closed")
+                    )
+            self._waiting.clear()
+
+    async def close(self):
+        self._writer.close()
+        await self._receiver
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+# Serve the inventory until the process is stopped
+def run_service(inventory, host: str = "127.0.0.1", port: int = 8765):
+    asyncio.run(InventoryService(inventory, host, port).serve_forever())
@@ -0,0 +1,462 @@
+## *************************************************************** ##
+## MSCS 532 - Algorithms and Data Structures
+## Project Phase 2
+## Inventory Management System - Memory mapped catalog
+## Shrisan kapali - 005032249
+## *************************************************************** ##
+
+## A read only copy of the catalog that many worker processes share. export_catalog
+## writes the products, categories and the price index to one binary file of fixed
+## size columns and a string table. MappedInventory maps that file into memory and
+## answers lookups and searches straight from the mapped pages, so opening it only
+## reads the header and the categories, and every process mapping the same file
+## shares one copy of it in the operating system's page cache.
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Mapping
+import mmap
+import os
+import struct
+import sys
+
+from Project_Phase_2 import Category
+
+# Catalog layout: header, one (offset, length) entry per section, then the sections
+# Every section starts at a multiple of 8 bytes, columns are in the byte order of
+# the machine that exported the catalog, which is stored in the header
+CATALOG_MAGIC = b"INVCAT01"
+CATALOG_HEADER = struct.Struct("<8s8sQQ")  # magic, byte order, categories, products
+CATALOG_SECTION = struct.Struct("<QQ")  # offset, length in bytes
+# Sections in file order with the array type code of their items, None for bytes
+# Products are in rows, in the order the inventory has them
+CATALOG_SECTIONS = (
+    ("ids", "q"),  # product id of every row
+    ("prices", "d"),
+    ("quantities", "q"),
+    ("category_positions", "q"),  # position of the category of every row
+    ("names", "q"),  # string number of the name of every row
+    ("descriptions", "q"),  # string number of the description of every row
+    ("sorted_ids", "q"),  # product ids in ascending order
+    ("id_rows", "q"),  # rows in the order of sorted_ids
+    ("price_rows", "q"),  # rows ordered by price and then id, the price index
+    ("category_starts", "q"),  # where the rows of each category begin in category_rows
+    ("category_rows", "q"),  # rows of every category one category after the other
+    ("string_offsets", "q"),  # where each string begins in strings, and the end
+    ("strings", None),  # every distinct string once, UTF-8
+    ("folded_offsets", "q"),  # where the name of each row begins in folded_names
+    ("folded_names", None),  # lowercase names of the rows, each followed by a 0 byte
+    ("categories", "q"),  # (id, flags, string number of the name) of every category
+)
+CATEGORY_ACTIVE = 1
+CATEGORY_DELETED = 2  # still referenced by products, but no longer in categories
+
+
+# Write the catalog of an Inventory (or a DurableInventory) to path
+# The file is written next to path and renamed over it, so a worker opening path
+# gets either the old catalog or the new one. Workers keep reading the catalog
+# they opened until they open it again
+def export_catalog(inventory, path: str):
+    products = list(inventory.products.values())
+    # Deleted categories are kept when products still point to them
+    # Position of every category in the catalog, keyed by the category object
+    positions = {id(category): None for category in inventory.categories.values()}
+    categories = list(inventory.categories.values())
+    for product in products:
+        if id(product.category) not in positions:
+            positions[id(product.category)] = None
+            categories.append(product.category)
+    for position, category in enumerate(categories):
+        positions[id(category)] = position
+
+    # Every distinct string is stored once, descriptions like "Per piece" repeat a lot
+    numbers = {}
+    strings = bytearray()
+    string_offsets = array("q")
+
+    def intern(value: str) -> int:
+        number = numbers.get(value)
+        if number is None:
+            number = numbers[value] = len(string_offsets)
+            string_offsets.append(len(strings))
+            strings.extend(value.encode("utf-8"))
+        return number
+
+    columns = {
+        "ids": array("q", (product.product_id for product in products)),
+        "prices": array("d", (product.price for product in products)),
+        "quantities": array("q", (product.quantity for product in products)),
+        "category_positions": array(
+            "q", (positions[id(product.category)] for product in products)
+        ),
+        "names": array("q", (intern(product.name) for product in products)),
+        "descriptions": array(
+            "q", (intern(product.description) for product in products)
+        ),
+    }
+    ids = columns["ids"]
+    prices = columns["prices"]
+    id_rows = sorted(range(len(products)), key=ids.__getitem__)
+    columns["sorted_ids"] = array("q", (ids[row] for row in id_rows))
+    columns["id_rows"] = array("q", id_rows)
+    columns["price_rows"] = array(
+        "q", sorted(range(len(products)), key=lambda row: (prices[row], ids[row]))
+    )
+
+    # Products of a deleted category stay out of the category searches, like
+    # they do after Inventory.delete_category
+    buckets = [[] for _ in categories]
+    for row, product in enumerate(products):
+        if inventory.categories.get(product.category.category_id) is product.category:
+            buckets[positions[id(product.category)]].append(row)
+    columns["category_starts"] = array("q", [0])
+    columns["category_rows"] = array("q")
+    for bucket in buckets:
+        columns["category_rows"].extend(bucket)
+        columns["category_starts"].append(len(columns["category_rows"]))
+
+    category_records = array("q")
+    for category in categories:
+        flags = CATEGORY_ACTIVE if category.status else 0
+        if inventory.categories.get(category.category_id) is not category:
+            flags |= CATEGORY_DELETED
+        category_records.extend((category.category_id, flags, intern(category.name)))
+    columns["categories"] = category_records
+    string_offsets.append(len(strings))
+    columns["string_offsets"] = string_offsets
+    columns["strings"] = strings
+
+    # Searching lowercase names joined in one block is a single scan of the pages
+    folded = bytearray()
+    folded_offsets = array("q")
+    for product in products:
+        folded_offsets.append(len(folded))
+        folded.extend(product.name.lower().encode("utf-8"))
+        folded.append(0)
+    folded_offsets.append(len(folded))
+    columns["folded_offsets"] = folded_offsets
+    columns["folded_names"] = folded
+
+    offset = CATALOG_HEADER.size + CATALOG_SECTION.size * len(CATALOG_SECTIONS)
+    table = []
+    for name, _ in CATALOG_SECTIONS:
+        offset += -offset % 8
+        length = len(columns[name]) * getattr(columns[name], "itemsize", 1)
+        table.append((offset, length))
+        offset += length
+
+    with open(path + ".tmp", "wb") as file:
+        file.write(
+            CATALOG_HEADER.pack(
+                CATALOG_MAGIC,
+                sys.byteorder.encode("ascii"),
+                len(categories),
+                len(products),
+            )
+        )
+        for section in table:
+            file.write(CATALOG_SECTION.pack(*section))
+        for (name, _), (offset, _) in zip(CATALOG_SECTIONS, table):
+            file.write(b"\0" * (offset - file.tell()))
+            file.write(columns[name])
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".tmp", path)
+
+
+# Defining class MappedProduct
+# A view over one row of a MappedInventory that behaves like a read only Product
+# It holds no data itself, every attribute is read from the mapped file
+class MappedProduct:
+    __slots__ = ("_catalog", "_row")
+
+    # Constructor to initialize the view over a row
+    def __init__(self, catalog, row: int):
+        self._catalog = catalog
+        self._row = row
+
+    @property
+    def product_id(self) -> int:
+        return self._catalog._ids[self._row]
+
+    @property
+    def name(self) -> str:
+        return self._catalog._string(self._catalog._names[self._row])
+
+    @property
+    def price(self) -> float:
+        return self._catalog._prices[self._row]
+
+    @property
+    def description(self) -> str:
+        return self._catalog._string(self._catalog._descriptions[self._row])
+
+    @property
+    def category(self) -> Category:
+        return self._catalog._category_objects[
+            self._catalog._category_positions[self._row]
+        ]
+
+    @property
+    def quantity(self) -> int:
+        return self._catalog._quantities[self._row]
+
+    # Two views are equal when they look at the same row of the same catalog
+    def __eq__(self, other):
+        return (
+            isinstance(other, MappedProduct)
+            and self._catalog is other._catalog
+            and self._row == other._row
+        )
+
+    def __hash__(self):
+        return hash((id(self._catalog), self._row))
+
+    # A function to print the product, same layout as Product
+    def __repr__(self):
+        return f"Product Id: {self.product_id}, Product Price: {self.price}, Product Name: {self.name}, Description: {self.description}, Quantity: {self.quantity}, Category:{self.category.name}"
+
+
+# Defining class MappedProductTable
+# Read only mapping of product id to MappedProduct, so code written against
+# Inventory.products (e.g. inventory.products[1]) keeps working
+class MappedProductTable(Mapping):
+    def __init__(self, catalog):
+        self._catalog = catalog
+
+    def __getitem__(self, product_id: int) -> MappedProduct:
+        row = self._catalog._row_of(product_id)
+        if row is None:
+            raise KeyError(product_id)
+        return MappedProduct(self._catalog, row)
+
+    def __contains__(self, product_id) -> bool:
+        return self._catalog._row_of(product_id) is not None
+
+    # Product ids in the order of the inventory that exported the catalog
+    def __iter__(self):
+        return iter(self._catalog._ids)
+
+    def __len__(self) -> int:
+        return len(self._catalog._ids)
+
+
+# Defining class MappedInventory
+# Same searches as Inventory over a catalog written by export_catalog, read
+# straight from the mapped file. It can't be changed: export the catalog again
+# and open a new MappedInventory to see changes
+class MappedInventory:
+    # Constructor to map the catalog file, only the categories are read here
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, byteorder, category_count, product_count = CATALOG_HEADER.unpack_from(
+            self._map
+        )
+        if magic != CATALOG_MAGIC:
+            self._map.close()
+            raise ValueError("File is not an inventory catalog")
+        if byteorder.rstrip(b"\0").decode("ascii") != sys.byteorder:
+            self._map.close()
+            raise ValueError(
+                "Catalog was exported on a machine with another byte order"
+            )
+
+        # Every column is a memoryview over the mapped pages, nothing is copied
+        self._views = []
+        pages = memoryview(self._map)
+        self._views.append(pages)
+        for number, (name, type_code) in enumerate(CATALOG_SECTIONS):
+            offset, length = CATALOG_SECTION.unpack_from(
+                self._map, CATALOG_HEADER.size + number * CATALOG_SECTION.size
+            )
+            if offset + length > len(self._map):
+                self.close()
+                raise ValueError(
+                    "Catalog file is damaged, a section ends past the file"
+                )
+            if type_code is not None and length % array(type_code).itemsize:
+                self.close()
+                raise ValueError(
+                    "Catalog file is damaged, a column ends inside an item"
+                )
+            view = pages[offset : offset + length]
+            if type_code is not None:
+                view = view.cast(type_code)
+            self._views.append(view)
+            setattr(self, "_" + name, view)
+            if type_code is None:
+                setattr(self, f"_{name}_start", offset)
+                setattr(self, f"_{name}_end", offset + length)
+
+        # A catalog cut short or damaged has columns shorter than the header says
+        row_columns = (
+            self._ids,
+            self._prices,
+            self._quantities,
+            self._category_positions,
+            self._names,
+            self._descriptions,
+            self._sorted_ids,
+            self._id_rows,
+            self._price_rows,
+        )
+        # Offset tables have one more item than what they index, the end of the
+        # last one, which is the length of the bytes they point into. The header
+        # has no string count, the strings are as many as their offsets less one
+        offset_tables = (
+            (self._category_starts, category_count, len(self._category_rows)),
+            (self._folded_offsets, product_count, len(self._folded_names)),
+            (
+                self._string_offsets,
+                max(len(self._string_offsets) - 1, 0),
+                len(self._strings),
+            ),
+        )
+        if (
+            any(len(column) != product_count for column in row_columns)
+            or len(self._categories) != 3 * category_count
+            or any(
+                len(offsets) != count + 1 or offsets[0] != 0 or offsets[-1] != end
+                for offsets, count, end in offset_tables
+            )
+        ):
+            self.close()
+            raise ValueError(
+                "Catalog file is damaged, its columns don't match its header"
+            )
+
+        # Every category ever referenced by position, and the live ones by id
+        self._category_objects = []
+        self.categories = {}
+        self._category_positions_by_id = {}
+        for position in range(category_count):
+            category_id, flags, name = self._categories[3 * position : 3 * position + 3]
+            category = Category(
+                category_id, self._string(name), bool(flags & CATEGORY_ACTIVE)
+            )
+            self._category_objects.append(category)
+            if not flags & CATEGORY_DELETED:
+                self.categories[category_id] = category
+                self._category_positions_by_id[category_id] = position
+        self.products = MappedProductTable(self)
+
+    # The string with the passed in number, decoded from the string table
+    # Offsets are checked when read, not all of them when the catalog is opened
+    def _string(self, number: int) -> str:
+        if not 0 <= number < len(self._string_offsets) - 1:
+            raise ValueError("Catalog file is damaged, a string is out of bounds")
+        start = self._strings_start + self._string_offsets[number]
+        end = self._strings_start + self._string_offsets[number + 1]
+        if not self._strings_start <= start <= end <= self._strings_end:
+            raise ValueError("Catalog file is damaged, a string is out of bounds")
+        return self._map[start:end].decode("utf-8")
+
+    # Row of the product id found by binary search, None when there is none
+    def _row_of(self, product_id):
+        if type(product_id) is not int:
+            return None
+        ids = self._sorted_ids
+        position = bisect_left(ids, product_id)
+        if position < len(ids) and ids[position] == product_id:
+            return self._id_rows[position]
+        return None
+
+    # Turn row numbers in a list of product views
+    def _products(self, rows):
+        return [MappedProduct(self, row) for row in rows]
+
+    # Check if category id is unique
+    def is_category_id_unique(self, category_id: int) -> bool:
+        return category_id not in self.categories
+
+    # Also check if product id is unique
+    def is_product_id_unique(self, product_id: int) -> bool:
+        return product_id not in self.products
+
+    # A function to search category by name
+    def search_category_by_name(self, name: str):
+        return [
+            category
+            for category in self.categories.values()
+            if name.lower() in category.name.lower()
+        ]
+
+    # Search product by name, one scan of the lowercase names with mmap.find
+    # A match that runs into the next name is skipped
+    def search_product_by_name(self, name: str):
+        text = name.lower().encode("utf-8")
+        start, end = self._folded_names_start, self._folded_names_end
+        offsets = self._folded_offsets
+        rows = []
+        found = self._map.find(text, start, end)
+        # An empty text is also found at the end of the names
+        while found != -1 and found < end:
+            row = bisect_right(offsets, found - start) - 1
+            # The 0 byte after each name is not part of it
+            if found + len(text) < start + offsets[row + 1]:
+                rows.append(row)
+                found = self._map.find(text, start + offsets[row + 1], end)
+            else:
+                found = self._map.find(text, found + 1, end)
+        return self._products(rows)
+
+    # Search product by price range, results are ordered by price
+    # Leave min_price or max_price as None to search an open ended range
+    def search_product_by_price_range(
+        self, min_price: float = None, max_price: float = None
+    ):
+        price_of = self._prices.__getitem__
+        low = (
+            0
+            if min_price is None
+            else bisect_left(self._price_rows, min_price, key=price_of)
+        )
+        high = (
+            len(self._price_rows)
+            if max_price is None
+            else bisect_right(self._price_rows, max_price, key=price_of)
+        )
+        return self._products(self._price_rows[low:high].tolist())
+
+    # Search product costing at least min_price, ordered by price
+    def search_product_by_min_price(self, min_price: float):
+        return self.search_product_by_price_range(min_price=min_price)
+
+    # Search product costing at most max_price, ordered by price
+    def search_product_by_max_price(self, max_price: float):
+        return self.search_product_by_price_range(max_price=max_price)
+
+    # Search product by category id
+    def search_product_by_category_id(self, category_id: int):
+        position = self._category_positions_by_id.get(category_id)
+        if position is None:
+            return []
+        start = self._category_starts[position]
+        end = self._category_starts[position + 1]
+        return self._products(self._category_rows[start:end].tolist())
+
+    # Search product by category name
+    def search_product_by_category_name(self, name: str):
+        return [
+            product
+            for category in self.search_category_by_name(name)
+            for product in self.search_product_by_category_id(category.category_id)
+        ]
+
+    # Unmap the file, products read from this inventory can't be used after it
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Finally a function to print the inventory
+    def __repr__(self):
+        return f"Inventory Details \nCategories:{list(self.categories.values())}, \n\nProducts:{list(self.products.values())})"
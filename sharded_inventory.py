@@ -0,0 +1,497 @@
+## *************************************************************** ##
+## MSCS 532 - Algorithms and Data Structures
+## Project Phase 2
+## Inventory Management System - Sharded inventory
+## Shrisan kapali - 005032249
+## *************************************************************** ##
+
+## An inventory split across worker processes so searches are not limited to the
+## one core the GIL lets a single Inventory use. Every worker process holds an
+## Inventory with a share (shard) of the products, picked by the hash of the
+## product id, and a copy of every category. Changes to one product are sent to
+## the shard that owns it, searches are sent to every shard at once and the
+## results are merged in the order a single Inventory would return them.
+from heapq import merge, nsmallest
+import itertools
+import multiprocessing
+import os
+import threading
+
+from Project_Phase_2 import BulkLoadResult, FuzzyIndex, Inventory
+
+
+# Run an Inventory in a worker process, answering the requests of the connection
+# A request is (function, args, kwargs): a string is the name of an Inventory
+# method, otherwise a function of this module called with the inventory first.
+# The reply is (True, result) or (False, the raised error). None stops the worker.
+def serve_shard(connection, options):
+    inventory = Inventory(**options)
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        function, args, kwargs = request
+        try:
+            if isinstance(function, str):
+                result = getattr(inventory, function)(*args, **kwargs)
+            else:
+                result = function(inventory, *args, **kwargs)
+        except Exception as error:
+            connection.send((False, error))
+        else:
+            connection.send((True, result))
+    connection.close()
+
+
+## ******************************************** ##
+# Functions run inside the shards
+## ******************************************** ##
+
+
+# The product with the passed in id
+def shard_get_product(inventory: Inventory, product_id: int):
+    if product_id not in inventory.products:
+        raise ValueError("Unable to find the product using passed in id")
+    return inventory.products[product_id]
+
+
+# Add numbered product rows, so errors keep the row numbers of the whole load
+def shard_add_product_rows(inventory: Inventory, numbered_rows) -> BulkLoadResult:
+    result = BulkLoadResult()
+    added = inventory._add_product_batch(numbered_rows, result)
+    inventory._index_new_products(added)
+    return result
+
+
+# Put back the quantities of (product_id, quantity) items taken by reserve
+def shard_restock(inventory: Inventory, items):
+    for product_id, quantity in items:
+        inventory.increase_product_quantity(product_id, quantity)
+
+
+# (total edits, product) of the fuzzy search results, so shards can be merged
+def shard_fuzzy_search(inventory: Inventory, name: str, limit: int):
+    fuzzy = FuzzyIndex()
+    searched = [(word, fuzzy.allowed_distance(word)) for word in fuzzy.words(name)]
+    scored = []
+    for product in inventory.search_product_by_name_fuzzy(name, limit):
+        words = fuzzy.words(product.name)
+        total = sum(
+            min(fuzzy.distance(word, other, allowed) for other in words)
+            for word, allowed in searched
+        )
+        scored.append((total, product))
+    return scored
+
+
+# (stock minus reorder threshold, product) of the products to reorder
+def shard_below_threshold(inventory: Inventory):
+    return [
+        (product.quantity - inventory.get_reorder_threshold(product.product_id), product)
+        for product in inventory.below_threshold()
+    ]
+
+
+# (category, product count in the shard) of every category starting with prefix
+def shard_category_completions(inventory: Inventory, prefix: str):
+    counts = inventory.get_all_category_stats()
+    prefix = prefix.casefold()
+    return [
+        (category, counts[category.category_id]["count"])
+        for category in inventory.categories.values()
+        if category.name.casefold().startswith(prefix)
+    ]
+
+
+# Combine the category stats summaries of every shard into one
+def merge_category_stats(summaries):
+    count = sum(summary["count"] for summary in summaries)
+    # Shards without products of the category have no prices
+    priced = [summary for summary in summaries if summary["count"]]
+    return {
+        "count": count,
+        "units": sum(summary["units"] for summary in summaries),
+        "stock_value": sum(summary["stock_value"] for summary in summaries),
+        "min_price": min((summary["min_price"] for summary in priced), default=None),
+        "max_price": max((summary["max_price"] for summary in priced), default=None),
+        "average_price": (
+            sum(summary["average_price"] * summary["count"] for summary in priced)
+            / count
+            if count
+            else None
+        ),
+    }
+
+
+# Defining class ShardedInventory
+# Same operations as Inventory over workers processes (default: one per core)
+# The other keyword options are passed to the Inventory of every shard, e.g.
+# name_index=True. They are sent to the worker processes, so they must be picklable.
+# Products returned are copies sent back by the shards, change them with the methods.
+# query() is not available, filter the results of the search methods instead.
+class ShardedInventory:
+    # Constructor to start the worker processes
+    def __init__(self, workers: int = None, **options):
+        workers = workers or os.cpu_count() or 1
+        self._connections = []
+        self._processes = []
+        # One request at a time goes through the connection of a shard
+        self._locks = [threading.Lock() for _ in range(workers)]
+        for _ in range(workers):
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=serve_shard, args=(worker_connection, options), daemon=True
+            )
+            process.start()
+            worker_connection.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+    # Number of shards
+    @property
+    def workers(self) -> int:
+        return len(self._connections)
+
+    # Shard owning the product id
+    def _shard_of(self, product_id) -> int:
+        return hash(product_id) % len(self._connections)
+
+    # Send a request to one shard and return its result
+    def _call(self, shard: int, function, *args, **kwargs):
+        return self._gather({shard: (function, args, kwargs)})[shard]
+
+    # Send the same request to every shard, results are in shard order
+    def _scatter(self, function, *args, **kwargs):
+        requests = {
+            shard: (function, args, kwargs) for shard in range(len(self._connections))
+        }
+        results = self._gather(requests)
+        return [results[shard] for shard in range(len(self._connections))]
+
+    # Send {shard: (function, args, kwargs)} requests, then wait for every reply,
+    # so the shards work on them at the same time. Returns {shard: result}
+    # Locks are taken in shard order so two requests never wait on each other
+    def _gather(self, requests):
+        shards = sorted(requests)
+        replies = {}
+        for shard in shards:
+            self._locks[shard].acquire()
+        try:
+            for shard in shards:
+                self._connections[shard].send(requests[shard])
+            for shard in shards:
+                replies[shard] = self._connections[shard].recv()
+        finally:
+            for shard in shards:
+                self._locks[shard].release()
+
+        # Every reply is read before raising, so no connection is left out of step
+        for shard in shards:
+            ok, result = replies[shard]
+            if not ok:
+                raise result
+            replies[shard] = result
+        return replies
+
+    # Stop the worker processes
+    def close(self):
+        for shard, connection in enumerate(self._connections):
+            with self._locks[shard]:
+                connection.send(None)
+                connection.close()
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    ## ******************************************** ##
+    # Inventory Category Management
+    ## ******************************************** ##
+
+    # Every shard has the same categories, so those questions go to the first one
+    def is_category_id_unique(self, category_id: int) -> bool:
+        return self._call(0, "is_category_id_unique", category_id)
+
+    # Category changes are made on every shard
+    def add_new_category(self, category_id: int, name: str, status: bool = True):
+        self._scatter("add_new_category", category_id, name, status)
+
+    def update_category(self, cagetory_id: int, name: str = None, status: bool = None):
+        self._scatter("update_category", cagetory_id, name, status)
+
+    def delete_category(self, cagetory_id: int):
+        self._scatter("delete_category", cagetory_id)
+
+    def search_category_by_name(self, name: str):
+        return self._call(0, "search_category_by_name", name)
+
+    # Categories are ranked by their product count summed over every shard
+    def autocomplete_category_name(self, prefix: str, limit: int = 10):
+        categories = {}
+        counts = {}
+        for completions in self._scatter(shard_category_completions, prefix):
+            for category, count in completions:
+                categories[category.category_id] = category
+                counts[category.category_id] = counts.get(category.category_id, 0) + count
+        return nsmallest(
+            limit,
+            categories.values(),
+            key=lambda category: (
+                -counts[category.category_id],
+                category.name.casefold(),
+                category.category_id,
+            ),
+        )
+
+    def get_category_stats(self, category_id: int):
+        return merge_category_stats(self._scatter("get_category_stats", category_id))
+
+    def get_all_category_stats(self):
+        shard_stats = self._scatter("get_all_category_stats")
+        return {
+            category_id: merge_category_stats(
+                [stats[category_id] for stats in shard_stats]
+            )
+            for category_id in shard_stats[0]
+        }
+
+    ## ******************************************** ##
+    # Inventory Product Management
+    ## ******************************************** ##
+
+    def is_product_id_unique(self, product_id: int) -> bool:
+        return self._call(self._shard_of(product_id), "is_product_id_unique", product_id)
+
+    # Read one product, in place of inventory.products[product_id]
+    def get_product(self, product_id: int):
+        return self._call(self._shard_of(product_id), shard_get_product, product_id)
+
+    def add_product(
+        self,
+        product_id: int,
+        name: str,
+        price: float,
+        description: str,
+        category_id: int,
+        quantity: int,
+    ):
+        self._call(
+            self._shard_of(product_id),
+            "add_product",
+            product_id,
+            name,
+            price,
+            description,
+            category_id,
+            quantity,
+        )
+
+    def update_product(
+        self,
+        product_id: int,
+        name: str = None,
+        price: float = None,
+        description: str = None,
+        category_id: int = None,
+        quantity: int = None,
+        timestamp: float = None,
+    ):
+        self._call(
+            self._shard_of(product_id),
+            "update_product",
+            product_id,
+            name,
+            price,
+            description,
+            category_id,
+            quantity,
+            timestamp,
+        )
+
+    def increase_product_quantity(self, product_id: int, quantity: int):
+        self._call(
+            self._shard_of(product_id), "increase_product_quantity", product_id, quantity
+        )
+
+    def decrease_product_quantity(self, product_id: int, quantity: int):
+        self._call(
+            self._shard_of(product_id), "decrease_product_quantity", product_id, quantity
+        )
+
+    # Take stock of several products at once, either every quantity is taken or none
+    # Items of one shard are reserved there at once. Items spread over shards are
+    # reserved shard by shard, and what was taken is put back if a shard is short,
+    # so another caller may see the stock taken for a moment before it is put back
+    def reserve(self, items):
+        by_shard = {}
+        for product_id, quantity in items:
+            by_shard.setdefault(self._shard_of(product_id), []).append(
+                (product_id, quantity)
+            )
+
+        reserved = []
+        try:
+            for shard, shard_items in by_shard.items():
+                self._call(shard, "reserve", shard_items)
+                reserved.append((shard, shard_items))
+        except ValueError:
+            for shard, shard_items in reserved:
+                self._call(shard, shard_restock, shard_items)
+            raise
+
+    def get_product_price_history(self, product_id: int):
+        return self._call(
+            self._shard_of(product_id), "get_product_price_history", product_id
+        )
+
+    def price_at(self, product_id: int, timestamp: float):
+        return self._call(self._shard_of(product_id), "price_at", product_id, timestamp)
+
+    def price_history_between(self, product_id: int, start: float, end: float):
+        return self._call(
+            self._shard_of(product_id), "price_history_between", product_id, start, end
+        )
+
+    ## ******************************************** ##
+    # Inventory Product Searches
+    ## ******************************************** ##
+
+    # Results come shard by shard, like Inventory they are in no particular order
+    def search_product_by_name(self, name: str):
+        return list(itertools.chain(*self._scatter("search_product_by_name", name)))
+
+    # The smallest total number of edits first, then by product id
+    def search_product_by_name_fuzzy(self, name: str, limit: int = 10):
+        scored = itertools.chain(*self._scatter(shard_fuzzy_search, name, limit))
+        return [
+            product
+            for _, product in nsmallest(
+                limit, scored, key=lambda item: (item[0], item[1].product_id)
+            )
+        ]
+
+    # Every shard returns its products ordered by price, which are merged in order
+    def search_product_by_price_range(
+        self, min_price: float = None, max_price: float = None
+    ):
+        return list(
+            merge(
+                *self._scatter("search_product_by_price_range", min_price, max_price),
+                key=lambda product: (product.price, product.product_id),
+            )
+        )
+
+    def search_product_by_min_price(self, min_price: float):
+        return self.search_product_by_price_range(min_price, None)
+
+    def search_product_by_max_price(self, max_price: float):
+        return self.search_product_by_price_range(None, max_price)
+
+    def search_product_by_category_id(self, category_id: int):
+        return list(
+            itertools.chain(*self._scatter("search_product_by_category_id", category_id))
+        )
+
+    def search_product_by_category_name(self, name: str):
+        return list(
+            itertools.chain(*self._scatter("search_product_by_category_name", name))
+        )
+
+    # The most in stock first, then by name
+    def autocomplete_product_name(self, prefix: str, limit: int = 10):
+        return list(
+            itertools.islice(
+                merge(
+                    *self._scatter("autocomplete_product_name", prefix, limit),
+                    key=lambda product: (
+                        -product.quantity,
+                        product.name.casefold(),
+                        product.product_id,
+                    ),
+                ),
+                limit,
+            )
+        )
+
+    ## ******************************************** ##
+    # Inventory Reorder Management
+    ## ******************************************** ##
+
+    def set_reorder_threshold(self, product_id: int, threshold: int):
+        self._call(
+            self._shard_of(product_id), "set_reorder_threshold", product_id, threshold
+        )
+
+    def get_reorder_threshold(self, product_id: int):
+        return self._call(
+            self._shard_of(product_id), "get_reorder_threshold", product_id
+        )
+
+    # The k products with the least stock of every shard, lowest of them first
+    def lowest_stock(self, k: int):
+        return nsmallest(
+            k,
+            itertools.chain(*self._scatter("lowest_stock", k)),
+            key=lambda product: product.quantity,
+        )
+
+    # Products at or below their reorder threshold, the ones furthest below it first
+    def below_threshold(self):
+        urgent = itertools.chain(*self._scatter(shard_below_threshold))
+        return [
+            product
+            for _, product in sorted(
+                urgent, key=lambda item: (item[0], item[1].product_id)
+            )
+        ]
+
+    ## ******************************************** ##
+    # Inventory Bulk Loading
+    ## ******************************************** ##
+
+    # Every shard gets every category, the result is the one of the first shard
+    def add_categories_bulk(self, rows) -> BulkLoadResult:
+        return self._scatter("add_categories_bulk", list(rows))[0]
+
+    # Rows are split by the shard of their id and the shards load batch_size rows
+    # each at the same time. A row whose id can't be read goes to the first shard,
+    # which reports it. Errors keep the row numbers of the whole load.
+    def add_products_bulk(self, rows, batch_size: int = 10000) -> BulkLoadResult:
+        result = BulkLoadResult()
+        batches = {}
+        waiting = 0
+        for row_number, row in enumerate(rows, start=1):
+            try:
+                shard = self._shard_of(int(row["id"]))
+            except (KeyError, TypeError, ValueError, AttributeError):
+                shard = 0
+            batches.setdefault(shard, []).append((row_number, row))
+            waiting += 1
+            if waiting == batch_size * len(self._connections):
+                self._load_batches(batches, result)
+                batches = {}
+                waiting = 0
+        self._load_batches(batches, result)
+        result.errors.sort(key=lambda error: error[0])
+        return result
+
+    # Load {shard: numbered rows} on the shards at the same time
+    def _load_batches(self, batches, result: BulkLoadResult):
+        loaded = self._gather(
+            {
+                shard: (shard_add_product_rows, (numbered_rows,), {})
+                for shard, numbered_rows in batches.items()
+            }
+        )
+        for shard_result in loaded.values():
+            result.loaded += shard_result.loaded
+            result.errors.extend(shard_result.errors)
+
+    def __repr__(self):
+        return f"ShardedInventory with {len(self._connections)} shards"